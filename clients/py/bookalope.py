@@ -3,13 +3,53 @@ The Bookalope module contains a simple object model to make Bookalope's REST API
 more accessible. See http://bookalope.net/
 """
 
+import atexit
 import base64
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import cProfile
+import csv
+import functools
+import hashlib
+import hmac
+import io
+import itertools
 import json
+import multiprocessing
+import os
+import pickle
 import re
 import datetime
+import socket
+import socketserver
+import tarfile
+import pstats
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+import xml.etree.ElementTree
+import zipfile
+import zlib
 import babel
 import requests
 
+try:
+    import PIL.Image
+    import PIL.ImageOps
+except ImportError:  # Pillow is optional, and only needed by the ImageOptimizer.
+    PIL = None
+try:
+    import PIL.ImageCms
+    _IMAGE_CMS = True
+except ImportError:  # Pillow without LittleCMS keeps the ICC profiles of images instead.
+    _IMAGE_CMS = False
+
 def _is_token(token_s):
     """
     Given a string, returns True if the string contains a Bookalope token, or
@@ -23,267 +63,665 @@ def _is_token(token_s):
     return re.match(r"^[0-9a-f]{32}$", token_s or "") is not None
 
 
-class BookalopeError(Exception):
-    """
-    Base class for all Bookalope related errors.
+# The characters of a JSON number token, used to find where a number ends.
+_JSON_NUMBER_RE = re.compile(r"[-+0-9.eE]*")
+
+
+def _iter_json_array(chunks, key):
     """
+    Incrementally parse a JSON document of the form {"key": [...], ...} from an
+    iterable of byte chunks, and yield the elements of the array under the given
+    key one at a time as soon as they have been received. Only a single array
+    element at a time is held in memory, and the remainder of the document after
+    the array is ignored.
 
+    :param chunks: An iterable of bytes objects containing UTF-8 encoded JSON.
+    :param str key: The name of the top-level key whose array is parsed.
 
-class TokenError(BookalopeError):
+    :returns: A generator of the decoded array elements.
+
+    :raises: ValueError if the document is malformed; KeyError if the document
+             does not contain the given key.
     """
-    A TokenError is raised whenever a Bookalope ID or auth token is expected but
-    not provided. See the _is_token() function.
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    state = {"buf": "", "pos": 0, "eof": False}
+
+    def _more():
+        if state["eof"]:
+            raise ValueError("Unexpected end of JSON document")
+        chunk = next(chunks, None)
+        if chunk is None:
+            state["eof"] = True
+            text = utf8.decode(b"", final=True)
+        else:
+            text = utf8.decode(chunk)
+        state["buf"] = state["buf"][state["pos"]:] + text
+        state["pos"] = 0
+
+    def _peek():
+        while True:
+            buf, pos = state["buf"], state["pos"]
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            state["pos"] = pos
+            if pos < len(buf):
+                return buf[pos]
+            _more()
+
+    def _next():
+        char = _peek()
+        state["pos"] += 1
+        return char
+
+    def _value():
+        _peek()
+        while True:
+            # A number that reaches the end of the buffer may continue in the next
+            # chunk, also when it ends with e.g. '.', 'e' or '-' so far.
+            match = _JSON_NUMBER_RE.match(state["buf"], state["pos"])
+            if match.end() > state["pos"] and match.end() == len(state["buf"]) and not state["eof"]:
+                _more()
+                continue
+            try:
+                obj, end = decoder.raw_decode(state["buf"], state["pos"])
+            except json.JSONDecodeError:
+                _more()
+                continue
+            state["pos"] = end
+            return obj
+
+    if _next() != "{":
+        raise ValueError("Expected a JSON object")
+    if _peek() == "}":
+        raise KeyError(key)
+    while True:
+        name = _value()
+        if _next() != ":":
+            raise ValueError("Expected ':' after object key")
+        if name == key and _peek() == "[":
+            _next()
+            if _peek() == "]":
+                return
+            while True:
+                yield _value()
+                char = _next()
+                if char == "]":
+                    return
+                if char != ",":
+                    raise ValueError("Expected ',' or ']' in array")
+        _value()
+        char = _next()
+        if char == "}":
+            raise KeyError(key)
+        if char != ",":
+            raise ValueError("Expected ',' or '}' in object")
+
+
+# Known document formats: the mime type, the file name extensions, and the
+# document type that set_document() passes to the server.
+_DOCUMENT_FORMATS = {
+    "pdf": ("application/pdf", {"pdf"}, None),
+    "rtf": ("application/rtf", {"rtf"}, "doc"),
+    "doc": ("application/msword", {"doc", "dot"}, "doc"),
+    "docx": ("application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+             {"docx", "docm", "dotx", "dotm"}, "doc"),
+    "odt": ("application/vnd.oasis.opendocument.text", {"odt", "ott"}, "doc"),
+    "epub": ("application/epub+zip", {"epub"}, "epub"),
+    "html": ("text/html", {"html", "htm", "xhtml"}, None),
+    "txt": ("text/plain", {"txt", "text", "md"}, None),
+    }
+
+
+def sniff_document(document_bytes):
     """
-    def __init__(self, token=""):
-        message = "Invalid Bookalope token: " + (token or "<not set>")
-        super().__init__(message)
+    Determine the format of a document from its magic bytes and, for ZIP
+    containers, from its structure: PDF, RTF, legacy Word, DOCX, ODT, EPUB,
+    HTML and plain text are recognized.
 
+    :param bytes document_bytes: A byte array containing the document.
 
-class BookflowError(BookalopeError):
-    """
-    A BookflowError is raised whenever an operation on a Bookflow can not be
-    executed or failed.
+    :returns tuple: A (mime type, set of file name extensions, document type)
+                    tuple, or None if the format is unknown.
     """
+    head = bytes(document_bytes[:8])
+    if head.startswith(b"%PDF-"):
+        return _DOCUMENT_FORMATS["pdf"]
+    if head.startswith(b"{\\rtf"):
+        return _DOCUMENT_FORMATS["rtf"]
+    if head == b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1":
+        return _DOCUMENT_FORMATS["doc"]
+    if head.startswith(b"PK\x03\x04"):
+        try:
+            with zipfile.ZipFile(io.BytesIO(document_bytes)) as zip_:
+                names = set(zip_.namelist())
+                mimetype = zip_.read("mimetype").decode("ascii", "replace").strip() if "mimetype" in names else None
+        except (zipfile.BadZipFile, KeyError):
+            return None
+        if mimetype == "application/epub+zip":
+            return _DOCUMENT_FORMATS["epub"]
+        if mimetype == "application/vnd.oasis.opendocument.text":
+            return _DOCUMENT_FORMATS["odt"]
+        if "word/document.xml" in names:
+            return _DOCUMENT_FORMATS["docx"]
+        return None
+    sample = bytes(document_bytes[:65536])
+    try:
+        if sample.startswith((b"\xff\xfe", b"\xfe\xff")):
+            text = sample.decode("utf-16")
+        else:
+            # A multi-byte character may be cut off at the end of the sample.
+            text = codecs.getincrementaldecoder("utf-8")().decode(sample, final=len(sample) == len(document_bytes))
+    except UnicodeDecodeError:
+        return None
+    if "\x00" in text:
+        return None
+    if re.match(r"\s*(<!doctype\s+html|<html)", text[:1024], re.IGNORECASE):
+        return _DOCUMENT_FORMATS["html"]
+    return _DOCUMENT_FORMATS["txt"]
 
 
-class BookalopeClient(object):
+# The API version of the Bookalope server that this client speaks.
+_API_VERSION = "1.2.0"
+
+# Valid language names and their Babel locale identifiers, which a WarmStartCache
+# persists across processes.
+_LANGUAGES = {}
+
+
+def _parse_language(language):
     """
-    The Bookalope client provides direct access to the Bookalope server and its
-    services.
+    Return the Babel locale identifier for the given standard language/culture
+    name, e.g. "en_US" or "en-US".
+
+    :raises: ValueError, babel.core.UnknownLocaleError if the language string
+             is invalid.
     """
+    identifier = _LANGUAGES.get(language)
+    if identifier is None:
+        try:
+            _ = babel.core.Locale.parse(language)
+            locale = babel.core.parse_locale(language)
+        except (ValueError, babel.core.UnknownLocaleError):
+            _ = babel.core.Locale.parse(language, sep="-")
+            locale = babel.core.parse_locale(language, sep="-")
+        identifier = _LANGUAGES[language] = babel.core.get_locale_identifier(locale)
+    return identifier
 
-    def __init__(self, token=None, beta_host=False, version="v1"):
-        """
-        Initializes a Bookalope client instance.
 
-        :param str token: The user's authentication token provided by Bookalope.
-        :param bool beta_host: True to use Bookalope's beta services, False for production.
-        :param int version: Use the given version of the API.
+def _parse_pubdate(pubdate):
+    """
+    Return the given publication date, a full date or only year and month or
+    only a year, with or without dashes, as "YYYY-MM-DD", "YYYY-MM" or "YYYY".
 
-        :raises TokenError: If the given token is an invalid Bookalope token.
-        """
-        self.__token = None
-        if token is not None:
-            self.__token = token
-        self.set_host(beta_host)
-        self.__version = version
+    :raises: ValueError if the string is not a valid date.
+    """
+    for in_format, out_format in (("%Y-%m-%d", "%Y-%m-%d"), ("%Y%m%d", "%Y-%m-%d"),
+                                  ("%Y-%m", "%Y-%m"), ("%Y%m", "%Y-%m"), ("%Y", "%Y")):
+        try:
+            return datetime.datetime.strptime(pubdate.strip(), in_format).strftime(out_format)
+        except ValueError:
+            pass
+    raise ValueError("Invalid publication date: {}".format(pubdate))
 
-    def __repr__(self):
-        """Return a printable representation of this instance."""
-        repr_s = "<{}.{} object at {}> JSON: {}".format(
-            self.__class__.__module__,
-            self.__class__.__name__,
-            hex(id(self)),
-            json.dumps({
-                "token": self.__token,
-                "server": self.__host,
-                }))
-        return repr_s
 
-    def http_get(self, url, params=None):
-        """
-        Perform an HTTP GET request to the Bookalope server. If the response
-        content type is JSON then this function returns whatever object was
-        encoded in JSON; if the response contains an attachment then this
-        function returns that attachment as a byte array.
+def _normalize_isbn(isbn):
+    """
+    Return the given ISBN-10 or ISBN-13, with or without dashes and spaces, as
+    a plain ISBN-13 string so that different spellings of an ISBN compare equal.
 
-        :param str url: The URL string of the service endpoint.
-        :param dict params: An optional dictionary of param/value pairs that
-                            is URL encoded and passed as part of the URL string.
+    :raises: ValueError if the string is not a valid ISBN.
+    """
+    digits = re.sub(r"[\s-]", "", isbn).upper()
+    if re.fullmatch(r"\d{9}[\dX]", digits):
+        if sum((10 - i) * (10 if _ == "X" else int(_)) for i, _ in enumerate(digits)) % 11 == 0:
+            digits = "978" + digits[:9]
+            return digits + str(-sum((3 if i % 2 else 1) * int(_) for i, _ in enumerate(digits)) % 10)
+    elif re.fullmatch(r"97[89]\d{10}", digits):
+        if sum((3 if i % 2 else 1) * int(_) for i, _ in enumerate(digits)) % 10 == 0:
+            return digits
+    raise ValueError("Invalid ISBN: {}".format(isbn))
+
+
+def _sha256_digest(headers):
+    """
+    Return the SHA-256 digest that the given response headers announce for the
+    response body (RFC 3230 'Digest' or RFC 9530 'Repr-Digest'), or None.
 
-        :returns: Depending on the response, either a dictionary or file download.
+    :param headers: The response headers.
+    :returns bytes: The digest, or None.
+    """
+    for name in ("Repr-Digest", "Digest"):
+        match = re.search(r"sha-256=:?([A-Za-z0-9+/=]+):?", headers.get(name, ""), re.IGNORECASE)
+        if match:
+            try:
+                return base64.b64decode(match.group(1))
+            except ValueError:
+                return None
+    return None
 
-        :raises: An HTTP exception if the server responded with anything but
-                 OK (200) or if the response contained unexpected header/body
-                 data; BookalopeError if there was a server version mismatch.
-        """
-        response = requests.get(self.__host + url, params=params, auth=(self.__token, ""))
-        if response.status_code == requests.codes.ok:
-            if not response.headers["X-Bookalope-Api-Version"] == "1.2.0":
-                raise BookalopeError("Invalid API server version, please update this client")
-            if response.headers["Content-Type"].startswith("application/json"):
-                return response.json()
-            if response.headers["Content-Disposition"].startswith("attachment"):
-                return response.content
-        response.raise_for_status()
-        assert not "Implement: missed a success code"
 
-    def http_post(self, url, params):
-        """
-        Perform an HTTP POST request to the Bookalope server. A response may or
-        may not contain a body, so this function returns either whatever object
-        was encoded in JSON; or None.
+def _write_zip_entry(container, name, chunks):
+    """
+    Stream the given chunks into a new entry of a ZIP archive.
 
-        :param str url: The URL string of the service endpoint.
-        :param dict params: An optional dictionary of param/value pairs that will
-                            be JSON encoded and passed in the request body.
+    :returns tuple: The size of the entry in bytes, and its SHA-256 hex digest.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    zipinfo = zipfile.ZipInfo(name, time.localtime()[:6])
+    zipinfo.compress_type = zipfile.ZIP_DEFLATED
+    with container.open(zipinfo, "w", force_zip64=True) as entry:
+        for chunk in chunks:
+            entry.write(chunk)
+            sha256.update(chunk)
+            size += len(chunk)
+    return size, sha256.hexdigest()
+
+
+class _ChunkReader(object):
+    """
+    A minimal read-only file object over an iterable of byte chunks that hashes
+    everything that's read from it.
+    """
 
-        :returns: Depending on the response, either a dictionary or None.
+    def __init__(self, chunks):
+        """Initialize this reader with an iterable of bytes."""
+        self.__chunks = iter(chunks)
+        self.__buffer = b""
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        """Read and return at most `size` bytes, or everything if size is negative."""
+        while size < 0 or len(self.__buffer) < size:
+            chunk = next(self.__chunks, None)
+            if chunk is None:
+                break
+            self.__buffer += chunk
+        if size < 0:
+            data, self.__buffer = self.__buffer, b""
+        else:
+            data, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+        self.sha256.update(data)
+        return data
 
-        :raises: An HTTP exception if the server responded with anything but
-                 OK (200) or CREATED (201); BookalopeError if there was a server
-                 version mismatch.
-        """
-        response = requests.post(self.__host + url, json=params, auth=(self.__token, ""))
-        if response.status_code in [requests.codes.ok, requests.codes.created]:
-            if not response.headers["X-Bookalope-Api-Version"] == "1.2.0":
-                raise BookalopeError("Invalid API server version, please update this client")
-            if int(response.headers["Content-Length"]):
-                # TODO: Check that Content-Type is JSON?
-                return response.json()
-            return None
-        response.raise_for_status()
-        assert not "Implement: missed a success code"
 
-    def http_delete(self, url):
-        """
-        Perform an HTTP DELETE request to the Bookalope server.
+def _write_tar_entry(container, name, chunks, content_length):
+    """
+    Stream the given chunks into a new entry of a tar archive. A tar header
+    holds the size of the entry, which must therefore be known up front.
 
-        :param str url: The URL of the service endpoint.
+    :returns tuple: The size of the entry in bytes, and its SHA-256 hex digest.
+    :raises: BookalopeError if the size is not known.
+    """
+    if content_length is None:
+        raise BookalopeError("Unable to stream '{}' into a tar archive, size is unknown".format(name))
+    tarinfo = tarfile.TarInfo(name)
+    tarinfo.size = int(content_length)
+    tarinfo.mtime = time.time()
+    reader = _ChunkReader(chunks)
+    container.addfile(tarinfo, reader)
+    return tarinfo.size, reader.sha256.hexdigest()
 
-        :returns: None
 
-        :raises: An HTTP exception if the server responded with anything but
-                 NO CONTENT (204); BookalopeError if there was a server version
-                 mismatch.
-        """
-        response = requests.delete(self.__host + url, auth=(self.__token, ""))
-        if not response.headers["X-Bookalope-Api-Version"] == "1.2.0":
-            raise BookalopeError("Invalid API server version, please update this client")
-        if response.status_code == requests.codes.no_content:
-            return None
-        response.raise_for_status()
-        assert not "Implement: missed a success code"
+# The estimated memory footprint of a JSON upload relative to the file size:
+# the file, its Base64 encoding as bytes and str, and the encoded JSON body.
+_UPLOAD_FOOTPRINT = 5
+
+
+class _Base64Upload(object):
+    """
+    A JSON request body that embeds a file as a Base64 encoded string, and that
+    is encoded chunk by chunk while it is being sent. Only a single chunk of the
+    file is held in memory at a time, and the length of the body is known up
+    front so that it's not sent using chunked transfer encoding.
+    """
 
-    def set_host(self, beta_host=False):
+    def __init__(self, params, file_key, source, chunk_size=3 * 256 * 1024):
         """
-        Set the host name of the Bookalope server that this client should use for all subsequent
-        requests. Defaults to the production host.
+        Initialize this upload body.
 
-        :param beta_host bool: True if the client should use Bookalope's Beta server, False otherwise.
+        :param dict params: A dictionary of param/value pairs that are JSON encoded.
+        :param str file_key: The name of the JSON key for the encoded file.
+        :param source: A file name, or a bytes-like object with the file content.
+        :param int chunk_size: The number of file bytes encoded at once; must be
+                               a multiple of 3 to avoid Base64 padding.
         """
-        if beta_host:
-            self.__host = "https://beta.bookalope.net"
+        assert chunk_size % 3 == 0
+        self.__source = source
+        self.__chunk_size = chunk_size
+        head = json.dumps(params)[:-1] + (", " if params else "") + json.dumps(file_key) + ": \""
+        self.__head = head.encode()
+        self.__tail = b"\"}"
+        if isinstance(source, str):
+            self.__size = os.path.getsize(source)
         else:
-            self.__host = "https://bookflow.bookalope.net"
+            self.__size = len(source)
+        self.__length = len(self.__head) + 4 * ((self.__size + 2) // 3) + len(self.__tail)
 
-    @property
-    def host(self):
-        """Return the host name of the Bookalope server that this client currently uses."""
-        return self.__host
+    def __len__(self):
+        """Return the length of the encoded request body in bytes."""
+        return self.__length
 
     @property
-    def token(self):
-        """Return the Bookalope auth token of this client instance, or None."""
-        return self.__token
+    def size(self):
+        """Return the size of the embedded file in bytes."""
+        return self.__size
 
-    @token.setter
-    def token(self, token):
+    @property
+    def footprint(self):
         """
-        Set the Bookalope auth token for this client instance.
-
-        :param str token: The auth token as provided by the website.
-        :raises: TokenError if the token is invalid.
+        Return the estimated memory footprint of sending this body in bytes: a
+        file chunk and its encoding, or the whole file if it's held in memory.
         """
-        if _is_token(token):
-            self.__token = token
+        footprint = self.__chunk_size + self.__chunk_size * 4 // 3
+        if not isinstance(self.__source, str):
+            footprint += self.__size
+        return footprint
+
+    def __iter__(self):
+        """Yield the encoded request body chunk by chunk."""
+        yield self.__head
+        if isinstance(self.__source, str):
+            with open(self.__source, "rb") as file_:
+                chunk = file_.read(self.__chunk_size)
+                while chunk:
+                    yield base64.b64encode(chunk)
+                    chunk = file_.read(self.__chunk_size)
         else:
-            raise TokenError(token)
+            view = memoryview(self.__source)
+            for offset in range(0, len(view), self.__chunk_size):
+                yield base64.b64encode(view[offset:offset + self.__chunk_size])
+        yield self.__tail
 
-    def get_profile(self):
-        """
-        Query the Bookalope server for the user profile data associated with the
-        auth token. Return a new Profile instance that represents a Bookalope
-        user profile.
-        """
-        return Profile(self)
 
-    def get_styles(self, format_):
+# Request bodies smaller than this many bytes are never compressed; of larger
+# ones, the first this many bytes are compressed to probe whether the whole body
+# compresses to less than the given ratio of its size.
+_COMPRESSION_THRESHOLD = 16 * 1024
+_COMPRESSION_PROBE = 64 * 1024
+_COMPRESSION_RATIO = 0.9
+
+# The zlib window bits that produce the supported Content-Encodings.
+_COMPRESSION_WBITS = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+}
+
+
+def _rejects_encoding(response):
+    """
+    Return True if the server refused a compressed request body: a 415 response,
+    or a 400 response whose body names the Content-Encoding. Other 400 responses,
+    e.g. for invalid parameters, would fail the same way without compression.
+    """
+    if response.status_code == requests.codes.unsupported_media_type:
+        return True
+    if response.status_code == requests.codes.bad_request:
+        return "encoding" in response.text.lower()
+    return False
+
+
+def _probe_compression(sample):
+    """
+    Return True if the given sample of a request body compresses well enough to
+    make compressing the whole body worthwhile.
+    """
+    return len(zlib.compress(sample, 1)) < _COMPRESSION_RATIO * len(sample)
+
+
+def _phase(bookalope, name, span_name=None, **attributes):
+    """
+    Return a context manager that records the enclosed code as the named phase
+    with the client's profiler, and as a span with the client's tracer; or a
+    no-op context manager if the client has neither.
+
+    :param bookalope: A Bookalope instance.
+    :param str name: The name of the phase.
+    :param str span_name: An optional name for the span; defaults to the name
+                          of the phase.
+    :param attributes: Optional attributes of the span.
+    """
+    profiler = bookalope.profiler
+    tracer = bookalope.tracer
+    if tracer is None:
+        if profiler is None:
+            return contextlib.nullcontext()
+        return profiler.phase(name)
+    if profiler is None:
+        return tracer.span(span_name or name, **attributes)
+
+    @contextlib.contextmanager
+    def _both():
+        with profiler.phase(name), tracer.span(span_name or name, **attributes):
+            yield
+
+    return _both()
+
+
+def _annotate(**attributes):
+    """Set the given attributes on the current span, if there is one."""
+    span = _SPAN.get()
+    if span:
+        span.attributes.update(attributes)
+
+
+class _ByteBudget(object):
+    """
+    A semaphore that counts bytes instead of permits: concurrent transfers
+    reserve their estimated memory footprint, and wait while the sum of all
+    reservations would exceed the ceiling.
+    """
+
+    def __init__(self, max_bytes):
         """
-        Query the Bookalope server for all available design styles for the given
-        target file format.
+        Initialize this byte budget.
 
-        :param str format: The target file format, one of 'epub', 'epub3',
-                           'mobi', 'pdf', 'icml', 'docx'.
-        :returns list: Returns a list of Style instances, each of which describes
-                       an available design style.
+        :param int max_bytes: The ceiling for the sum of all reservations.
         """
-        params = {
-            "format": format_,
-            }
-        styles = self.http_get("/api/styles", params)["styles"]
-        return [Style(format_, _) for _ in styles]
+        self.__max_bytes = max_bytes
+        self.__used = 0
+        self.__condition = threading.Condition()
 
-    def get_export_formats(self):
+    def _reinit_after_fork(self):
         """
-        Query the Bookalope server for all available export file formats.
+        Reset the condition and reservations that a newly forked child process
+        inherited; the parent's transfers don't exist in the child.
+        """
+        self.__used = 0
+        self.__condition = threading.Condition()
 
-        :returns list: Returns a list of Format instances, each of which describes
-                       a supported export file format.
+    @contextlib.contextmanager
+    def reserve(self, nbytes):
         """
-        formats = self.http_get("/api/formats")["formats"]
-        return [Format(format_) for format_ in formats["export"]]
+        Return a context manager that holds a reservation of the given number of
+        bytes. Reservations larger than the ceiling are capped to the ceiling,
+        i.e. they wait until they can run alone.
 
-    def get_import_formats(self):
+        :param int nbytes: The number of bytes to reserve.
+        :raises: DeadlineExceeded if the current deadline expired while waiting.
         """
-        Query the Bookalope server for all available import file formats.
+        nbytes = min(max(0, nbytes), self.__max_bytes)
+        with self.__condition:
+            while self.__used + nbytes > self.__max_bytes:
+                if not self.__condition.wait(_remaining()):
+                    _remaining()
+            self.__used += nbytes
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__used -= nbytes
+                self.__condition.notify_all()
 
-        :returns list: Returns a list of Format instances, each of which describes
-                       a supported import file format.
+
+def _format_created(created):
+    """
+    Return the given creation date, either a datetime instance or a string that
+    wasn't parsed yet, as a Bookalope date string.
+    """
+    if isinstance(created, str):
+        return created
+    return created.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class _RateLimiter(object):
+    """
+    A thread-safe token bucket that limits operations to a given number per
+    second, while allowing for short bursts of up to `burst` operations.
+    """
+
+    def __init__(self, rate, burst=None):
         """
-        formats = self.http_get("/api/formats")["formats"]
-        return [Format(format_) for format_ in formats["import"]]
+        Initialize this rate limiter.
 
-    def get_bookshelves(self):
+        :param float rate: The number of operations permitted per second.
+        :param int burst: The optional size of the bucket; defaults to one
+                          second's worth of operations.
         """
-        Queries the Bookalope server for all Bookshelves of the user.
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        self.__rate = float(rate)
+        self.__capacity = float(burst or max(1.0, self.__rate))
+        self.__tokens = self.__capacity
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def _reinit_after_fork(self):
+        """Reset the lock that a newly forked child process inherited."""
+        self.__lock = threading.Lock()
+
+    def try_acquire(self, reserve=0.0):
+        """
+        Take a single token from the bucket if one is available.
 
-        :returns list: Returns a list of Bookshelf instances for this user.
+        :param float reserve: The share of the bucket's capacity that must be
+                              left in the bucket, e.g. for more urgent operations.
+        :returns float: 0 if a token was taken, or else the number of seconds
+                        until the next token becomes available.
         """
-        bookshelves = self.http_get("/api/bookshelves")
-        return [Bookshelf(self, _) for _ in bookshelves["bookshelves"]]
+        needed = 1.0 + min(reserve * self.__capacity, self.__capacity - 1.0)
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.__capacity, self.__tokens + (now - self.__last) * self.__rate)
+            self.__last = now
+            if self.__tokens >= needed:
+                self.__tokens -= 1.0
+                return 0.0
+            return (needed - self.__tokens) / self.__rate
+
+    def acquire(self, reserve=0.0):
+        """
+        Block until a token could be taken from the bucket.
 
-    def get_books(self):
+        :param float reserve: See try_acquire().
         """
-        Queries the Bookalope server for all books associated with the user.
+        while True:
+            wait = self.try_acquire(reserve)
+            if not wait:
+                return
+            _sleep(wait)
 
-        :returns list: Returns a list of Book instances for this user.
+
+class _PriorityGate(object):
+    """
+    A semaphore for requests of two priority classes: interactive requests may
+    take any free slot, while batch requests leave a reserved number of slots
+    to interactive requests and don't take a slot while an interactive request
+    is waiting for one.
+    """
+
+    def __init__(self, capacity, reserved):
         """
-        books = self.http_get("/api/books")
-        return [Book(self, _) for _ in books["books"]]
+        Initialize this gate.
 
-    def create_book(self, name=None, bookshelf=None):
+        :param int capacity: The total number of slots.
+        :param int reserved: The number of slots that batch requests can't take.
         """
-        Create a new Book instance with the given name. Note that the books has
-        not been saved to the Bookalope server yet, and needs to be saved. The
-        new book has a default name '<none>' which should be changed. Note that
-        the new book will also have a single empty Bookflow instance.
+        self.__capacity = capacity
+        self.__reserved = min(reserved, capacity - 1)
+        self.__used = {"interactive": 0, "batch": 0}
+        self.__waiting = 0
+        self.__condition = threading.Condition()
+
+    def __admit(self, priority):
+        """Return True if a request of the given priority may take a slot now."""
+        used = sum(self.__used.values())
+        if priority == "interactive":
+            return used < self.__capacity
+        return used < self.__capacity and self.__used["batch"] < self.__capacity - self.__reserved and not self.__waiting
+
+    def acquire(self, priority, blocking=True):
+        """
+        Take a slot for a request of the given priority, waiting for one if
+        necessary; release it with release().
 
-        :param bookshelf: An optional Bookshelf instance to associate with the
-                          new Book.
-        :param str name: An optional name for the new Book.
-        :returns: A Book instance for the new book.
+        :param str priority: Either 'interactive' or 'batch'.
+        :param bool blocking: False to return right away if no slot is free.
+        :returns bool: True if a slot was taken.
+        :raises: DeadlineExceeded if the current deadline expired while waiting.
         """
-        return Book(self, name=name, bookshelf=bookshelf)
+        with self.__condition:
+            if not blocking and not self.__admit(priority):
+                return False
+            interactive = priority == "interactive"
+            self.__waiting += interactive
+            try:
+                while not self.__admit(priority):
+                    if not self.__condition.wait(_remaining()):
+                        _remaining()
+            finally:
+                self.__waiting -= interactive
+            self.__used[priority] += 1
+            return True
+
+    def release(self, priority):
+        """Release a slot that was taken for a request of the given priority."""
+        with self.__condition:
+            self.__used[priority] -= 1
+            self.__condition.notify_all()
 
+    @property
+    def used(self):
+        """Return a dictionary with the number of slots held by each priority class."""
+        with self.__condition:
+            return dict(self.__used)
 
-class Profile(object):
+
+class SharedBudget(object):
     """
-    The Profile class implements the Bookalope user profile, and provides access
-    to the profile's first and last name.
+    A request budget that is shared by several processes on the same host: a
+    token bucket whose state lives in shared memory limits the number of
+    requests per second across all processes, and a shared semaphore limits the
+    number of their requests in flight. A SharedBudget must be created before
+    the worker processes and passed to them when they start, e.g. as an
+    argument of a multiprocessing.Pool initializer.
     """
 
-    def __init__(self, bookalope):
+    def __init__(self, rate=None, burst=None, max_in_flight=None, context=None):
         """
-        Initialize this Profile instance from the current Bookalope profile data.
-
-        :param bookalope: A Bookalope instance.
+        Initialize this shared budget.
+
+        :param float rate: The optional number of requests permitted per second.
+        :param int burst: The optional size of the bucket; defaults to one
+                          second's worth of requests.
+        :param int max_in_flight: The optional number of requests that may be
+                                  in flight at the same time.
+        :param context: The multiprocessing context of the worker processes;
+                        defaults to the default context.
         """
-        assert isinstance(bookalope, BookalopeClient)
-        self.__bookalope = bookalope
-        self.__firstname = None
-        self.__lastname = None
-        self.update()
+        if rate is not None and rate <= 0:
+            raise ValueError("Rate must be positive")
+        if max_in_flight is not None and max_in_flight <= 0:
+            raise ValueError("Number of requests in flight must be positive")
+        context = context or multiprocessing.get_context()
+        self.__rate = float(rate) if rate else None
+        self.__capacity = float(burst or max(1.0, self.__rate or 1.0))
+        self.__lock = context.Lock()
+        self.__bucket = context.RawArray("d", [self.__capacity, time.monotonic()])
+        self.__max_in_flight = max_in_flight
+        self.__slots = context.BoundedSemaphore(max_in_flight) if max_in_flight else None
 
     def __repr__(self):
         """Return a printable representation of this instance."""
@@ -291,247 +729,427 @@ class Profile(object):
             self.__class__.__module__,
             self.__class__.__name__,
             hex(id(self)),
-            json.dumps(self.pack()))
+            json.dumps({
+                "rate": self.__rate,
+                "max_in_flight": self.__max_in_flight,
+                }))
         return repr_s
 
-    def update(self):
+    def try_acquire(self):
         """
-        Queries the Bookalope server for the current profile data, and updates
-        this instance with that data.
+        Take a single token from the shared bucket if one is available.
 
-        :raises: HTTP related exceptions.
+        :returns float: 0 if a token was taken, or else the number of seconds
+                        until the next token becomes available.
         """
-        result = self.__bookalope.http_get("/api/profile")
-        self.__firstname = result["user"]["firstname"]
-        self.__lastname = result["user"]["lastname"]
+        if self.__rate is None:
+            return 0.0
+        with self.__lock:
+            tokens, last = self.__bucket
+            now = time.monotonic()
+            tokens = min(self.__capacity, tokens + (now - last) * self.__rate)
+            wait = 0.0
+            if tokens >= 1.0:
+                tokens -= 1.0
+            else:
+                wait = (1.0 - tokens) / self.__rate
+            self.__bucket[0], self.__bucket[1] = tokens, now
+            return wait
+
+    def acquire(self):
+        """Block until a token could be taken from the shared bucket."""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            _sleep(wait)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """
+        Return a context manager that holds one of the shared in-flight slots,
+        waiting for one to become free if necessary.
 
-    def save(self):
+        :raises: DeadlineExceeded if the current deadline expired while waiting.
         """
-        Posts this Profile's instance data to the Bookalope server, i.e. save
-        first and last name.
+        if self.__slots is None:
+            yield
+            return
+        if not self.__slots.acquire(timeout=_remaining()):
+            raise DeadlineExceeded("Deadline exceeded while waiting for a request slot")
+        try:
+            yield
+        finally:
+            self.__slots.release()
 
-        :raises: HTTP related exceptions.
+
+class _SingleFlight(object):
+    """
+    Coalesce concurrent calls for the same key: while a call for a key is in
+    flight, all other calls for that key wait for it and share its outcome
+    instead of repeating the work.
+    """
+
+    def __init__(self):
+        """Initialize this instance without calls in flight."""
+        self.__lock = threading.Lock()
+        self.__calls = {}
+
+    def do(self, key, func):
         """
-        params = self.pack()
-        return self.__bookalope.http_post("/api/profile", params)
+        Call the given function unless a call for the same key is in flight
+        already, in which case wait for that call's result.
 
-    def pack(self):
+        :param key: A hashable key that identifies identical calls.
+        :param func: A callable without arguments.
+        :returns: The result of the function call.
+        :raises: Whatever exception the function call raised.
         """
-        Pack this instance data into a dictionary that can be encoded as a JSON
-        string and is compatible to the Bookalope profile data.
+        with self.__lock:
+            future = self.__calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.__calls[key] = concurrent.futures.Future()
+        if not leader:
+            return _wait(future)
+        try:
+            result = func()
+        except BaseException as exc:
+            self.__done(key)
+            future.set_exception(exc)
+            raise
+        self.__done(key)
+        future.set_result(result)
+        return result
+
+    def __done(self, key):
+        """Remove the in-flight call for the given key."""
+        with self.__lock:
+            del self.__calls[key]
+
+
+class _TimerWheel(object):
+    """
+    A hashed timer wheel: a ring of slots each of which holds the items that
+    expire when the wheel's cursor reaches that slot. Items that are further
+    in the future than one revolution carry a count of remaining rounds. This
+    keeps scheduling and expiry O(1) regardless of the number of timers. The
+    wheel itself is not thread-safe.
+    """
 
-        :returns dict: First and last name packed into a dictionary.
+    def __init__(self, tick=0.1, size=512):
         """
-        packed = {
-            "firstname": self.__firstname,
-            "lastname": self.__lastname,
-            }
-        return packed
+        Initialize this timer wheel.
+
+        :param float tick: The duration of a single tick in seconds.
+        :param int size: The number of slots of the wheel.
+        """
+        self.__tick = tick
+        self.__slots = [[] for _ in range(size)]
+        self.__cursor = 0
 
     @property
-    def firstname(self):
-        """Return the first name string of this instance."""
-        return self.__firstname
+    def tick(self):
+        """Return the duration of a single tick in seconds."""
+        return self.__tick
 
-    @firstname.setter
-    def firstname(self, name):
+    def schedule(self, delay, item):
         """
-        Change the first name of this instance to the new value.
+        Schedule the given item to expire after `delay` seconds, rounded up to
+        the next full tick.
 
-        :param str name: The new first name.
+        :param float delay: The delay in seconds.
+        :param item: An arbitrary item.
         """
-        self.__firstname = name
-
-    @property
-    def lastname(self):
-        """Return the last name string of this instance."""
-        return self.__lastname
+        size = len(self.__slots)
+        ticks = max(1, int(-(-delay // self.__tick)))
+        slot = (self.__cursor + ticks) % size
+        self.__slots[slot].append([(ticks - 1) // size, item])
 
-    @lastname.setter
-    def lastname(self, name):
+    def advance(self):
         """
-        Change the last name of this instance to the new value.
+        Advance the wheel's cursor by a single tick.
 
-        :param str name: The new last name.
+        :returns list: The items that expired with this tick.
         """
-        self.__lastname = name
+        self.__cursor = (self.__cursor + 1) % len(self.__slots)
+        expired = []
+        pending = []
+        for entry in self.__slots[self.__cursor]:
+            if entry[0]:
+                entry[0] -= 1
+                pending.append(entry)
+            else:
+                expired.append(entry[1])
+        self.__slots[self.__cursor] = pending
+        return expired
 
 
-class Format(object):
+class BookalopeError(Exception):
     """
-    A Format instance describes a file format that Bookalope supports either as
-    import or export file format. It contains the mime type of the supported file
-    format, and a list of file name extensions.
+    Base class for all Bookalope related errors.
     """
 
-    def __init__(self, packed):
-        """
-        Initialize this Format instance from a dictionary of a packed Format.
 
-        :param dict packed: A dictionary containing packed Format information.
-        """
-        self.__name = packed["name"]
-        self.__mime = packed["mime"]
-        self.__file_extensions = packed["exts"]
+class TokenError(BookalopeError):
+    """
+    A TokenError is raised whenever a Bookalope ID or auth token is expected but
+    not provided. See the _is_token() function.
+    """
+    def __init__(self, token=""):
+        message = "Invalid Bookalope token: " + (token or "<not set>")
+        super().__init__(message)
 
-    def __repr__(self):
-        """Return a printable representation of this instance."""
-        repr_s = "<{}.{} object at {}> JSON: {}".format(
-            self.__class__.__module__,
-            self.__class__.__name__,
-            hex(id(self)),
-            json.dumps(self.pack()))
-        return repr_s
 
-    def pack(self):
-        """
-        Pack this instance data into a dictionary that can be encoded as a JSON
-        string and is compatible to the Bookalope Format data.
+class BookflowError(BookalopeError):
+    """
+    A BookflowError is raised whenever an operation on a Bookflow can not be
+    executed or failed.
+    """
 
-        :returns dict: This Format's information as a Bookalope compatible
-                       dictionary.
-        """
-        packed = {
-            "name": self.__name,
-            "mime": self.__mime,
-            "exts": self.__file_extensions,
-            }
-        return packed
 
-    @property
-    def name(self):
-        """Return the short name of this format."""
-        return self.__name
+class DeadlineExceeded(BookalopeError):
+    """
+    A DeadlineExceeded error is raised whenever an operation can not finish
+    before the deadline of the enclosing deadline() context. See deadline().
+    """
+    def __init__(self, message="Deadline exceeded"):
+        super().__init__(message)
 
-    @property
-    def mimetype(self):
-        """Return the mime type of this format."""
-        return self.__mime
 
-    @property
-    def file_exts(self):
-        """Return a list of file extensions for this file format."""
-        return self.__file_extensions
+_DEADLINE = contextvars.ContextVar("bookalope_deadline", default=None)
+# The priority classes of requests, and the priority of the current requests.
+_PRIORITIES = ("interactive", "batch")
+_PRIORITY = contextvars.ContextVar("bookalope_priority", default=None)
+# The current span of the Tracer, or False while tracing is suppressed.
+_SPAN = contextvars.ContextVar("bookalope_span", default=None)
 
 
-class Style(object):
+@contextlib.contextmanager
+def deadline(seconds):
     """
-    For every target file format that Bookalope generates, the user can select
-    from several available design styles. This class implements a single such
-    design style.
+    Return a context manager that gives all enclosed operations a budget of the
+    given number of seconds. Every HTTP request's timeouts and every polling
+    wait are capped by the remaining budget, and fail with DeadlineExceeded once
+    the budget is spent. Deadlines nest, in which case the earlier one applies,
+    and they carry over into the thread pools of bulk operations.
+
+    :param float seconds: The budget in seconds.
+    :returns: The expiry time of the deadline as time.monotonic() value.
+    """
+    expires = time.monotonic() + seconds
+    outer = _DEADLINE.get()
+    if outer is not None:
+        expires = min(expires, outer)
+    token = _DEADLINE.set(expires)
+    try:
+        yield expires
+    finally:
+        _DEADLINE.reset(token)
+
+
+@contextlib.contextmanager
+def priority(priority_):
+    """
+    Return a context manager that sends all enclosed requests with the given
+    priority. Interactive requests, the default, use their own connection pool
+    and have a reserved share of the client's connections and rate limit, so
+    that they keep a low latency while batch requests, e.g. the status monitor's
+    polls or bulk operations, saturate the client. Priorities nest, in which
+    case the inner one applies, and they carry over into the thread pools of
+    bulk operations.
+
+    :param str priority_: Either 'interactive' or 'batch'.
     """
+    if priority_ not in _PRIORITIES:
+        raise ValueError("Unknown priority: {}".format(priority_))
+    token = _PRIORITY.set(priority_)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
 
-    def __init__(self, format_, packed):
-        """
-        Initialize this Style instance from a dictionary of a packed Style.
 
-        :param str format_: The file format this Style instance applies to.
-        :param dict packed: A dictionary containing packed Style information.
-        """
-        self.__format = format_
-        self.__short_name = packed["name"]
-        self.__name = packed["info"]["name"]
-        self.__description = packed["info"]["description"]
-        self.__api_price = packed["info"]["price-api"]
+@contextlib.contextmanager
+def _default_priority(priority_):
+    """
+    Like priority(), but only if the caller hasn't chosen a priority already.
+    Used by operations that are batch traffic unless the caller says otherwise.
+    """
+    if _PRIORITY.get() is not None:
+        yield
+        return
+    with priority(priority_):
+        yield
 
-    def __repr__(self):
-        """Return a printable representation of this instance."""
-        repr_s = "<{}.{} object at {}> JSON: {}".format(
-            self.__class__.__module__,
-            self.__class__.__name__,
-            hex(id(self)),
-            json.dumps(self.pack()))
-        return repr_s
 
-    def pack(self):
-        """
-        Pack this instance data into a dictionary that can be encoded as a JSON
-        string and is compatible to the Bookalope Style data.
+def _remaining():
+    """
+    Return the number of seconds left until the current deadline expires, or
+    None if there is no deadline.
 
-        :returns dict: This Style's information as a Bookalope compatible
-                       dictionary.
-        """
-        packed = {
-            "name": self.__short_name,
-            "info": {
-                "name": self.__name,
-                "description": self.__description,
-                "price-api": self.__api_price,
-                },
-            }
-        return packed
+    :raises: DeadlineExceeded if the current deadline has expired.
+    """
+    expires = _DEADLINE.get()
+    if expires is None:
+        return None
+    remaining = expires - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return remaining
 
-    @property
-    def format(self):
-        """Return the file format this style description refers to."""
-        return self.__format
 
-    @property
-    def short_name(self):
-        """Return the short name of this style description."""
-        return self.__short_name
+def _sleep(seconds):
+    """
+    Sleep for the given number of seconds, unless that would overrun the current
+    deadline in which case DeadlineExceeded is raised right away.
+    """
+    remaining = _remaining()
+    if remaining is not None and seconds > remaining:
+        raise DeadlineExceeded()
+    time.sleep(seconds)
 
-    @property
-    def name(self):
-        """Return the descriptive name of this style description."""
-        return self.__name
 
-    @property
-    def description(self):
-        """Return the description string for this style."""
-        return self.__description
+def _wait(future, timeout=None):
+    """
+    Wait for the result of the given future for at most the given timeout or
+    the time left until the current deadline, whichever is shorter.
 
-    @property
-    def api_price(self):
-        """Return the price in US$ that is charged for this style by the API."""
-        return self.__api_price
+    :raises: concurrent.futures.TimeoutError if the timeout expired first, or
+             DeadlineExceeded if the deadline expired first.
+    """
+    remaining = _remaining()
+    if remaining is None or (timeout is not None and timeout <= remaining):
+        return future.result(timeout)
+    try:
+        return future.result(remaining)
+    except concurrent.futures.TimeoutError:
+        raise DeadlineExceeded() from None
 
 
-class Bookshelf(object):
+def _map(executor, func, items):
     """
-    The Bookshelf class describes a single bookshelf as used by Bookalope. A
-    Bookshelf may be associated with zero or more Books, and its has a name.
+    Like executor.map() but every call runs in a copy of the caller's context,
+    so that the current deadline carries over into the executor's threads.
+
+    :returns list: The results of all calls in the order of the items.
     """
+    futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+    return [future.result() for future in futures]
 
-    def __init__(self, bookalope, id_or_packed=None, name=None, description=None):
+
+def _imap(executor, func, items, window):
+    """
+    Like _map() but lazy: at most `window` calls are pending at any time, so that
+    the items can come from a generator of any length, e.g. a parser.
+
+    :returns: A generator of the results of all calls in the order of the items.
+    """
+    futures = collections.deque()
+    for item in items:
+        futures.append(executor.submit(contextvars.copy_context().run, func, item))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+# All live clients, whose connections and threads must be reset in a forked child.
+_CLIENTS = weakref.WeakSet()
+
+
+def _reinit_clients_after_fork():
+    """Reset all clients that a newly forked child process inherited."""
+    for client in list(_CLIENTS):
+        client._reinit_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_clients_after_fork)
+
+
+class BookalopeClient(object):
+    """
+    The Bookalope client provides direct access to the Bookalope server and its
+    services.
+    """
+
+    def __init__(self, token=None, beta_host=False, version="v1", rate_limit=None, max_connections=10,
+                 coalesce_requests=True, artifact_cache=None, profiler=None, timeout=(10.0, 60.0),
+                 conversion_stats=None, image_optimizer=None, max_inflight_bytes=None, compression=None,
+                 tracer=None, warm_start_cache=None, interactive_share=0.2, host=None):
         """
-        Create or initialize a new Bookshelf instance. The new Bookshelf instance is
-        created on the Bookalope server and this instance is initialized with the new
-        data. Note that the default bookshelf name is set to 'Bookshelf'.
+        Initializes a Bookalope client instance.
 
-        :param bookalope: A Bookalope instance.
-        :param str id_or_packed: None to create a new Bookshelf instance; a valid
-                                 Bookalope token string with a Bookshelf id; or a
-                                 dictionary containing packed bookshelf information.
-        :param str name: An optional name for this Bookshelf.
-        :param str description: An optional description for this Bookshelf.
+        :param str token: The user's authentication token provided by Bookalope.
+        :param bool beta_host: True to use Bookalope's beta services, False for production.
+        :param int version: Use the given version of the API.
+        :param float rate_limit: An optional maximum number of requests per second.
+        :param int max_connections: The maximum number of concurrent requests, and
+                                    the size of each of the client's two connection
+                                    pools for interactive and batch requests.
+        :param bool coalesce_requests: True to let concurrent identical GET requests
+                                       share a single request to the server.
+        :param artifact_cache: An optional ArtifactCache instance that caches
+                               downloaded conversions and images.
+        :param profiler: An optional Profiler instance that records where time is spent.
+        :param tuple timeout: The (connect, read) timeouts in seconds for every
+                              request; the current deadline() may shorten them.
+        :param conversion_stats: An optional ConversionStats instance that records
+                                 analysis and conversion durations, and whose
+                                 estimates schedule the status polls.
+        :param image_optimizer: An optional ImageOptimizer instance that shrinks
+                                images before they are uploaded.
+        :param int max_inflight_bytes: An optional ceiling for the estimated memory
+                                       footprint of all concurrent uploads and downloads.
+        :param str compression: An optional Content-Encoding, "gzip" or "deflate",
+                                for large request bodies that compress well.
+        :param tracer: An optional Tracer instance that records spans for requests
+                       and the phases of a bookflow's lifecycle.
+        :param warm_start_cache: An optional WarmStartCache instance that keeps the
+                                 server's formats, styles and the user profile on
+                                 disk for the next process.
+        :param float interactive_share: The share of the client's connections and
+                                        rate limit that's reserved for interactive
+                                        requests, see priority().
+        :param str host: An optional URL of another server that takes precedence
+                         over beta_host, see set_host(). Clients that ProcessRunner
+                         and ClientPool create from these arguments use it too.
+
+        :raises TokenError: If the given token is an invalid Bookalope token.
         """
-        assert isinstance(bookalope, BookalopeClient)
-        self.__bookalope = bookalope
-        if id_or_packed is None:
-            params = {
-                "name": name or "Bookshelf",
-                }
-            if description:
-                params["description"] = description
-            url = "/api/bookshelves"
-            bookshelf = self.__bookalope.http_post(url, params)["bookshelf"]
-        elif isinstance(id_or_packed, str):
-            if not _is_token(id_or_packed):
-                raise TokenError(id_or_packed)
-            url = "/api/bookshelves/" + id_or_packed
-            bookshelf = self.__bookalope.http_get(url)["bookshelf"]
-        elif isinstance(id_or_packed, dict):
-            bookshelf = id_or_packed
-        else:
-            raise TypeError()
-        self.__id = bookshelf["id"]
-        self.__url = "/api/bookshelves/{}".format(self.__id)
-        self.__name = bookshelf["name"]
-        self.__description = bookshelf["description"]
-        self.__created = datetime.datetime.strptime(bookshelf["created"], "%Y-%m-%dT%H:%M:%S")
-        books = bookshelf["books"]
-        self.__books = [Book(self.__bookalope, _, bookshelf=self) for _ in books]
+        self.__token = None
+        if token is not None:
+            self.__token = token
+        self.set_host(beta_host, host)
+        self.__version = version
+        self.__max_connections = max_connections
+        self.__interactive_share = interactive_share
+        self.__sessions = {_: self.__new_session() for _ in _PRIORITIES}
+        self.__gate = _PriorityGate(max_connections, round(interactive_share * max_connections))
+        self.__rate_limiter = None
+        self.set_rate_limit(rate_limit)
+        self.__single_flight = _SingleFlight() if coalesce_requests else None
+        self.__artifact_cache = artifact_cache
+        self.__profiler = profiler
+        self.__tracer = tracer
+        self.__warm_start_cache = warm_start_cache
+        self.__timeout = timeout
+        self.__conversion_stats = conversion_stats
+        self.__formats = None
+        self.__image_optimizer = image_optimizer
+        self.__in_flight = 0
+        self.__in_flight_lock = threading.Lock()
+        self.__byte_budget = _ByteBudget(max_inflight_bytes) if max_inflight_bytes else None
+        self.__status_monitor = None
+        self.__status_monitor_lock = threading.Lock()
+        self.__shared_budget = None
+        self.__compression = None
+        self.compression = compression
+        self.__compression_rejected = False
+        self.__compression_stats = collections.Counter()
+        self.__compression_lock = threading.Lock()
+        _CLIENTS.add(self)
 
     def __repr__(self):
         """Return a printable representation of this instance."""
@@ -539,184 +1157,3418 @@ class Bookshelf(object):
             self.__class__.__module__,
             self.__class__.__name__,
             hex(id(self)),
-            json.dumps(self.pack()))
+            json.dumps({
+                "token": self.__token,
+                "server": self.__host,
+                }))
         return repr_s
 
-    def update(self):
+    def __new_session(self):
+        """Return a new requests.Session with a connection pool for this client."""
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.__max_connections)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _reinit_after_fork(self):
         """
-        Queries the Bookalope server for this Bookshelf's server-side data, and
-        updates this instance with that data. Note that this creates a new list
-        with new Book instances, that may compete with references to older Book
-        instances.
+        Reset the connections, locks and threads that this client inherited from
+        its parent process, because they can't be shared with the parent. Called
+        in a newly forked child process for every client that existed at the time
+        of the fork.
         """
-        bookshelf = self.__bookalope.http_get(self.url)["bookshelf"]
-        self.__name = bookshelf["name"]
-        self.__description = bookshelf["description"]
-        books = bookshelf["books"]
+        self.__sessions = {_: self.__new_session() for _ in _PRIORITIES}
+        self.__gate = _PriorityGate(self.__max_connections, round(self.__interactive_share * self.__max_connections))
+        self.__single_flight = _SingleFlight() if self.__single_flight is not None else None
+        self.__in_flight = 0
+        self.__in_flight_lock = threading.Lock()
+        self.__status_monitor = None
+        self.__status_monitor_lock = threading.Lock()
+        self.__compression_lock = threading.Lock()
+        for helper in (self.__rate_limiter, self.__byte_budget, self.__artifact_cache, self.__profiler,
+                       self.__tracer, self.__conversion_stats, self.__image_optimizer, self.__warm_start_cache):
+            if helper is not None:
+                helper._reinit_after_fork()  # pylint: disable=protected-access
+
+    def __request(self, method, url, **kwargs):
+        """
+        Send an HTTP request to the Bookalope server using this client's
+        connection pool for the current priority, once the client's rate limit,
+        its free connections and its shared budget (if any) permit it. Batch
+        requests leave a share of the rate limit and of the connections to
+        interactive requests.
+
+        :param str method: The HTTP method.
+        :param str url: The URL string of the service endpoint.
+        :param kwargs: Additional arguments passed on to requests.
+
+        :returns: A requests.Response instance.
+
+        :raises: DeadlineExceeded if the current deadline expired before or while
+                 the request was sent.
+        """
+        priority_ = _PRIORITY.get() or "interactive"
+        shared_budget = self.__shared_budget
+        if self.__rate_limiter is not None or shared_budget is not None:
+            with _phase(self, "rate limit wait"):
+                if self.__rate_limiter is not None:
+                    self.__rate_limiter.acquire(self.__interactive_share if priority_ == "batch" else 0.0)
+                if shared_budget is not None:
+                    shared_budget.acquire()
+        if not self.__gate.acquire(priority_, blocking=False):
+            with _phase(self, "queue wait", priority=priority_):
+                self.__gate.acquire(priority_)
+        try:
+            if shared_budget is None:
+                return self.__send(priority_, method, url, **kwargs)
+            with shared_budget.slot():
+                return self.__send(priority_, method, url, **kwargs)
+        finally:
+            self.__gate.release(priority_)
+
+    def __send(self, priority_, method, url, **kwargs):
+        """
+        Send an HTTP request for __request() with timeouts that don't overrun the
+        current deadline, and count it as in flight while it's being sent.
+        """
+        connect_timeout, read_timeout = self.__timeout
+        remaining = _remaining()
+        if remaining is not None:
+            connect_timeout = min(connect_timeout, remaining)
+            read_timeout = min(read_timeout, remaining)
+        with self.__in_flight_lock:
+            self.__in_flight += 1
+        try:
+            with _phase(self, "network", method=method, url=url, priority=priority_):
+                response = self.__sessions[priority_].request(method, self.__host + url, auth=(self.__token, ""),
+                                                  timeout=(connect_timeout, read_timeout), **kwargs)
+                _annotate(status_code=response.status_code)
+                return response
+        except requests.Timeout as exc:
+            if remaining is not None and remaining <= max(connect_timeout, read_timeout):
+                raise DeadlineExceeded("Deadline exceeded during {} {}".format(method, url)) from exc
+            raise
+        finally:
+            with self.__in_flight_lock:
+                self.__in_flight -= 1
+
+    def http_get(self, url, params=None):
+        """
+        Perform an HTTP GET request to the Bookalope server. If the response
+        content type is JSON then this function returns whatever object was
+        encoded in JSON; if the response contains an attachment then this
+        function returns that attachment as a byte array.
+
+        Unless disabled for this client, concurrent calls with identical URL and
+        parameters share a single server request and all receive its result (or
+        its exception). Callers must therefore not modify a returned dictionary.
+
+        :param str url: The URL string of the service endpoint.
+        :param dict params: An optional dictionary of param/value pairs that
+                            is URL encoded and passed as part of the URL string.
+
+        :returns: Depending on the response, either a dictionary or file download.
+
+        :raises: An HTTP exception if the server responded with anything but
+                 OK (200) or if the response contained unexpected header/body
+                 data; BookalopeError if there was a server version mismatch.
+        """
+        if self.__single_flight is None:
+            return self.__http_get(url, params)
+        key = (_PRIORITY.get() or "interactive", url, tuple(sorted((params or {}).items())))
+        return self.__single_flight.do(key, lambda: self.__http_get(url, params))
+
+    def __http_get(self, url, params):
+        """
+        Perform the actual HTTP GET request for http_get(). The response body is
+        streamed so that an attachment is only read once the client's byte budget
+        has room for it.
+        """
+        response = self.__request("GET", url, params=params, stream=True)
+        with response:
+            if response.status_code == requests.codes.ok:
+                if not response.headers["X-Bookalope-Api-Version"] == _API_VERSION:
+                    raise BookalopeError("Invalid API server version, please update this client")
+                if response.headers["Content-Type"].startswith("application/json"):
+                    with _phase(self, "json decode"):
+                        return response.json()
+                if response.headers["Content-Disposition"].startswith("attachment"):
+                    with self.reserve_bytes(int(response.headers.get("Content-Length") or 0)):
+                        return response.content
+            response.raise_for_status()
+            assert not "Implement: missed a success code"
+
+    def http_get_items(self, url, key, params=None, chunk_size=65536):
+        """
+        Perform an HTTP GET request to the Bookalope server whose JSON response
+        contains an array under the given key, and yield the elements of that
+        array one by one while the response body is still being received.
+
+        :param str url: The URL string of the service endpoint.
+        :param str key: The name of the array in the JSON response, e.g. 'books'.
+        :param dict params: An optional dictionary of param/value pairs that
+                            is URL encoded and passed as part of the URL string.
+        :param int chunk_size: The number of bytes read from the network at once.
+
+        :returns: A generator of the decoded array elements.
+
+        :raises: An HTTP exception if the server responded with anything but
+                 OK (200); BookalopeError if there was a server version mismatch
+                 or if the response was not JSON.
+        """
+        response = self.__request("GET", url, params=params, stream=True)
+        with response:
+            if response.status_code != requests.codes.ok:
+                response.raise_for_status()
+                assert not "Implement: missed a success code"
+            if not response.headers["X-Bookalope-Api-Version"] == _API_VERSION:
+                raise BookalopeError("Invalid API server version, please update this client")
+            if not response.headers["Content-Type"].startswith("application/json"):
+                raise BookalopeError("Unexpected response content, expected JSON")
+            yield from _iter_json_array(response.iter_content(chunk_size), key)
+
+    @contextlib.contextmanager
+    def http_stream(self, url, params=None):
+        """
+        Perform an HTTP GET request to the Bookalope server whose response is an
+        attachment, and return a context manager that provides the response with
+        its body not yet read; use response.iter_content() to stream the body.
+
+        :param str url: The URL string of the service endpoint.
+        :param dict params: An optional dictionary of param/value pairs that
+                            is URL encoded and passed as part of the URL string.
+
+        :returns: A context manager for a requests.Response instance.
+
+        :raises: An HTTP exception if the server responded with anything but
+                 OK (200); BookalopeError if there was a server version mismatch
+                 or if the response was not an attachment.
+        """
+        with self.__request("GET", url, params=params, stream=True) as response:
+            if response.status_code != requests.codes.ok:
+                response.raise_for_status()
+                assert not "Implement: missed a success code"
+            if not response.headers["X-Bookalope-Api-Version"] == _API_VERSION:
+                raise BookalopeError("Invalid API server version, please update this client")
+            if not response.headers.get("Content-Disposition", "").startswith("attachment"):
+                raise BookalopeError("Unexpected response content, expected an attachment")
+            yield response
+
+    def http_download(self, url, filename, params=None, retries=5, chunk_size=65536):
+        """
+        Perform an HTTP GET request to the Bookalope server whose response is an
+        attachment, and stream that attachment into the given file. The download
+        is written to a partial file first; if the connection drops and the server
+        supports byte ranges then the download continues where it stopped using
+        HTTP Range requests, otherwise it starts over. A partial file left behind
+        by an earlier, interrupted call is resumed as well, and discarded if the
+        server ignores the range or the completed file doesn't check out. The
+        completed file is checked against the expected length and, if the server
+        sent a digest, its SHA-256 checksum.
+
+        :param str url: The URL string of the service endpoint.
+        :param str filename: The name of the file to write.
+        :param dict params: An optional dictionary of param/value pairs that
+                            is URL encoded and passed as part of the URL string.
+        :param int retries: The number of times a failed transfer is resumed.
+        :param int chunk_size: The number of bytes read from the network at once.
+
+        :returns tuple: The size of the file in bytes, and its SHA-256 hex digest.
+
+        :raises: An HTTP exception if the server responded with an error, or if
+                 the transfer failed more than `retries` times; BookalopeError if
+                 there was a server version mismatch or if the downloaded file
+                 didn't check out.
+        """
+        partial = filename + ".part"
+        # A partial file of an earlier call may be stale, e.g. if the attachment
+        # changed since; then it's discarded once the completed file is checked.
+        stale = os.path.exists(partial)
+        attempt = 0
+        while True:
+            offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+            headers = {"Range": "bytes={}-".format(offset)} if offset else None
+            try:
+                with self.__request("GET", url, params=params, headers=headers, stream=True) as response:
+                    if response.status_code == requests.codes.requested_range_not_satisfiable and offset:
+                        # The partial file is as long as the attachment, or longer. If it's
+                        # exactly as long then it's complete, and checked below.
+                        match = re.match(r"bytes \*/(\d+)", response.headers.get("Content-Range", ""))
+                        if match and int(match.group(1)) == offset:
+                            length, digest = offset, _sha256_digest(response.headers)
+                            break
+                        os.remove(partial)
+                        stale = False
+                        continue
+                    if response.status_code not in (requests.codes.ok, requests.codes.partial_content):
+                        response.raise_for_status()
+                        assert not "Implement: missed a success code"
+                    if not response.headers["X-Bookalope-Api-Version"] == _API_VERSION:
+                        raise BookalopeError("Invalid API server version, please update this client")
+                    digest = _sha256_digest(response.headers)
+                    if response.status_code == requests.codes.partial_content:
+                        match = re.match(r"bytes (\d+)-\d+/(\d+)", response.headers.get("Content-Range", ""))
+                        if not match or int(match.group(1)) != offset:
+                            raise BookalopeError("Unexpected Content-Range in response")
+                        length = int(match.group(2))
+                        mode = "ab"
+                    else:
+                        # The server sent the whole file, regardless of a Range request.
+                        length = int(response.headers.get("Content-Length") or -1)
+                        mode = "wb"
+                        stale = False
+                    with open(partial, mode) as file_, self.reserve_bytes(chunk_size):
+                        for chunk in response.iter_content(chunk_size):
+                            file_.write(chunk)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                attempt += 1
+                _annotate(retries=attempt)
+                if attempt > retries:
+                    raise
+                _sleep(min(30.0, 0.5 * 2 ** attempt))
+        size = os.path.getsize(partial)
+        sha256 = hashlib.sha256()
+        with open(partial, "rb") as file_:
+            for chunk in iter(lambda: file_.read(chunk_size), b""):
+                sha256.update(chunk)
+        if (length >= 0 and size != length) or (digest is not None and digest != sha256.digest()):
+            os.remove(partial)
+            if stale:
+                return self.http_download(url, filename, params, retries, chunk_size)
+            raise BookalopeError("Downloaded file is corrupt: {}".format(filename))
+        os.replace(partial, filename)
+        _annotate(bytes=size)
+        return size, sha256.hexdigest()
+
+    def http_post(self, url, params, body=None):
+        """
+        Perform an HTTP POST request to the Bookalope server. A response may or
+        may not contain a body, so this function returns either whatever object
+        was encoded in JSON; or None.
+
+        :param str url: The URL string of the service endpoint.
+        :param dict params: An optional dictionary of param/value pairs that will
+                            be JSON encoded and passed in the request body.
+        :param body: Instead of params, an optional iterable of bytes with a length
+                     that's streamed as the JSON request body, see _Base64Upload.
+
+        :returns: Depending on the response, either a dictionary or None.
+
+        :raises: An HTTP exception if the server responded with anything but
+                 OK (200) or CREATED (201); BookalopeError if there was a server
+                 version mismatch.
+        """
+        response = None
+        sizes = [0, 0]
+        compressed = self.__compress(params, body, sizes)
+        if compressed is not None:
+            response = self.__request("POST", url, data=compressed, headers={
+                "Content-Type": "application/json",
+                "Content-Encoding": self.__compression,
+                })
+            if _rejects_encoding(response):
+                # The server doesn't accept compressed bodies, so try again without.
+                response.close()
+                response = None
+            elif response.ok:
+                self.__count_compression(*sizes)
+        if response is None:
+            if body is not None:
+                response = self.__request("POST", url, data=body, headers={"Content-Type": "application/json"})
+            else:
+                response = self.__request("POST", url, json=params)
+            if compressed is not None and response.ok:
+                with self.__compression_lock:
+                    self.__compression_rejected = True
+                    self.__compression_stats["rejected"] += 1
+        if response.status_code in [requests.codes.ok, requests.codes.created]:
+            if not response.headers["X-Bookalope-Api-Version"] == _API_VERSION:
+                raise BookalopeError("Invalid API server version, please update this client")
+            if int(response.headers["Content-Length"]):
+                # TODO: Check that Content-Type is JSON?
+                return response.json()
+            return None
+        response.raise_for_status()
+        assert not "Implement: missed a success code"
+
+    def __compress(self, params, body, sizes):
+        """
+        Return the compressed request body for http_post(), either as bytes or as
+        a generator of bytes if the body is streamed; or None if this client
+        doesn't compress, or the body is too small or doesn't compress well. The
+        given sizes list receives the body's size before and after compression
+        once it's been compressed.
+        """
+        if self.__compression is None or self.__compression_rejected:
+            return None
+        if body is None:
+            if params is None:
+                return None
+            data = json.dumps(params).encode()
+            if len(data) < _COMPRESSION_THRESHOLD or not _probe_compression(data[:_COMPRESSION_PROBE]):
+                self.__count_compression(len(data), None)
+                return None
+            with _phase(self, "compress"):
+                compressor = zlib.compressobj(6, zlib.DEFLATED, _COMPRESSION_WBITS[self.__compression])
+                compressed = compressor.compress(data) + compressor.flush()
+            sizes[:] = len(data), len(compressed)
+            return compressed
+        if len(body) < _COMPRESSION_THRESHOLD:
+            self.__count_compression(len(body), None)
+            return None
+        chunks = iter(body)
+        head = []
+        head_size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            head_size += len(chunk)
+            if head_size >= _COMPRESSION_PROBE:
+                break
+        if not _probe_compression(b"".join(head)[:_COMPRESSION_PROBE]):
+            self.__count_compression(len(body), None)
+            return None
+        return self.__compress_chunks(itertools.chain(head, chunks), sizes)
+
+    def __compress_chunks(self, chunks, sizes):
+        """
+        Yield the compressed form of the given streamed request body chunks, and
+        store the body's size before and after compression in the sizes list.
+        """
+        compressor = zlib.compressobj(6, zlib.DEFLATED, _COMPRESSION_WBITS[self.__compression])
+        size, compressed_size = 0, 0
+        for chunk in chunks:
+            size += len(chunk)
+            with _phase(self, "compress"):
+                compressed = compressor.compress(chunk)
+            if compressed:
+                compressed_size += len(compressed)
+                yield compressed
+        compressed = compressor.flush()
+        compressed_size += len(compressed)
+        yield compressed
+        sizes[:] = size, compressed_size
+
+    def __count_compression(self, size, compressed_size):
+        """
+        Record a request body of the given size that was compressed to the given
+        size, or sent uncompressed if compressed_size is None.
+        """
+        with self.__compression_lock:
+            if compressed_size is None:
+                self.__compression_stats["skipped"] += 1
+            else:
+                self.__compression_stats["compressed"] += 1
+                self.__compression_stats["bytes_in"] += size
+                self.__compression_stats["bytes_out"] += compressed_size
+
+    def http_delete(self, url):
+        """
+        Perform an HTTP DELETE request to the Bookalope server.
+
+        :param str url: The URL of the service endpoint.
+
+        :returns: None
+
+        :raises: An HTTP exception if the server responded with anything but
+                 NO CONTENT (204); BookalopeError if there was a server version
+                 mismatch.
+        """
+        response = self.__request("DELETE", url)
+        if not response.headers["X-Bookalope-Api-Version"] == _API_VERSION:
+            raise BookalopeError("Invalid API server version, please update this client")
+        if response.status_code == requests.codes.no_content:
+            return None
+        response.raise_for_status()
+        assert not "Implement: missed a success code"
+
+    def set_host(self, beta_host=False, host=None):
+        """
+        Set the host name of the Bookalope server that this client should use for all subsequent
+        requests. Defaults to the production host.
+
+        :param beta_host bool: True if the client should use Bookalope's Beta server, False otherwise.
+        :param host str: An optional URL of another server, e.g. a local stand-in server for testing,
+                         that takes precedence over beta_host.
+        """
+        if host:
+            self.__host = host.rstrip("/")
+        elif beta_host:
+            self.__host = "https://beta.bookalope.net"
+        else:
+            self.__host = "https://bookflow.bookalope.net"
+
+    @property
+    def host(self):
+        """Return the host name of the Bookalope server that this client currently uses."""
+        return self.__host
+
+    @property
+    def artifact_cache(self):
+        """Return the ArtifactCache instance of this client, or None."""
+        return self.__artifact_cache
+
+    @artifact_cache.setter
+    def artifact_cache(self, artifact_cache):
+        """
+        Set the cache for downloaded conversions and images of this client.
+
+        :param artifact_cache: An ArtifactCache instance, or None to disable caching.
+        """
+        self.__artifact_cache = artifact_cache
+
+    @property
+    def profiler(self):
+        """Return the Profiler instance of this client, or None."""
+        return self.__profiler
+
+    @profiler.setter
+    def profiler(self, profiler):
+        """
+        Set the profiler that records the phases of this client's operations.
+
+        :param profiler: A Profiler instance, or None to disable profiling.
+        """
+        self.__profiler = profiler
+
+    @property
+    def warm_start_cache(self):
+        """Return the WarmStartCache instance of this client, or None."""
+        return self.__warm_start_cache
+
+    @warm_start_cache.setter
+    def warm_start_cache(self, warm_start_cache):
+        """
+        Set a WarmStartCache instance that keeps the server's formats, styles and
+        the user profile on disk for the next process, or None to always query
+        the server.
+
+        :param warm_start_cache: A WarmStartCache instance, or None.
+        """
+        self.__warm_start_cache = warm_start_cache
+
+    @property
+    def tracer(self):
+        """Return the Tracer instance of this client, or None."""
+        return self.__tracer
+
+    @tracer.setter
+    def tracer(self, tracer):
+        """
+        Set a Tracer instance that records spans for this client's requests and
+        the phases of a bookflow's lifecycle, or None to stop tracing.
+
+        :param tracer: A Tracer instance, or None.
+        """
+        self.__tracer = tracer
+
+    @property
+    def conversion_stats(self):
+        """Return the ConversionStats instance of this client, or None."""
+        return self.__conversion_stats
+
+    @conversion_stats.setter
+    def conversion_stats(self, conversion_stats):
+        """
+        Set the store of observed analysis and conversion durations.
+
+        :param conversion_stats: A ConversionStats instance, or None.
+        """
+        self.__conversion_stats = conversion_stats
+
+    @property
+    def image_optimizer(self):
+        """Return the ImageOptimizer instance of this client, or None."""
+        return self.__image_optimizer
+
+    @image_optimizer.setter
+    def image_optimizer(self, image_optimizer):
+        """
+        Set the optimizer that shrinks images before they are uploaded.
+
+        :param image_optimizer: An ImageOptimizer instance, or None to upload
+                                images verbatim.
+        """
+        self.__image_optimizer = image_optimizer
+
+    def reserve_bytes(self, nbytes):
+        """
+        Return a context manager that reserves the given number of bytes from
+        this client's in-flight byte budget for the duration of a transfer, and
+        that blocks until the reservation fits under the budget's ceiling. A
+        transfer larger than the ceiling waits until it can run alone. Without
+        a budget this is a no-op.
+
+        :param int nbytes: The estimated memory footprint of the transfer.
+        :raises: DeadlineExceeded if the current deadline expired while waiting.
+        """
+        if self.__byte_budget is None:
+            return contextlib.nullcontext()
+        return self.__byte_budget.reserve(nbytes)
+
+    def set_rate_limit(self, rate_limit):
+        """
+        Limit the number of requests per second that this client sends to the
+        Bookalope server.
+
+        :param float rate_limit: The maximum number of requests per second, or
+                                 None to remove the limit.
+        """
+        self.__rate_limiter = _RateLimiter(rate_limit) if rate_limit else None
+
+    @property
+    def compression(self):
+        """Return the Content-Encoding used for large request bodies, or None."""
+        return self.__compression
+
+    @compression.setter
+    def compression(self, compression):
+        """
+        Set the Content-Encoding for large request bodies that compress well, or
+        None to always send plain request bodies. If the server rejects a
+        compressed body then it's sent again uncompressed, and this client stops
+        compressing.
+
+        :param str compression: "gzip", "deflate", or None.
+        """
+        if compression is not None and compression not in _COMPRESSION_WBITS:
+            raise ValueError("Unsupported compression: {}".format(compression))
+        self.__compression = compression
+
+    @property
+    def compression_stats(self):
+        """
+        Return a dictionary with the number of request bodies that were compressed,
+        skipped because they were small or didn't compress well, and rejected by
+        the server; and the number of bytes before and after compression, and the
+        number of bytes saved.
+        """
+        with self.__compression_lock:
+            stats = {_: self.__compression_stats[_]
+                     for _ in ("compressed", "skipped", "rejected", "bytes_in", "bytes_out")}
+            stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+            stats["enabled"] = self.__compression is not None and not self.__compression_rejected
+        return stats
+
+    @property
+    def shared_budget(self):
+        """Return the SharedBudget instance that this client draws from, or None."""
+        return self.__shared_budget
+
+    @shared_budget.setter
+    def shared_budget(self, shared_budget):
+        """
+        Set a SharedBudget instance that limits the requests of this client
+        together with the requests of other processes, in addition to this
+        client's own rate limit; or None to remove it.
+
+        :param shared_budget: A SharedBudget instance, or None.
+        """
+        self.__shared_budget = shared_budget
+
+    @property
+    def in_flight(self):
+        """Return the number of requests that this client is currently sending."""
+        return self.__in_flight
+
+    @property
+    def token(self):
+        """Return the Bookalope auth token of this client instance, or None."""
+        return self.__token
+
+    @token.setter
+    def token(self, token):
+        """
+        Set the Bookalope auth token for this client instance.
+
+        :param str token: The auth token as provided by the website.
+        :raises: TokenError if the token is invalid.
+        """
+        if _is_token(token):
+            self.__token = token
+        else:
+            raise TokenError(token)
+
+    @property
+    def status_monitor(self):
+        """
+        Return the StatusMonitor instance owned by this client, which polls the
+        status of all watched bookflows and conversions. The monitor is created
+        on first access.
+        """
+        with self.__status_monitor_lock:
+            if self.__status_monitor is None:
+                self.__status_monitor = StatusMonitor(self)
+            return self.__status_monitor
+
+    @property
+    def has_status_monitor(self):
+        """Return True if this client's StatusMonitor was created, without creating it."""
+        return self.__status_monitor is not None
+
+    def get_profile(self):
+        """
+        Query the Bookalope server for the user profile data associated with the
+        auth token. Return a new Profile instance that represents a Bookalope
+        user profile.
+        """
+        return Profile(self, self.__warm_get("/api/profile"))
+
+    def get_styles(self, format_):
+        """
+        Query the Bookalope server for all available design styles for the given
+        target file format.
+
+        :param str format: The target file format, one of 'epub', 'epub3',
+                           'mobi', 'pdf', 'icml', 'docx'.
+        :returns list: Returns a list of Style instances, each of which describes
+                       an available design style.
+        """
+        params = {
+            "format": format_,
+            }
+        styles = self.__warm_get("/api/styles", params)["styles"]
+        return [Style(format_, _) for _ in styles]
+
+    def __get_formats(self):
+        """
+        Query the Bookalope server for all supported import and export formats
+        once, and return the cached result thereafter.
+        """
+        if self.__formats is None:
+            self.__formats = self.__warm_get("/api/formats")["formats"]
+        return self.__formats
+
+    def __warm_get(self, url, params=None):
+        """
+        Like http_get() for the catalog endpoints, but return the response from
+        the client's warm-start cache if it has a fresh one, and store a new
+        response in the cache.
+        """
+        cache = self.__warm_start_cache
+        if cache is None:
+            return self.http_get(url, params)
+        result = cache.get(self, url, params)
+        if result is None:
+            result = self.http_get(url, params)
+            cache.put(self, url, result, params)
+        return result
+
+    def get_export_formats(self):
+        """
+        Query the Bookalope server for all available export file formats. The
+        server's response is cached by this client.
+
+        :returns list: Returns a list of Format instances, each of which describes
+                       a supported export file format.
+        """
+        formats = self.__get_formats()
+        return [Format(format_) for format_ in formats["export"]]
+
+    def get_import_formats(self):
+        """
+        Query the Bookalope server for all available import file formats. The
+        server's response is cached by this client.
+
+        :returns list: Returns a list of Format instances, each of which describes
+                       a supported import file format.
+        """
+        formats = self.__get_formats()
+        return [Format(format_) for format_ in formats["import"]]
+
+    def get_bookshelves(self):
+        """
+        Queries the Bookalope server for all Bookshelves of the user.
+
+        :returns list: Returns a list of Bookshelf instances for this user.
+        """
+        bookshelves = self.http_get("/api/bookshelves")
+        return [Bookshelf(self, _) for _ in bookshelves["bookshelves"]]
+
+    def iter_bookshelves(self):
+        """
+        Queries the Bookalope server for all Bookshelves of the user, and yields
+        them one at a time while the server response is being received. Unlike
+        get_bookshelves() this keeps memory use flat for large accounts.
+
+        :returns: A generator of Bookshelf instances for this user.
+        """
+        for bookshelf in self.http_get_items("/api/bookshelves", "bookshelves"):
+            yield Bookshelf(self, bookshelf)
+
+    def get_books(self):
+        """
+        Queries the Bookalope server for all books associated with the user.
+
+        :returns list: Returns a list of Book instances for this user.
+        """
+        books = self.http_get("/api/books")
+        return [Book(self, _) for _ in books["books"]]
+
+    def iter_books(self):
+        """
+        Queries the Bookalope server for all books associated with the user, and
+        yields them one at a time while the server response is being received.
+        Unlike get_books() this keeps memory use flat for large accounts.
+
+        Note that the Bookshelf instances of the yielded books are built from the
+        bookshelf information embedded in the book listing, and are shared among
+        the books of the same bookshelf. Their list of books is empty, call their
+        update() to fetch it.
+
+        :returns: A generator of Book instances for this user.
+        """
+        bookshelves = {}
+        for book in self.http_get_items("/api/books", "books"):
+            bookshelf = None
+            if book["bookshelf"]:
+                bookshelf_id = book["bookshelf"]["id"]
+                bookshelf = bookshelves.get(bookshelf_id)
+                if bookshelf is None:
+                    packed = dict(book["bookshelf"], books=[])
+                    bookshelf = bookshelves[bookshelf_id] = Bookshelf(self, packed)
+            yield Book(self, book, bookshelf=bookshelf)
+
+    def create_book(self, name=None, bookshelf=None):
+        """
+        Create a new Book instance with the given name. Note that the books has
+        not been saved to the Bookalope server yet, and needs to be saved. The
+        new book has a default name '<none>' which should be changed. Note that
+        the new book will also have a single empty Bookflow instance.
+
+        :param bookshelf: An optional Bookshelf instance to associate with the
+                          new Book.
+        :param str name: An optional name for the new Book.
+        :returns: A Book instance for the new book.
+        """
+        return Book(self, name=name, bookshelf=bookshelf)
+
+    def bulk_delete_books(self, books, max_workers=8, retries=3):
+        """
+        Delete many books (and all of their bookflows) from the Bookalope server
+        concurrently. Failures don't stop the operation, but are reported.
+
+        :param books: An iterable of Book instances or book id strings.
+        :param int max_workers: The maximum number of concurrent requests.
+        :param int retries: The number of retries for a rate-limited request.
+        :returns list: A list of BulkResult instances in the order of the books.
+        """
+        def _delete(book):
+            if isinstance(book, Book):
+                return book.delete()
+            if not _is_token(book):
+                raise TokenError(book)
+            return self.http_delete("/api/books/" + book)
+
+        return self.__bulk(_delete, books, max_workers, retries)
+
+    def bulk_move_books(self, books, bookshelf, max_workers=8, retries=3):
+        """
+        Move many books onto the given bookshelf concurrently, or remove them
+        from their bookshelves. Failures don't stop the operation, but are reported.
+
+        :param books: An iterable of Book instances or book id strings.
+        :param bookshelf: A Bookshelf instance or bookshelf id string, or None to
+                          remove the books from their bookshelves.
+        :param int max_workers: The maximum number of concurrent requests.
+        :param int retries: The number of retries for a rate-limited request.
+        :returns list: A list of BulkResult instances in the order of the books.
+        :raises: TokenError if the bookshelf id is invalid.
+        """
+        if isinstance(bookshelf, Bookshelf):
+            bookshelf = bookshelf.id
+        elif bookshelf is not None and not _is_token(bookshelf):
+            raise TokenError(bookshelf)
+
+        def _move(book):
+            if isinstance(book, Book):
+                book = book.id
+            elif not _is_token(book):
+                raise TokenError(book)
+            params = {
+                "bookshelf_id": bookshelf,
+                }
+            return self.http_post("/api/books/" + book, params)
+
+        return self.__bulk(_move, books, max_workers, retries)
+
+    def bulk_save(self, objects, max_workers=8, retries=3):
+        """
+        Save many Bookshelf, Book, or Bookflow instances to the Bookalope server
+        concurrently. Failures don't stop the operation, but are reported.
+
+        :param objects: An iterable of instances that implement save().
+        :param int max_workers: The maximum number of concurrent requests.
+        :param int retries: The number of retries for a rate-limited request.
+        :returns list: A list of BulkResult instances in the order of the objects.
+        """
+        return self.__bulk(lambda obj: obj.save(), objects, max_workers, retries)
+
+    def bulk_set_credit(self, bookflows, credit, max_workers=8, retries=3):
+        """
+        Add the specified credit type to many bookflows concurrently. Failures
+        don't stop the operation, but are reported.
+
+        :param bookflows: An iterable of Bookflow instances or bookflow id strings.
+        :param str credit: The credit type, either 'basic' or 'pro'.
+        :param int max_workers: The maximum number of concurrent requests.
+        :param int retries: The number of retries for a rate-limited request.
+        :returns list: A list of BulkResult instances in the order of the bookflows.
+        :raises: BookflowError if the credit type is invalid.
+        """
+        if credit not in ("basic", "pro"):
+            raise BookflowError("Invalid credit type")
+
+        def _credit(bookflow):
+            if isinstance(bookflow, Bookflow):
+                return bookflow.set_credit(credit)
+            if not _is_token(bookflow):
+                raise TokenError(bookflow)
+            params = {
+                "type": credit,
+                }
+            return self.http_post("/api/bookflows/{}/credit".format(bookflow), params)
+
+        return self.__bulk(_credit, bookflows, max_workers, retries)
+
+    def __bulk(self, func, items, max_workers, retries):
+        """
+        Apply the given function to all items using a bounded number of threads.
+        Requests that were rejected with TOO MANY REQUESTS (429) are retried after
+        the delay the server asked for. Unless the caller chose a priority, the
+        requests are batch traffic.
+
+        :returns list: A list of BulkResult instances in the order of the items.
+        """
+        def _apply(item):
+            for attempt in range(retries + 1):
+                try:
+                    return BulkResult(item, func(item), None)
+                except requests.HTTPError as exc:
+                    response = exc.response
+                    if response is None or response.status_code != requests.codes.too_many_requests or attempt == retries:
+                        return BulkResult(item, None, exc)
+                    try:
+                        delay = float(response.headers.get("Retry-After", 1))
+                    except ValueError:
+                        delay = 1.0
+                    try:
+                        _sleep(delay)
+                    except DeadlineExceeded as deadline_exc:
+                        return BulkResult(item, None, deadline_exc)
+                except Exception as exc:  # pylint: disable=broad-except
+                    return BulkResult(item, None, exc)
+
+        with _default_priority("batch"), concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return _map(executor, _apply, items)
+
+
+class ClientPool(object):
+    """
+    A ClientPool spreads work across several Bookalope accounts: it manages
+    one BookalopeClient per API token, each with its own connection pool and
+    rate limit. New books go to the least loaded client, and all subsequent
+    operations on a book and its bookflows stay with the client (and thus the
+    token) that created them.
+    """
+
+    def __init__(self, tokens, **kwargs):
+        """
+        Initialize this ClientPool with one client per token.
+
+        :param tokens: An iterable of Bookalope auth token strings.
+        :param kwargs: Arguments passed on to every BookalopeClient, e.g.
+                       beta_host, rate_limit, or max_connections.
+        :raises TokenError: If a token is invalid.
+        """
+        self.__clients = []
+        for token in tokens:
+            if not _is_token(token):
+                raise TokenError(token)
+            self.__clients.append(BookalopeClient(token=token, **kwargs))
+        if not self.__clients:
+            raise BookalopeError("A client pool requires at least one token")
+        self.__pins = {}
+        self.__books = collections.Counter()
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps({
+                "clients": len(self.__clients),
+                "pinned": len(self.__pins),
+                }))
+        return repr_s
+
+    @property
+    def clients(self):
+        """Return the list of BookalopeClient instances of this pool."""
+        return list(self.__clients)
+
+    def load(self, client):
+        """
+        Return the current load of the given client: the number of its requests
+        in flight plus the number of bookflows and conversions it is watching.
+
+        :param client: A BookalopeClient instance of this pool.
+        :returns int: The load of the client.
+        """
+        watched = len(client.status_monitor) if client.has_status_monitor else 0
+        return client.in_flight + watched
+
+    def least_loaded(self):
+        """
+        Return the BookalopeClient instance of this pool with the least load; ties
+        go to the client that created the fewest books through this pool.
+        """
+        with self.__lock:
+            return min(self.__clients, key=lambda _: (self.load(_), self.__books[id(_)]))
+
+    def create_book(self, name=None, bookshelf=None):
+        """
+        Create a new Book using the least loaded client, and pin the book and its
+        bookflow to that client. If a bookshelf is given then the book is created
+        by the client that owns the bookshelf.
+
+        :param str name: An optional name for the new Book.
+        :param bookshelf: An optional Bookshelf instance for the new Book.
+        :returns: A Book instance for the new book.
+        """
+        client = self.client_for(bookshelf) if bookshelf is not None else self.least_loaded()
+        with self.__lock:
+            self.__books[id(client)] += 1
+        book = client.create_book(name=name, bookshelf=bookshelf)
+        self.pin(book, client)
+        return book
+
+    def create_bookshelf(self, name=None, description=None):
+        """
+        Create a new Bookshelf using the least loaded client, and pin it to that
+        client.
+
+        :param str name: An optional name for the new Bookshelf.
+        :param str description: An optional description for the new Bookshelf.
+        :returns: A Bookshelf instance for the new bookshelf.
+        """
+        client = self.least_loaded()
+        bookshelf = Bookshelf(client, name=name, description=description)
+        self.pin(bookshelf, client)
+        return bookshelf
+
+    def pin(self, obj, client):
+        """
+        Pin the given Bookshelf, Book (and its Bookflows) or Bookflow, or the id
+        of one, to the given client of this pool.
+
+        :param obj: A Bookshelf, Book or Bookflow instance, or an id string.
+        :param client: A BookalopeClient instance of this pool.
+        """
+        assert client in self.__clients
+        ids = [obj] if isinstance(obj, str) else [obj.id]
+        if isinstance(obj, Book):
+            ids += [_.id for _ in obj.bookflows]
+        with self.__lock:
+            for id_ in ids:
+                self.__pins[id_] = client
+
+    def client_for(self, obj):
+        """
+        Return the client of this pool that the given object is pinned to. A
+        Bookflow that isn't pinned itself follows its Book.
+
+        :param obj: A Bookshelf, Book or Bookflow instance, or an id string.
+        :returns: A BookalopeClient instance.
+        :raises: BookalopeError if the object is not pinned to a client.
+        """
+        with self.__lock:
+            client = self.__pins.get(obj if isinstance(obj, str) else obj.id)
+            if client is None and isinstance(obj, Bookflow):
+                client = self.__pins.get(obj.book.id)
+        if client is None:
+            raise BookalopeError("Object is not pinned to a client of this pool: {}".format(obj))
+        return client
+
+    def get_book(self, book_id):
+        """
+        Return a Book instance for the given pinned book id, queried through the
+        client that the book is pinned to.
+
+        :param str book_id: A book id.
+        :returns: A Book instance.
+        """
+        return Book(self.client_for(book_id), book_id)
+
+    def close(self):
+        """Stop the status monitors of all clients."""
+        for client in self.__clients:
+            if client.has_status_monitor:
+                client.status_monitor.close()
+
+
+_WORKER_CLIENT = None
+
+
+def _init_worker(client_kwargs, shared_budget):
+    """
+    Initialize a ProcessRunner worker process: create the process's own client,
+    which draws from the budget shared by all workers.
+    """
+    global _WORKER_CLIENT
+    _WORKER_CLIENT = BookalopeClient(**client_kwargs)
+    _WORKER_CLIENT.shared_budget = shared_budget
+
+
+def _run_in_worker(func, item):
+    """
+    Call the given function with the worker process's client and the given item,
+    and return the outcome as a BulkResult. An exception that can't be sent back
+    to the parent process is replaced by a BookalopeError.
+    """
+    try:
+        return BulkResult(item, func(_WORKER_CLIENT, item), None)
+    except Exception as exc:
+        try:
+            pickle.dumps(exc)
+        except Exception:
+            exc = BookalopeError("{}: {}".format(exc.__class__.__name__, exc))
+        return BulkResult(item, None, exc)
+
+
+class ProcessRunner(object):
+    """
+    A ProcessRunner spreads CPU-bound work like encoding documents or parsing
+    large listings across a pool of worker processes. Every worker creates its
+    own BookalopeClient, and all workers draw from one SharedBudget so that the
+    total request rate and the total number of requests in flight stay within
+    the given limits no matter how many processes run.
+    """
+
+    def __init__(self, token, processes=None, rate_limit=None, max_in_flight=None, start_method=None,
+                 **kwargs):
+        """
+        Initialize this ProcessRunner and start its worker processes.
+
+        :param str token: The user's authentication token provided by Bookalope.
+        :param int processes: The number of worker processes; defaults to the
+                              number of CPUs.
+        :param float rate_limit: An optional maximum number of requests per second
+                                 for all workers together.
+        :param int max_in_flight: An optional maximum number of requests in flight
+                                  for all workers together.
+        :param str start_method: The multiprocessing start method, e.g. "fork" or
+                                 "spawn"; defaults to the platform's default.
+        :param kwargs: Arguments passed on to every worker's BookalopeClient, e.g.
+                       beta_host, max_connections, or timeout.
+        :raises TokenError: If the given token is an invalid Bookalope token.
+        """
+        if not _is_token(token):
+            raise TokenError(token)
+        context = multiprocessing.get_context(start_method)
+        self.__shared_budget = SharedBudget(rate_limit, max_in_flight=max_in_flight, context=context)
+        client_kwargs = dict(kwargs, token=token)
+        self.__processes = processes or os.cpu_count() or 1
+        self.__pool = context.Pool(self.__processes, initializer=_init_worker,
+                                   initargs=(client_kwargs, self.__shared_budget))
+
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps({
+                "processes": self.__processes,
+                }))
+        return repr_s
+
+    def __enter__(self):
+        """Return this runner for use in a with statement."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close this runner when leaving the with statement."""
+        self.close()
+
+    @property
+    def shared_budget(self):
+        """Return the SharedBudget instance that all workers draw from."""
+        return self.__shared_budget
+
+    def map(self, func, items, ordered=True, chunksize=1):
+        """
+        Call the given function for every item in a worker process, and yield the
+        outcomes as BulkResult instances. The function is called as func(bookalope,
+        item) with the worker's BookalopeClient, and must be defined at module level
+        so that it can be sent to the workers; items and results must be picklable,
+        e.g. ids, file names, or packed dictionaries rather than model instances.
+
+        :param func: The function to call.
+        :param items: An iterable of items.
+        :param bool ordered: True to yield the results in the order of the items,
+                             False to yield them as they become available.
+        :param int chunksize: The number of items sent to a worker at once.
+        :returns: A generator of BulkResult instances.
+        """
+        imap = self.__pool.imap if ordered else self.__pool.imap_unordered
+        yield from imap(functools.partial(_run_in_worker, func), items, chunksize)
+
+    def close(self):
+        """Wait for all pending work to finish, then stop the worker processes."""
+        self.__pool.close()
+        self.__pool.join()
+
+
+class BulkResult(collections.namedtuple("BulkResult", ["item", "result", "error"])):
+    """
+    The outcome of a bulk operation for a single item: the item itself, the
+    result of the operation, and the exception if the operation failed.
+    """
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        """Return True if the operation succeeded for this item, False otherwise."""
+        return self.error is None
+
+
+class Profile(object):
+    """
+    The Profile class implements the Bookalope user profile, and provides access
+    to the profile's first and last name.
+    """
+
+    __slots__ = ("__bookalope", "__firstname", "__lastname")
+
+    def __init__(self, bookalope, packed=None):
+        """
+        Initialize this Profile instance from the current Bookalope profile data.
+
+        :param bookalope: A Bookalope instance.
+        :param dict packed: Optional profile data as returned by the server, in
+                            which case the server is not queried.
+        """
+        assert isinstance(bookalope, BookalopeClient)
+        self.__bookalope = bookalope
+        self.__firstname = None
+        self.__lastname = None
+        if packed is None:
+            self.update()
+        else:
+            self.__firstname = packed["user"]["firstname"]
+            self.__lastname = packed["user"]["lastname"]
+
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps(self.pack()))
+        return repr_s
+
+    def update(self):
+        """
+        Queries the Bookalope server for the current profile data, and updates
+        this instance with that data.
+
+        :raises: HTTP related exceptions.
+        """
+        result = self.__bookalope.http_get("/api/profile")
+        self.__firstname = result["user"]["firstname"]
+        self.__lastname = result["user"]["lastname"]
+
+    def save(self):
+        """
+        Posts this Profile's instance data to the Bookalope server, i.e. save
+        first and last name.
+
+        :raises: HTTP related exceptions.
+        """
+        params = self.pack()
+        cache = self.__bookalope.warm_start_cache
+        if cache is not None:
+            cache.invalidate(self.__bookalope, "/api/profile")
+        return self.__bookalope.http_post("/api/profile", params)
+
+    def pack(self):
+        """
+        Pack this instance data into a dictionary that can be encoded as a JSON
+        string and is compatible to the Bookalope profile data.
+
+        :returns dict: First and last name packed into a dictionary.
+        """
+        packed = {
+            "firstname": self.__firstname,
+            "lastname": self.__lastname,
+            }
+        return packed
+
+    @property
+    def firstname(self):
+        """Return the first name string of this instance."""
+        return self.__firstname
+
+    @firstname.setter
+    def firstname(self, name):
+        """
+        Change the first name of this instance to the new value.
+
+        :param str name: The new first name.
+        """
+        self.__firstname = name
+
+    @property
+    def lastname(self):
+        """Return the last name string of this instance."""
+        return self.__lastname
+
+    @lastname.setter
+    def lastname(self, name):
+        """
+        Change the last name of this instance to the new value.
+
+        :param str name: The new last name.
+        """
+        self.__lastname = name
+
+
+class Format(object):
+    """
+    A Format instance describes a file format that Bookalope supports either as
+    import or export file format. It contains the mime type of the supported file
+    format, and a list of file name extensions.
+    """
+
+    __slots__ = ("__name", "__mime", "__file_extensions")
+
+    def __init__(self, packed):
+        """
+        Initialize this Format instance from a dictionary of a packed Format.
+
+        :param dict packed: A dictionary containing packed Format information.
+        """
+        self.__name = packed["name"]
+        self.__mime = packed["mime"]
+        self.__file_extensions = packed["exts"]
+
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps(self.pack()))
+        return repr_s
+
+    def pack(self):
+        """
+        Pack this instance data into a dictionary that can be encoded as a JSON
+        string and is compatible to the Bookalope Format data.
+
+        :returns dict: This Format's information as a Bookalope compatible
+                       dictionary.
+        """
+        packed = {
+            "name": self.__name,
+            "mime": self.__mime,
+            "exts": self.__file_extensions,
+            }
+        return packed
+
+    @property
+    def name(self):
+        """Return the short name of this format."""
+        return self.__name
+
+    @property
+    def mimetype(self):
+        """Return the mime type of this format."""
+        return self.__mime
+
+    @property
+    def file_exts(self):
+        """Return a list of file extensions for this file format."""
+        return self.__file_extensions
+
+
+class Style(object):
+    """
+    For every target file format that Bookalope generates, the user can select
+    from several available design styles. This class implements a single such
+    design style.
+    """
+
+    __slots__ = ("__format", "__short_name", "__name", "__description", "__api_price")
+
+    def __init__(self, format_, packed):
+        """
+        Initialize this Style instance from a dictionary of a packed Style.
+
+        :param str format_: The file format this Style instance applies to.
+        :param dict packed: A dictionary containing packed Style information.
+        """
+        self.__format = format_
+        self.__short_name = packed["name"]
+        self.__name = packed["info"]["name"]
+        self.__description = packed["info"]["description"]
+        self.__api_price = packed["info"]["price-api"]
+
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps(self.pack()))
+        return repr_s
+
+    def pack(self):
+        """
+        Pack this instance data into a dictionary that can be encoded as a JSON
+        string and is compatible to the Bookalope Style data.
+
+        :returns dict: This Style's information as a Bookalope compatible
+                       dictionary.
+        """
+        packed = {
+            "name": self.__short_name,
+            "info": {
+                "name": self.__name,
+                "description": self.__description,
+                "price-api": self.__api_price,
+                },
+            }
+        return packed
+
+    @property
+    def format(self):
+        """Return the file format this style description refers to."""
+        return self.__format
+
+    @property
+    def short_name(self):
+        """Return the short name of this style description."""
+        return self.__short_name
+
+    @property
+    def name(self):
+        """Return the descriptive name of this style description."""
+        return self.__name
+
+    @property
+    def description(self):
+        """Return the description string for this style."""
+        return self.__description
+
+    @property
+    def api_price(self):
+        """Return the price in US$ that is charged for this style by the API."""
+        return self.__api_price
+
+
+class Bookshelf(object):
+    """
+    The Bookshelf class describes a single bookshelf as used by Bookalope. A
+    Bookshelf may be associated with zero or more Books, and its has a name.
+    """
+
+    __slots__ = ("__bookalope", "__id", "__name", "__description", "__created", "__books")
+
+    def __init__(self, bookalope, id_or_packed=None, name=None, description=None):
+        """
+        Create or initialize a new Bookshelf instance. The new Bookshelf instance is
+        created on the Bookalope server and this instance is initialized with the new
+        data. Note that the default bookshelf name is set to 'Bookshelf'.
+
+        :param bookalope: A Bookalope instance.
+        :param str id_or_packed: None to create a new Bookshelf instance; a valid
+                                 Bookalope token string with a Bookshelf id; or a
+                                 dictionary containing packed bookshelf information.
+        :param str name: An optional name for this Bookshelf.
+        :param str description: An optional description for this Bookshelf.
+        """
+        assert isinstance(bookalope, BookalopeClient)
+        self.__bookalope = bookalope
+        if id_or_packed is None:
+            params = {
+                "name": name or "Bookshelf",
+                }
+            if description:
+                params["description"] = description
+            url = "/api/bookshelves"
+            bookshelf = self.__bookalope.http_post(url, params)["bookshelf"]
+        elif isinstance(id_or_packed, str):
+            if not _is_token(id_or_packed):
+                raise TokenError(id_or_packed)
+            url = "/api/bookshelves/" + id_or_packed
+            bookshelf = self.__bookalope.http_get(url)["bookshelf"]
+        elif isinstance(id_or_packed, dict):
+            bookshelf = id_or_packed
+        else:
+            raise TypeError()
+        self.__id = bookshelf["id"]
+        self.__name = bookshelf["name"]
+        self.__description = bookshelf["description"]
+        self.__created = bookshelf["created"]  # Parsed on first access.
+        books = bookshelf["books"]
+        self.__books = [Book(self.__bookalope, _, bookshelf=self) for _ in books]
+
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps(self.pack()))
+        return repr_s
+
+    def update(self):
+        """
+        Queries the Bookalope server for this Bookshelf's server-side data, and
+        updates this instance with that data. Note that this creates a new list
+        with new Book instances, that may compete with references to older Book
+        instances.
+        """
+        bookshelf = self.__bookalope.http_get(self.url)["bookshelf"]
+        self.__name = bookshelf["name"]
+        self.__description = bookshelf["description"]
+        books = bookshelf["books"]
         self.__books = [Book(self.__bookalope, _, bookshelf=self) for _ in books]
 
-    def save(self):
+    def save(self):
+        """
+        Post this Bookshelf's instance data to the Bookalope server, i.e. stores
+        the name of this Bookshelf.
+        """
+        params = {
+            "name": self.__name,
+            "description": self.__description,
+            }
+        return self.__bookalope.http_post(self.url, params)
+
+    def delete(self):
+        """
+        Delete this Bookshelf (and all of its Books and their Bookflows) from the
+        Bookalope server. Subsequent calls to save() will fail on the server side.
+        """
+        return self.__bookalope.http_delete(self.url)
+
+    def pack(self):
+        """
+        Pack this instance data into a dictionary that can be encoded as a JSON
+        string and is compatible to the Bookalope Bookshelf data.
+
+        :returns dict: This Bookshelf's information as a Bookalope compatible
+                       dictionary.
+        """
+        packed = {
+            "id": self.__id,
+            "name": self.__name,
+            "description": self.__description,
+            "created": _format_created(self.__created),
+            "books": [_.pack() for _ in self.__books],
+            }
+        return packed
+
+    @property
+    def id(self):
+        """Return the Bookalope token id for this Bookshelf instance."""
+        return self.__id
+
+    @property
+    def url(self):
+        """Return the API endpoint URL for this Bookshelf instance."""
+        return "/api/bookshelves/" + self.__id
+
+    @property
+    def name(self):
+        """Return the name of this Bookshelf instance."""
+        return self.__name
+
+    @name.setter
+    def name(self, name):
+        """
+        Change the name of this Bookshelf instance locally. Use save() to store the
+        change to the Bookalope server.
+
+        :param str name: The new Bookshelf name.
+        """
+        self.__name = name
+
+    @property
+    def description(self):
+        """Return the description for this Bookshelf instance."""
+        return self.__description
+
+    @description.setter
+    def description(self, description):
+        """
+        Change the description for this Bookshelf instance locally. Use save() to store the
+        change to the Bookalope server.
+
+        :param str description: The new Bookshelf description.
+        """
+        self.__description = description
+
+    @property
+    def created(self):
+        """
+        Return a Python datetime instance that represents the date when this
+        Bookshelf instance was created.
+        """
+        if isinstance(self.__created, str):
+            self.__created = datetime.datetime.strptime(self.__created, "%Y-%m-%dT%H:%M:%S")
+        return self.__created
+
+    @property
+    def books(self):
+        """Return a list of Book instances associated with this Bookshelf."""
+        return self.__books
+
+    def add_book(self, book):
+        """
+        Add the given Book instance to this Bookshelf.
+
+        :param book: The Book that's being added to this Bookshelf.
+        """
+        return book.move_to_bookshelf(self)
+
+    def remove_book(self, book):
+        """
+        Remove the given Book instance from this Bookshelf.
+
+        :param book: The Book that's being added to this Bookshelf.
+        """
+        return book.remove_from_bookshelf()
+
+
+class Book(object):
+    """
+    The Book class describes a single book as used by Bookalope. A Book may be
+    associated with a Bookshelf, it has only one name, and a list of conversions:
+    the Bookflows. Note that title, author, and other information is stored as
+    part of the Bookflow, not the Book itself.
+    """
+
+    __slots__ = ("__bookalope", "__id", "__name", "__created", "__bookshelf", "__bookflows")
+
+    def __init__(self, bookalope, id_or_packed=None, name=None, bookshelf=None):
+        """
+        Create or initialize a new Book instance. The new Book instance is created
+        on the Bookalope server and this instance is initialized with the new
+        data. Note that the default book name is set to '<none>', and an empty
+        bookflow will be created for this book as well.
+
+        :param bookalope: A Bookalope instance.
+        :param bookshelf: An optional Bookshelf instance.
+        :param str id_or_packed: None to create a new Book instance; a valid
+                                 Bookalope token string with a book id; or a
+                                 dictionary containing packed book information.
+        :param str name: An optional name for this Book.
+        """
+        assert isinstance(bookalope, BookalopeClient)
+        self.__bookalope = bookalope
+        if id_or_packed is None:
+            params = {
+                "name": name or "<none>",
+                }
+            if bookshelf:
+                params["bookshelf_id"] = bookshelf.id
+            url = "/api/books"
+            with _phase(self.__bookalope, "create", span_name="create book"):
+                book = self.__bookalope.http_post(url, params)["book"]
+                _annotate(book=book["id"])
+        elif isinstance(id_or_packed, str):
+            if not _is_token(id_or_packed):
+                raise TokenError(id_or_packed)
+            url = "/api/books/" + id_or_packed
+            book = self.__bookalope.http_get(url)["book"]
+            if bookshelf and book["bookshelf"] and bookshelf.id != book["bookshelf"]["id"]:
+                raise BookflowError("Bookshelf and Book's bookshelf are not the same")
+        elif isinstance(id_or_packed, dict):
+            book = id_or_packed
+            if bookshelf and book["bookshelf"] and bookshelf.id != book["bookshelf"]["id"]:
+                raise BookflowError("Bookshelf and Book's bookshelf are not the same")
+        else:
+            raise TypeError()
+        self.__id = book["id"]
+        self.__name = book["name"]
+        self.__created = book["created"]  # Parsed on first access.
+        if bookshelf:
+            self.__bookshelf = bookshelf
+        elif book["bookshelf"]:
+            self.__bookshelf = Bookshelf(self.__bookalope, book["bookshelf"]["id"])
+        else:
+            self.__bookshelf = None
+        bookflows = book["bookflows"]
+        self.__bookflows = [Bookflow(self.__bookalope, self, _) for _ in bookflows]
+
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps(self.pack()))
+        return repr_s
+
+    def update(self):
+        """
+        Queries the Bookalope server for this Book's server-side data, and updates
+        this instance with that data. Note that this creates a new list with new
+        Bookflow instances, that may compete with references to older Bookflow
+        instances, as well as a new (optional) Bookshelf instance.
+        """
+        book = self.__bookalope.http_get(self.url)["book"]
+        self.__name = book["name"]
+        if book["bookshelf"]:
+            self.__bookshelf = Bookshelf(self.__bookalope, book["bookshelf"]["id"])
+        else:
+            self.__bookshelf = None
+        bookflows = book["bookflows"]
+        self.__bookflows = [Bookflow(self.__bookalope, self, _) for _ in bookflows]
+
+    def save(self):
+        """
+        Post this Book's instance data to the Bookalope server, i.e. stores the
+        name of this book.
+        """
+        params = {
+            "name": self.__name,
+            "bookshelf_id": self.__bookshelf.id if self.__bookshelf else None,
+            }
+        return self.__bookalope.http_post(self.url, params)
+
+    def delete(self):
+        """
+        Delete this Book from the Bookalope server. Subsequent calls to save()
+        will fail on the server side.
+        """
+        return self.__bookalope.http_delete(self.url)
+
+    def pack(self):
+        """
+        Pack this instance data into a dictionary that can be encoded as a JSON
+        string and is compatible to the Bookalope Book data.
+
+        :returns dict: This Book's information as a Bookalope compatible
+                       dictionary.
+        """
+        packed = {
+            "id": self.__id,
+            "name": self.__name,
+            "created": _format_created(self.__created),
+            "bookshelf": {
+                "id": self.__bookshelf.id,
+                "name": self.__bookshelf.name,
+                "description": self.__bookshelf.description,
+                "created": self.__bookshelf.created,
+                } if self.__bookshelf else None,
+            "bookflows": [_.pack() for _ in self.__bookflows],
+            }
+        return packed
+
+    @property
+    def id(self):
+        """Return the Bookalope token id for this Book instance."""
+        return self.__id
+
+    @property
+    def url(self):
+        """Return the API endpoint URL for this Book instance."""
+        return "/api/books/" + self.__id
+
+    @property
+    def name(self):
+        """Return the name of this Book instance."""
+        return self.__name
+
+    @name.setter
+    def name(self, name):
+        """
+        Change the name of this Book instance locally. Use save() to store the
+        change to the Bookalope server.
+
+        :param str name: The new book name.
+        """
+        self.__name = name
+
+    @property
+    def created(self):
+        """
+        Return a Python datetime instance that represents the date when this
+        Book instance was created.
+        """
+        if isinstance(self.__created, str):
+            self.__created = datetime.datetime.strptime(self.__created, "%Y-%m-%dT%H:%M:%S")
+        return self.__created
+
+    @property
+    def bookshelf(self):
+        """
+        Return the Bookshelf instance that this Book is associated with.
+        """
+        return self.__bookshelf
+
+    def move_to_bookshelf(self, bookshelf):
+        """
+        Move this Book onto the specified Bookshelf. If the Book is already associated
+        with a Bookshelf then it moves to the new one.
+
+        :param bookshelf: A Bookshelf instance to which this Book is being added.
+        """
+        assert isinstance(bookshelf, Bookshelf)
+        params = {
+            "bookshelf_id": bookshelf.id,
+            }
+        self.__bookalope.http_post(self.url, params)
+
+    def remove_from_bookshelf(self):
+        """
+        Remove this Book from its Bookshelf.
+        """
+        params = {
+            "bookshelf_id": None,
+            }
+        self.__bookalope.http_post(self.url, params)
+
+    @property
+    def bookflows(self):
+        """Return a list of Bookflow instances associated with this Book."""
+        return self.__bookflows
+
+    def create_bookflow(self, name=None, title=None):
+        """
+        Create a new Bookflow on the Bokalope server and return an initialized
+        Bookflow instance.
+
+        :param str name: An optional name for this Book.
+        :param str title: An optional title for this Book.
+        """
+        bookflow = Bookflow(self.__bookalope, self, name=name, title=title)
+        self.__bookflows += [bookflow]
+        return bookflow
+
+
+# Guards the lazily allocated conversion start times of all Bookflow instances;
+# a lock per instance would cost every Bookflow memory.
+_CONVERSIONS_STARTED_LOCK = threading.Lock()
+
+
+class Bookflow(object):
+    """
+    The Bookflow class describes a Bookalope conversion flow--the 'bookflow'. A
+    bookflow also contains the book's title, author, and other related information.
+    All document uploads, image handling, and conversion is handled by this
+    class.
+    """
+
+    __slots__ = (
+        "__bookalope", "__book", "__id", "__name", "__step", "__credit", "__title", "__author",
+        "__copyright", "__isbn", "__language", "__pubdate", "__publisher", "__document_size",
+        "__analysis_started", "__conversions_started",
+        )
+
+    def __init__(self, bookalope, book, id_or_packed=None, name=None, title=None):
+        """
+        Create or initialize a new Bookflow instance. The new bookflow is created
+        on the Bookalope server side, and this Bookflow instance is then initialized
+        from the new bookflow data. If a valid bookflow id is given, the new
+        Bookflow instance is initialized from that existing bookflow.
+
+        Note: initialization does not update the bookflow's metadata; instead
+              call update() manually. This is to prevent too many server requests.
+
+        :param bookalope: A Bookalope instance.
+        :param book: A Book instance for which this bookflow is created.
+        :param str id_or_packed: None to create a new Bookflow instance; a valid
+                                 Bookalope token string with a bookflow id; or
+                                 a dictionary containing packed bookflow information.
+        :raises: BookflowError if the Bookflow's book and the specified book are different.
+        """
+        assert isinstance(bookalope, BookalopeClient)
+        self.__bookalope = bookalope
+        if id_or_packed is None:
+            params = {
+                "name": name or "Bookflow",
+                "title": title or "<no-title>",
+                }
+            url = "/api/books/{}/bookflows".format(book.id)
+            with _phase(self.__bookalope, "create", span_name="create bookflow", book=book.id):
+                bookflow = self.__bookalope.http_post(url, params)["bookflow"]
+                _annotate(bookflow=bookflow["id"])
+        elif isinstance(id_or_packed, str):
+            if not _is_token(id_or_packed):
+                raise TokenError(id_or_packed)
+            url = "/api/bookflows/{}".format(id_or_packed)
+            bookflow = self.__bookalope.http_get(url)["bookflow"]
+            if bookflow.book.id != book.id:
+                raise BookflowError("Book and Bookflow's book are not the same")
+        elif isinstance(id_or_packed, dict):
+            bookflow = id_or_packed
+        else:
+            raise TypeError()
+        # BUGBUG: I can pass a Bookflow from a different Book here.
+        self.__id = bookflow["id"]
+        self.__name = bookflow["name"]
+        self.__step = bookflow["step"]
+        self.__credit = None
+        if bookflow.get("credit"):
+            self.__credit = bookflow["credit"]["type"]
+            # TODO: Does a client want to know formats here as well?
+        self.__book = book
+        # Metadata that can be modified.
+        # TODO: Consider update() here to pull in server data.
+        self.__title = None
+        self.__author = None
+        self.__copyright = None
+        self.__isbn = None
+        self.__language = None
+        self.__pubdate = None
+        self.__publisher = None
+        # Start times of the analysis and conversions, for the client's ConversionStats.
+        self.__document_size = None
+        self.__analysis_started = None
+        self.__conversions_started = None
+
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps(self.pack()))
+        return repr_s
+
+    def update(self):
+        """
+        Queries the Bookalope server for this Bookflow's server-side data, and
+        updates this instance with that data.
+        """
+        bookflow = self.__bookalope.http_get(self.url)["bookflow"]
+        self.__name = bookflow["name"]
+        if bookflow["step"] != self.__step:
+            self.__invalidate_artifacts()
+            if self.__step == "processing" and bookflow["step"] == "convert":
+                self.__record_duration(None)
+        self.__step = bookflow["step"]
+        self.__credit = None
+        if bookflow.get("credit"):
+            self.__credit = bookflow["credit"]["type"]
+            # TODO: Does a client want to know formats here as well?
+        self.__title = bookflow["title"]
+        self.__author = bookflow["author"]
+        self.__copyright = bookflow["copyright"]
+        self.__isbn = bookflow["isbn"]
+        self.__language = bookflow["language"]
+        self.__pubdate = bookflow["pubdate"]
+        self.__publisher = bookflow["publisher"]
+
+    def save(self):
+        """Post this Bookflow's instance data to the Bookalope server."""
+        params = {
+            "name": self.__name,
+            }
+        params.update({k: v for k, v in self.metadata().items() if v is not None})
+        return self.__bookalope.http_post(self.url, params)
+
+    def delete(self):
+        """
+        Delete this Bookflow from the Bookalope server. Subsequent calls to save()
+        will fail on the server side.
+        """
+        if self.processing:
+            raise BookflowError("Unable to delete a processing bookflow")
+        # TODO: Remove this Bookflow from the Book's list.
+        self.__invalidate_artifacts()
+        return self.__bookalope.http_delete(self.url)
+
+    def pack(self):
+        """
+        Pack this instance data into a dictionary that can be encoded as a JSON
+        string and is compatible to the Bookalope Book data.
+
+        :returns dict: This Bookflow's information as a Bookalope compatible
+                       dictionary.
+        """
+        packed = {
+            "book": self.__book.id,
+            "id": self.__id,
+            "name": self.__name,
+            "step": self.__step,
+            "credit": self.__credit,
+            }
+        return packed
+
+    def metadata(self):
+        """Pack the bookflow metadata into a dictionary and return that dictionary."""
+        metadata = {
+            "title": self.__title,
+            "author": self.__author,
+            "copyright": self.__copyright,
+            "isbn": self.__isbn,
+            "language": self.__language,
+            "pubdate": self.__pubdate,
+            "publisher": self.__publisher,
+            }
+        return metadata
+
+    @property
+    def id(self):
+        """Return the Bookalope token id for this Bookflow instance."""
+        return self.__id
+
+    @property
+    def url(self):
+        """Return the API endpoint URL for this Bookflow instance."""
+        return "/api/bookflows/" + self.__id
+
+    @property
+    def name(self):
+        """Return the name of this Bookflow instance."""
+        return self.__name
+
+    @name.setter
+    def name(self, name):
+        """Set the name for this bookflow instance."""
+        self.__name = name
+
+    @property
+    def step(self):
+        """
+        Return the current conversion step this Bookflow instance is currently in.
+        The step changes as the bookflow itself progresses by calling methods on
+        it, but it can not be modified.
+        """
+        return self.__step
+
+    @property
+    def credit(self):
+        """
+        Return the credit type associated with this Bookflow, either None, 'basic',
+        or 'pro'.
+        """
+        return self.__credit
+
+    @property
+    def book(self):
+        """Return the Book instance associated with this bookflow."""
+        return self.__book
+
+    @property
+    def title(self):
+        """Return the title of this bookflow's book."""
+        return self.__title
+
+    @title.setter
+    def title(self, title):
+        """Set the title for this bookflow's book."""
+        self.__title = title
+
+    @property
+    def author(self):
+        """Get the author's name for this bookflow's book."""
+        return self.__author
+
+    @author.setter
+    def author(self, author):
+        """Set the author's name for this bookflow's book."""
+        self.__author = author
+
+    @property
+    def copyright(self):
+        """Get the copyright string for this bookflow's book."""
+        return self.__copyright
+
+    @copyright.setter
+    def copyright(self, copyright_):
+        """Set the copyright string for this bookflow's book."""
+        self.__copyright = copyright_
+
+    @property
+    def isbn(self):
+        """Get the ISBN number string for this bookflow's book."""
+        return self.__isbn
+
+    @isbn.setter
+    def isbn(self, isbn):
+        """Set the copyright string for this bookflow's book."""
+        # TODO: Check if ISBN is valid ( http://bit.ly/1lV1PgI )
+        self.__isbn = isbn
+
+    @property
+    def language(self):
+        """Get the Babel Locale instance representing the book's language."""
+        return self.__language
+
+    @language.setter
+    def language(self, language):
+        """
+        Given a standard language/culture name string, set this bookflow's book
+        language using a Babel Locale instance.
+
+        :param str language: A standard language/culture name, e.g. en_US that
+                             specifies the book's language.
+        :raises: ValueError, babel.core.UnknownLocaleError if the language string
+                 is invalid.
+        """
+        self.__language = _parse_language(language)
+
+    @property
+    def pubdate(self):
+        """Get the publication date string of this bookflow's book."""
+        return self.__pubdate
+
+    @pubdate.setter
+    def pubdate(self, pubdate):
+        """Set the publication date string of this bookflow's book."""
+        # TODO: Use datetime/date instance instead of string?
+        self.__pubdate = pubdate
+
+    @property
+    def publisher(self):
+        """Get this bookflow's book's publisher string."""
+        return self.__publisher
+
+    @publisher.setter
+    def publisher(self, publisher):
+        """Set this bookflow's book's publisher string."""
+        self.__publisher = publisher
+
+    @property
+    def processing(self):
+        """Return True if the bookflow is currently being processed; False otherwise."""
+        return self.step == "processing"
+
+    def set_credit(self, credit):
+        """
+        Add the specified credit type to this Bookflow.
+
+        :param str credit: The credit type, either 'basic' or 'pro'.
+        """
+        if credit not in ("basic", "pro"):
+            raise BookflowError("Invalid credit type")
+        params = {
+            "type": credit,
+            }
+        self.__bookalope.http_post(self.url + "/credit", params)
+        self.__credit = credit
+
+    def get_cover_image(self):
+        """Download the cover image as a byte array from the Bookalope server."""
+        return self.get_image("cover-image")
+
+    def get_image(self, name):
+        """
+        Download an image with the name 'name' as a byte array from the
+        Bookalope server.
+
+        :param str name: The name of the image.
+        :returns bytes: An array of bytes of the image.
+        """
+        params = {
+            "name": name,
+            }
+        # TODO: Handle file name and mime type correctly (part of the response).
+        return self.__cached("image", name, lambda: self.__bookalope.http_get(self.url + "/files/image", params))
+
+    def set_cover_image(self, image_filename, image_bytes):
+        """
+        Upload the cover image for this bookflow.
+
+        :param str image_filename: The file name of the cover image.
+        :param bytes image_bytes: A byte array containing the image.
+        """
+        return self.add_image("cover-image", image_filename, image_bytes)
+
+    def add_image(self, name, image_filename, image_bytes):
+        """
+        Upload an image for this bookflow using the given name.
+
+        :param str name: A name for the image, e.g. 'cover'.
+        :param str image_filename: The file name of the cover image.
+        :param bytes image_bytes: A byte array containing the image.
+        """
+        if self.step != "convert":
+            raise BookflowError("Can't add image, bookflow must be in 'convert' step")
+        optimizer = self.__bookalope.image_optimizer
+        if optimizer is not None:
+            with _phase(self.__bookalope, "image optimization"):
+                image_filename, image_bytes = optimizer.optimize(image_bytes, image_filename)
+        with _phase(self.__bookalope, "upload", span_name="add_image", bookflow=self.__id, image=name,
+                    bytes=len(image_bytes)), self.__bookalope.reserve_bytes(_UPLOAD_FOOTPRINT * len(image_bytes)):
+            with _phase(self.__bookalope, "base64 encode"):
+                params = {
+                    "name": name,
+                    "filename": image_filename,
+                    "file": base64.b64encode(image_bytes).decode(),
+                }
+            self.__invalidate_artifacts("image", name)
+            return self.__bookalope.http_post(self.url + "/files/image", params)
+
+    def add_images(self, images, max_workers=4):
+        """
+        Upload many images for this bookflow concurrently. Every image is Base64
+        encoded while it is being sent, so that large images are not held in
+        memory in their encoded form. Failures don't stop the upload of the other
+        images, but are reported.
+
+        :param dict images: A dictionary that maps image names to either a file
+                            name, or a (file name, bytes) tuple, or bytes in which
+                            case the image name is used as file name.
+        :param int max_workers: The maximum number of concurrent uploads.
+        :returns list: A list of BulkResult instances whose items are the image names.
+        :raises: BookflowError if the bookflow is not in 'convert' step.
+        """
+        if self.step != "convert":
+            raise BookflowError("Can't add images, bookflow must be in 'convert' step")
+
+        def _add(item):
+            name, image = item
+            try:
+                if isinstance(image, str):
+                    image_filename = os.path.basename(image)
+                elif isinstance(image, tuple):
+                    image_filename, image = image
+                else:
+                    image_filename = name
+                optimizer = self.__bookalope.image_optimizer
+                if optimizer is not None:
+                    with _phase(self.__bookalope, "image optimization"):
+                        image_filename, image = optimizer.optimize(image, image_filename)
+                params = {
+                    "name": name,
+                    "filename": image_filename,
+                    }
+                body = _Base64Upload(params, "file", image)
+                self.__invalidate_artifacts("image", name)
+                with _phase(self.__bookalope, "upload", span_name="add_image", bookflow=self.__id, image=name,
+                            bytes=body.size), self.__bookalope.reserve_bytes(body.footprint):
+                    result = self.__bookalope.http_post(self.url + "/files/image", None, body)
+                return BulkResult(name, result, None)
+            except Exception as exc:  # pylint: disable=broad-except
+                return BulkResult(name, None, exc)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return _map(executor, _add, images.items())
+
+    def get_images(self, names, max_workers=4):
+        """
+        Download many images of this bookflow concurrently. Failures don't stop
+        the download of the other images, but are reported.
+
+        :param names: An iterable of image names.
+        :param int max_workers: The maximum number of concurrent downloads.
+        :returns list: A list of BulkResult instances whose items are the image
+                       names and whose results are the image bytes.
+        """
+        def _get(name):
+            try:
+                return BulkResult(name, self.get_image(name), None)
+            except Exception as exc:  # pylint: disable=broad-except
+                return BulkResult(name, None, exc)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return _map(executor, _get, names)
+
+    def get_document(self):
+        """
+        Download this bookflow's document. Returns a byte array of the document.
+        """
+        return self.__bookalope.http_get(self.url + "/files/document")
+
+    def set_document(self, document_filename, document_bytes, document_type=None, skip_analysis=False,
+                     validate=True):
+        """
+        Upload a document for this bookflow. This will start the style analysis,
+        and automatically extract the content and structure of the document using
+        Bookalope's default heuristics. Switches the bookflow's `step` property
+        to 'processing', and then to 'convert' once the document analysis has
+        finished and the document can be converted.
+
+        :param str document_filename: The file name of the document.
+        :param bytes document_bytes: A byte array containing the document.
+        :param str document_type: The optional document type, one of "doc", "epub" or "gutenberg";
+                                  if not given it's derived from the document's content.
+        :param boolean skip_analysis: Whether to skip the semantic structure analysis of the document.
+        :param boolean validate: Whether to check the document's format against the server's
+                                 import formats before uploading it.
+        :raises: BookflowError if the document's format is not supported by the server.
+        """
+        if self.step != "files":
+            raise BookflowError("Unable to set document because one is already set")
+        sniffed = sniff_document(document_bytes)
+        if validate:
+            self.__validate_document(document_filename, sniffed)
+        if document_type is None and sniffed is not None:
+            document_type = sniffed[2]
+        with _phase(self.__bookalope, "upload", span_name="set_document", bookflow=self.__id,
+                    bytes=len(document_bytes), document_type=document_type or ""), \
+                self.__bookalope.reserve_bytes(_UPLOAD_FOOTPRINT * len(document_bytes)):
+            with _phase(self.__bookalope, "base64 encode"):
+                params = {
+                    "filename": document_filename,
+                    "file": base64.b64encode(document_bytes).decode(),
+                    "skip_analysis": skip_analysis,
+                    }
+            if document_type and document_type in ("doc", "epub", "gutenberg",):
+                params["filetype"] = document_type
+            self.__invalidate_artifacts()
+            self.__bookalope.http_post(self.url + "/files/document", params)
+        self.__step = "processing"  # Server does the same.
+        self.__document_size = len(document_bytes)
+        self.__analysis_started = time.monotonic()
+
+    def __validate_document(self, document_filename, sniffed):
+        """
+        Check the sniffed format of a document, or else its file name extension,
+        against the server's import formats.
+
+        :raises: BookflowError if the format is not supported by the server.
+        """
+        formats = self.__bookalope.get_import_formats()
+        if sniffed is not None:
+            mimetype, exts, _ = sniffed
+        else:
+            mimetype, exts = None, {os.path.splitext(document_filename)[1].lstrip(".").lower()}
+        for format_ in formats:
+            if format_.mimetype == mimetype or exts & set(format_.file_exts):
+                return
+        raise BookflowError("Unsupported document format: {}".format(mimetype or document_filename))
+
+    def convert(self, format_, style=None):
+        """
+        Initiate the conversion of a bookflow's document. If no plan was associated
+        with the bookflow then a *test version* of the document is produced. A
+        'test' version shuffles the letters of random words, thus making the
+        document rather useless for anything but testing purposes.
+
+        :param str format_: A valid format string, one of 'epub', 'epub3', 'mobi',
+                           'pdf', 'icml', 'docx', 'docbook', 'htmlbook'.
+        :param style: A Style instance describing the styling for the converted
+                      document.
+        """
+        if self.step != "convert":
+            raise BookflowError("Can't convert document, bookflow must be in 'convert' step")
+        styling = style.short_name if style else "default"
+        params = {
+            "format": format_,
+            "styling": styling,
+            }
+        self.__invalidate_artifacts("format", format_)
+        with _phase(self.__bookalope, "convert", bookflow=self.__id, format=format_, style=styling):
+            self.__bookalope.http_post(self.url + "/convert", params)
+        with _CONVERSIONS_STARTED_LOCK:
+            if self.__conversions_started is None:
+                self.__conversions_started = {}
+            self.__conversions_started[format_] = (time.monotonic(), styling)
+
+    def convert_when_ready(self, targets, cover=None, images=None, max_workers=4):
+        """
+        Convert this bookflow's document into all of the given target formats
+        as soon as the document analysis has finished. Styles are resolved right
+        away while the analysis is still running. The rest runs in stages: once
+        the bookflow reaches the 'convert' step the cover and images are uploaded
+        concurrently, and once all uploads have finished all conversions are
+        triggered concurrently, because the conversions must include the images.
+        The uploads don't overlap the analysis, and the conversions wait for the
+        slowest upload. This method does not block; use the returned futures to
+        wait for the conversions.
+
+        :param targets: A dictionary that maps formats to a Style instance, a
+                        style short name, or None for the default style; or an
+                        iterable of formats that use the default style.
+        :param cover: An optional cover image, see `add_images` method.
+        :param dict images: Optional images, see `add_images` method.
+        :param int max_workers: The maximum number of concurrent requests.
+        :returns dict: A dictionary that maps every format to a Future which
+                       resolves to the final conversion status, see
+                       `convert_status` method.
+        :raises: BookflowError if a style name is unknown.
+        """
+        bookalope = self.__bookalope
+        if isinstance(targets, dict):
+            targets = dict(targets)
+        else:
+            targets = {format_: None for format_ in targets}
+        names = {format_: style for format_, style in targets.items() if isinstance(style, str)}
+        if names:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                styles = dict(zip(names, _map(executor, bookalope.get_styles, names)))
+            for format_, name in names.items():
+                style = next((_ for _ in styles[format_] if _.short_name == name), None)
+                if style is None:
+                    raise BookflowError("Unknown style '{}' for format '{}'".format(name, format_))
+                targets[format_] = style
+        uploads = dict(images or {})
+        if cover is not None:
+            uploads["cover-image"] = cover
+        results = {format_: concurrent.futures.Future() for format_ in targets}
+
+        def _chain(watch, result):
+            if watch.cancelled():
+                result.cancel()
+            elif watch.exception() is not None:
+                result.set_exception(watch.exception())
+            else:
+                result.set_result(watch.result())
+
+        def _convert(format_):
+            try:
+                self.convert(format_, targets[format_])
+                watch = bookalope.status_monitor.watch(self, format_)
+                watch.add_done_callback(lambda _: _chain(_, results[format_]))
+            except Exception as exc:  # pylint: disable=broad-except
+                results[format_].set_exception(exc)
+
+        def _kickoff(ready):
+            try:
+                step = ready.result()
+                if step != "convert":
+                    raise BookflowError("Can't convert document, bookflow is in '{}' step".format(step))
+                # Images are uploaded only after the analysis, like set_cover_image()
+                # after wait_for_analysis(), and all of them before any conversion.
+                if uploads:
+                    failed = [_.item for _ in self.add_images(uploads, max_workers) if not _.ok]
+                    if failed:
+                        raise BookflowError("Failed to upload images: " + ", ".join(failed))
+            except Exception as exc:  # pylint: disable=broad-except
+                for result in results.values():
+                    result.set_exception(exc)
+                return
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                _map(executor, _convert, targets)
+
+        # Run the kickoff in its own thread with the caller's context (and thus
+        # deadline), so that the status monitor's threads are not blocked.
+        context = contextvars.copy_context()
+        ready = bookalope.status_monitor.watch(self)
+        ready.add_done_callback(lambda _: threading.Thread(target=context.run, args=(_kickoff, _), daemon=True).start())
+        return results
+
+    def convert_status(self, format_):
+        """
+        Check the status of the bookflow's file conversion for the specified format and style.
+
+        :param str format_: Same as `convert` method.
+        :param style: Same as `convert` method.
+        :return: A string that is either 'processing', 'available' (conversion finished), 'failed',
+                 or 'none' (no conversion initiated yet).
+        """
+        conversion = self.__bookalope.http_get(self.url + "/download/" + format_ + "/status")
+        if conversion["status"] == "available":
+            self.__record_duration(format_)
+        elif conversion["status"] != "processing":
+            self.__conversion_started(format_, pop=True)
+        return conversion["status"]
+
+    def eta(self, format_=None):
+        """
+        Estimate the number of seconds until the document analysis or, if a
+        format is given, the conversion into that format finishes. Estimates
+        come from the client's ConversionStats.
+
+        :param str format_: An optional conversion format, see `convert` method.
+        :returns float: The estimated number of seconds left (may be 0), or None
+                        if nothing is in progress or no estimate is available.
+        """
+        stats = self.__bookalope.conversion_stats
+        if stats is None:
+            return None
+        if format_ is None:
+            started, style = self.__analysis_started, None
+        else:
+            started, style = self.__conversion_started(format_)
+        if started is None:
+            return None
+        kind = "analysis" if format_ is None else "conversion"
+        estimate = stats.estimate(kind, self.__document_size, format_, style)
+        if estimate is None:
+            return None
+        return max(0.0, started + estimate - time.monotonic())
+
+    def __conversion_started(self, format_, pop=False):
+        """
+        Return the (start time, style) tuple of the conversion into the given
+        format, or (None, None) if none was started; and forget it if pop is True.
+        """
+        with _CONVERSIONS_STARTED_LOCK:
+            started = self.__conversions_started or {}
+            return started.pop(format_, (None, None)) if pop else started.get(format_, (None, None))
+
+    def __record_duration(self, format_):
+        """
+        Record the duration of a finished document analysis or, if a format is
+        given, a finished conversion with the client's ConversionStats.
+        """
+        if format_ is None:
+            started, style = self.__analysis_started, None
+            self.__analysis_started = None
+        else:
+            started, style = self.__conversion_started(format_, pop=True)
+        stats = self.__bookalope.conversion_stats
+        if stats is not None and started is not None:
+            kind = "analysis" if format_ is None else "conversion"
+            stats.record(kind, time.monotonic() - started, self.__document_size, format_, style)
+
+    def wait_for_analysis(self, timeout=None):
+        """
+        Block until this bookflow has left the 'processing' step, i.e. until the
+        analysis of an uploaded document has finished. Polling is done by the
+        client's StatusMonitor, and this instance is updated along the way.
+
+        :param float timeout: An optional timeout in seconds.
+        :returns str: The new step of this bookflow.
+        :raises: concurrent.futures.TimeoutError if the timeout expired;
+                 DeadlineExceeded if the current deadline expired.
+        """
+        with _phase(self.__bookalope, "analysis wait", bookflow=self.__id):
+            step = self.__wait(None, timeout)
+            _annotate(step=step)
+            return step
+
+    def wait_for_conversion(self, format_, timeout=None):
+        """
+        Block until the conversion of this bookflow's document into the given
+        format has finished. Polling is done by the client's StatusMonitor.
+
+        :param str format_: Same as `convert` method.
+        :param float timeout: An optional timeout in seconds.
+        :returns str: The final conversion status, see `convert_status` method.
+        :raises: concurrent.futures.TimeoutError if the timeout expired;
+                 DeadlineExceeded if the current deadline expired.
+        """
+        with _phase(self.__bookalope, "status wait", bookflow=self.__id, format=format_):
+            status = self.__wait(format_, timeout)
+            _annotate(status=status)
+            return status
+
+    def __wait(self, format_, timeout):
+        """
+        Watch this bookflow's step, or the conversion into the given format, and
+        wait for the result. If the wait times out then the watcher is detached,
+        so that the status monitor doesn't keep polling for it.
+        """
+        monitor = self.__bookalope.status_monitor
+        future = monitor.watch(self, format_)
+        try:
+            return _wait(future, timeout)
+        except (concurrent.futures.TimeoutError, DeadlineExceeded):
+            monitor.detach(self, format_, future)
+            raise
+
+    def convert_download(self, format_):
+        """
+        Once `convert_status` method returns 'available', the converted file can be downloaded
+        and is returned by this method.
+
+        :param str format_: Same as `convert` method.
+        :return: A bytes object containing the converted document, or None if converted document
+                 was not available (any status but 'available').
+        :raises: A HTTPException (Bad Request) if the conversion was not in 'available' status.
+        """
+        with _phase(self.__bookalope, "download", span_name="convert_download", bookflow=self.__id, format=format_):
+            download = self.__cached("format", format_, lambda: self.__bookalope.http_get(self.url + "/download/" + format_))
+            _annotate(bytes=len(download or b""))
+            return download
+
+    def convert_download_to(self, format_, filename, retries=5):
+        """
+        Like `convert_download` but stream the converted file into the given file
+        instead of memory. An interrupted download resumes where it stopped if the
+        server supports byte ranges, see BookalopeClient.http_download().
+
+        :param str format_: Same as `convert` method.
+        :param str filename: The name of the file to write.
+        :param int retries: The number of times a failed transfer is resumed.
+        :returns tuple: The size of the file in bytes, and its SHA-256 hex digest.
+        :raises: A HTTPException (Bad Request) if the conversion was not in 'available' status;
+                 BookalopeError if the downloaded file didn't check out.
+        """
+        with _phase(self.__bookalope, "download", span_name="convert_download", bookflow=self.__id, format=format_):
+            return self.__bookalope.http_download(self.url + "/download/" + format_, filename, retries=retries)
+
+    def package(self, fileobj, formats=None, include_cover=True, archive="zip", chunk_size=65536):
+        """
+        Write an archive with converted files of this bookflow and its cover image
+        into the given file object. Every download is streamed straight into its
+        archive entry as it arrives, so memory use is bounded by the chunk size
+        and no intermediate files are written; the file object doesn't need to be
+        seekable. The archive ends with a 'manifest.json' entry that lists the
+        name, size and SHA-256 checksum of every other entry.
+
+        :param fileobj: A writable binary file object.
+        :param formats: An optional iterable of formats to include; defaults to all
+                        export formats whose conversion is available.
+        :param bool include_cover: Whether to include the cover image, if there is one.
+        :param str archive: The archive type, either 'zip' or 'tar'.
+        :param int chunk_size: The number of bytes read from the network at once.
+        :returns dict: The manifest.
+        :raises: ValueError for an unknown archive type; BookalopeError if a tar
+                 entry's size is not known up front.
+        """
+        if archive not in ("zip", "tar"):
+            raise ValueError("Unknown archive type: " + archive)
+        bookalope = self.__bookalope
+        if formats is None:
+            formats = [format_.name for format_ in bookalope.get_export_formats()]
+            formats = [format_ for format_ in formats if self.convert_status(format_) == "available"]
+        downloads = [("{}.{}".format(self.__id, format_), self.url + "/download/" + format_, None, format_)
+                     for format_ in formats]
+        if include_cover:
+            downloads.append(("cover-image", self.url + "/files/image", {"name": "cover-image"}, None))
+        manifest = {
+            "bookflow": self.__id,
+            "created": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+            "files": [],
+            }
+        if archive == "zip":
+            container = zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED)
+        else:
+            container = tarfile.open(fileobj=fileobj, mode="w|")
+        with container, _phase(bookalope, "download", span_name="package", bookflow=self.__id, archive=archive):
+            for name, url, params, format_ in downloads:
+                try:
+                    with bookalope.http_stream(url, params) as response, bookalope.reserve_bytes(chunk_size):
+                        if format_ is None:
+                            # Keep the cover image's file name extension.
+                            match = re.search(r"filename=\"?([^\";]+)", response.headers["Content-Disposition"])
+                            if match:
+                                name += os.path.splitext(match.group(1))[1]
+                        chunks = response.iter_content(chunk_size)
+                        if archive == "zip":
+                            size, sha256 = _write_zip_entry(container, name, chunks)
+                        else:
+                            size, sha256 = _write_tar_entry(container, name, chunks, response.headers.get("Content-Length"))
+                except requests.HTTPError as exc:
+                    # A missing cover image is fine, everything else is not.
+                    if format_ is None and exc.response is not None and exc.response.status_code == requests.codes.not_found:
+                        continue
+                    raise
+                manifest["files"].append({
+                    "name": name,
+                    "format": format_,
+                    "size": size,
+                    "sha256": sha256,
+                    })
+            manifest_bytes = json.dumps(manifest, indent=2).encode()
+            if archive == "zip":
+                container.writestr("manifest.json", manifest_bytes)
+            else:
+                tarinfo = tarfile.TarInfo("manifest.json")
+                tarinfo.size = len(manifest_bytes)
+                tarinfo.mtime = time.time()
+                container.addfile(tarinfo, io.BytesIO(manifest_bytes))
+            _annotate(files=len(manifest["files"]), bytes=sum(_["size"] for _ in manifest["files"]))
+        return manifest
+
+    def __cached(self, kind, name, download):
+        """
+        Return the artifact of the given kind and name from the client's artifact
+        cache, or call the download function and cache its result.
+        """
+        cache = self.__bookalope.artifact_cache
+        if cache is None:
+            return download()
+        key = (self.__id, kind, name)
+        artifact = cache.get(key)
+        if artifact is None:
+            artifact = download()
+            if isinstance(artifact, bytes):
+                cache.put(key, artifact)
+        return artifact
+
+    def __invalidate_artifacts(self, kind=None, name=None):
+        """
+        Remove this bookflow's artifacts from the client's artifact cache; if
+        kind and name are given then remove only that artifact.
+        """
+        cache = self.__bookalope.artifact_cache
+        if cache is not None:
+            if kind is None:
+                cache.invalidate(self.__id)
+            else:
+                cache.invalidate(self.__id, (self.__id, kind, name))
+
+
+class Profiler(object):
+    """
+    A Profiler records the wall-clock and CPU time that a client spends in the
+    phases of a pipeline run: creating books and bookflows, uploading (and
+    Base64 encoding), waiting for analysis, converting, waiting for conversion
+    status, and downloading, as well as network time, JSON decoding and rate
+    limit waits. Optionally, a run is wrapped in cProfile and tracemalloc, and
+    the stacks of all threads are sampled for a flame graph.
+
+    Use the Profiler as a context manager around a run, and pass it to the
+    BookalopeClient to have the client record its phases.
+    """
+
+    def __init__(self, cprofile=False, trace_memory=False, sample_interval=None):
+        """
+        Initialize this Profiler instance.
+
+        :param bool cprofile: True to profile the run with cProfile; note that
+                              cProfile only covers the thread that starts the run.
+        :param bool trace_memory: True to trace memory allocations with tracemalloc.
+        :param float sample_interval: An optional interval in seconds at which the
+                                      stacks of all threads are sampled.
+        """
+        self.__phases = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__cprofile = cProfile.Profile() if cprofile else None
+        self.__trace_memory = trace_memory
+        self.__memory = None
+        self.__sample_interval = sample_interval
+        self.__samples = collections.Counter()
+        self.__sampler = None
+        self.__running = False
+        self.__started = None
+        self.__wall = 0.0
+
+    def _reinit_after_fork(self):
+        """Reset the lock that a newly forked child process inherited."""
+        self.__lock = threading.Lock()
+
+    def __enter__(self):
+        """Start profiling a run."""
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop profiling a run."""
+        self.stop()
+
+    def start(self):
+        """Start profiling a run."""
+        self.__running = True
+        self.__started = time.perf_counter()
+        if self.__trace_memory:
+            tracemalloc.start()
+        if self.__sample_interval:
+            self.__sampler = threading.Thread(target=self.__sample, name="bookalope-profiler", daemon=True)
+            self.__sampler.start()
+        if self.__cprofile is not None:
+            self.__cprofile.enable()
+
+    def stop(self):
+        """Stop profiling a run."""
+        if self.__cprofile is not None:
+            self.__cprofile.disable()
+        self.__running = False
+        if self.__sampler is not None:
+            self.__sampler.join()
+            self.__sampler = None
+        if self.__trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            self.__memory = (peak, tracemalloc.take_snapshot())
+            tracemalloc.stop()
+        self.__wall += time.perf_counter() - self.__started
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Return a context manager that records the wall-clock and CPU time of the
+        enclosed code as the named phase. Phases may nest, e.g. 'network' inside
+        'upload'; a phase that is already active in the current thread is not
+        counted twice.
+
+        :param str name: The name of the phase.
+        """
+        active = getattr(self.__local, "active", None)
+        if active is None:
+            active = self.__local.active = set()
+        if name in active:
+            yield
+            return
+        active.add(name)
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            active.discard(name)
+            with self.__lock:
+                phase = self.__phases.setdefault(name, [0, 0.0, 0.0])
+                phase[0] += 1
+                phase[1] += wall
+                phase[2] += cpu
+
+    def phases(self):
+        """
+        Return the recorded phases.
+
+        :returns dict: A dictionary that maps phase names to dictionaries with
+                       the number of calls, the wall-clock and the CPU time.
         """
-        Post this Bookshelf's instance data to the Bookalope server, i.e. stores
-        the name of this Bookshelf.
+        with self.__lock:
+            return {
+                name: {"calls": calls, "wall": wall, "cpu": cpu}
+                for name, (calls, wall, cpu) in self.__phases.items()
+                }
+
+    def report(self, limit=20):
         """
-        params = {
-            "name": self.__name,
-            "description": self.__description,
-            }
-        return self.__bookalope.http_post(self.url, params)
+        Return a human readable report of the recorded phases, followed by the
+        top functions from cProfile and the top allocations from tracemalloc if
+        they were enabled.
 
-    def delete(self):
+        :param int limit: The number of cProfile and tracemalloc entries.
+        :returns str: The report.
         """
-        Delete this Bookshelf (and all of its Books and their Bookflows) from the
-        Bookalope server. Subsequent calls to save() will fail on the server side.
+        lines = ["Run: {:.3f}s wall-clock".format(self.__wall), ""]
+        lines.append("{:<20} {:>8} {:>12} {:>12}".format("phase", "calls", "wall (s)", "cpu (s)"))
+        for name, phase in sorted(self.phases().items(), key=lambda _: -_[1]["wall"]):
+            lines.append("{:<20} {:>8} {:>12.3f} {:>12.3f}".format(name, phase["calls"], phase["wall"], phase["cpu"]))
+        if self.__cprofile is not None:
+            stream = io.StringIO()
+            pstats.Stats(self.__cprofile, stream=stream).sort_stats("cumulative").print_stats(limit)
+            lines += ["", stream.getvalue()]
+        if self.__memory is not None:
+            peak, snapshot = self.__memory
+            lines += ["", "Peak traced memory: {} bytes".format(peak)]
+            lines += [str(_) for _ in snapshot.statistics("lineno")[:limit]]
+        return "\n".join(lines) + "\n"
+
+    def folded_stacks(self):
         """
-        return self.__bookalope.http_delete(self.url)
+        Return the sampled stacks in the collapsed format that flame graph tools
+        (e.g. flamegraph.pl, speedscope, inferno) accept: one line per unique
+        stack, with semicolon separated frames followed by the sample count.
+
+        :returns str: The folded stacks.
+        """
+        with self.__lock:
+            samples = sorted(self.__samples.items())
+        return "".join("{} {}\n".format(stack, count) for stack, count in samples)
+
+    def write(self, directory):
+        """
+        Write the report to 'profile.txt', the cProfile data to 'profile.pstats',
+        and the sampled stacks to 'profile.folded' in the given directory.
+
+        :param str directory: The directory, which is created if needed.
+        """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "profile.txt"), "w") as file_:
+            file_.write(self.report())
+        if self.__cprofile is not None:
+            self.__cprofile.dump_stats(os.path.join(directory, "profile.pstats"))
+        if self.__sample_interval:
+            with open(os.path.join(directory, "profile.folded"), "w") as file_:
+                file_.write(self.folded_stacks())
+
+    def __sample(self):
+        """Periodically sample the stacks of all other threads."""
+        own = threading.get_ident()
+        names = {}
+        while self.__running:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                with self.__lock:
+                    self.__samples[";".join(reversed(stack))] += 1
+            time.sleep(self.__sample_interval)
+
+
+class Span(object):
+    """
+    A Span records a single timed operation of a trace: its name, start and end
+    times, its attributes, and the error that ended it, if any. Spans nest: a
+    span started while another span is current becomes its child.
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attributes", "error")
+
+    def __init__(self, name, parent=None, attributes=None):
+        """
+        Initialize and start this span.
+
+        :param str name: The name of the span.
+        :param parent: The optional parent Span instance.
+        :param dict attributes: Optional attributes of the span.
+        """
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps(self.pack()))
+        return repr_s
 
     def pack(self):
         """
-        Pack this instance data into a dictionary that can be encoded as a JSON
-        string and is compatible to the Bookalope Bookshelf data.
+        Pack this span into a dictionary that can be encoded as a JSON string.
 
-        :returns dict: This Bookshelf's information as a Bookalope compatible
-                       dictionary.
+        :returns dict: This Span's information as a dictionary.
         """
         packed = {
-            "id": self.__id,
-            "name": self.__name,
-            "description": self.__description,
-            "created": self.__created.strftime("%Y-%m-%dT%H:%M:%S"),
-            "books": [_.pack() for _ in self.__books],
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration": (self.end - self.start) / 1e9 if self.end is not None else None,
+            "attributes": self.attributes,
+            "error": self.error,
             }
         return packed
 
-    @property
-    def id(self):
-        """Return the Bookalope token id for this Bookshelf instance."""
-        return self.__id
+    def set(self, key, value):
+        """
+        Set an attribute of this span.
 
-    @property
-    def url(self):
-        """Return the API endpoint URL for this Bookshelf instance."""
-        return self.__url
+        :param str key: The name of the attribute.
+        :param value: A string, number or boolean.
+        """
+        self.attributes[key] = value
 
-    @property
-    def name(self):
-        """Return the name of this Bookshelf instance."""
-        return self.__name
 
-    @name.setter
-    def name(self, name):
+class Tracer(object):
+    """
+    A Tracer records spans for the requests of a client and the phases of a
+    bookflow's lifecycle (create, set_document, analysis wait, add_image,
+    convert, status wait, convert_download), and hands every finished span to
+    an exporter. Wrap the work on a single bookflow in a span of its own to get
+    one trace per bookflow job, e.g.
+
+        with tracer.span("bookflow job", document=filename):
+            book = bookalope.create_book()
+            ...
+
+    Spans carry over into the threads of the client's bulk operations.
+    """
+
+    def __init__(self, exporter):
         """
-        Change the name of this Bookshelf instance locally. Use save() to store the
-        change to the Bookalope server.
+        Initialize this tracer.
 
-        :param str name: The new Bookshelf name.
+        :param exporter: A JSONLExporter or OTLPExporter instance, or any object
+                         with export(spans) and close() methods; or a file name
+                         to export spans to as JSON lines.
         """
-        self.__name = name
+        self.__exporter = JSONLExporter(exporter) if isinstance(exporter, str) else exporter
+        self.__lock = threading.Lock()
+        self.__spans = 0
+        self.__errors = 0
+
+    def _reinit_after_fork(self):
+        """Reset the locks that a newly forked child process inherited."""
+        self.__lock = threading.Lock()
+        reinit = getattr(self.__exporter, "_reinit_after_fork", None)
+        if reinit is not None:
+            reinit()
 
-    @property
-    def description(self):
-        """Return the description for this Bookshelf instance."""
-        return self.__description
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps({
+                "spans": self.__spans,
+                "errors": self.__errors,
+                }))
+        return repr_s
 
-    @description.setter
-    def description(self, description):
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
         """
-        Change the description for this Bookshelf instance locally. Use save() to store the
-        change to the Bookalope server.
+        Return a context manager that records the enclosed code as a span, child
+        of the current span if there is one. The span is exported when the code
+        finishes; if it raises, the span records the error.
+
+        :param str name: The name of the span.
+        :param attributes: Optional attributes of the span.
+        :returns: A context manager that yields the Span instance, or None if
+                  tracing is suppressed in the current context.
+        """
+        parent = _SPAN.get()
+        if parent is False:
+            yield None
+            return
+        span = Span(name, parent, attributes)
+        token = _SPAN.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.error = "{}: {}".format(exc.__class__.__name__, exc)
+            raise
+        finally:
+            _SPAN.reset(token)
+            span.end = time.time_ns()
+            with self.__lock:
+                self.__spans += 1
+                self.__errors += span.error is not None
+            self.__exporter.export([span])
+
+    def close(self):
+        """Flush and close the exporter."""
+        self.__exporter.close()
+
+
+class JSONLExporter(object):
+    """
+    A JSONLExporter appends finished spans to a file, one JSON object per line
+    (see Span.pack), so that slow phases and stragglers can be found with a few
+    lines of code or jq.
+    """
 
-        :param str description: The new Bookshelf description.
+    def __init__(self, filename):
         """
-        self.__description = description
+        Open the file that spans are appended to.
 
-    @property
-    def created(self):
+        :param str filename: The name of the file.
         """
-        Return a Python datetime instance that represents the date when this
-        Bookshelf instance was created.
+        self.__file = open(filename, "a", encoding="utf-8")
+        self.__lock = threading.Lock()
+
+    def _reinit_after_fork(self):
+        """Reset the lock that a newly forked child process inherited."""
+        self.__lock = threading.Lock()
+
+    def export(self, spans):
+        """Append the given spans to the file."""
+        lines = "".join(json.dumps(span.pack()) + "\n" for span in spans)
+        with self.__lock:
+            self.__file.write(lines)
+            self.__file.flush()
+
+    def close(self):
+        """Close the file."""
+        with self.__lock:
+            self.__file.close()
+
+
+class OTLPExporter(object):
+    """
+    An OTLPExporter sends finished spans in batches to an OpenTelemetry collector
+    using OTLP/HTTP with JSON encoding, e.g. a local collector or Jaeger. Spans
+    that can't be delivered are dropped and counted, so that tracing never
+    breaks the client.
+    """
+
+    def __init__(self, endpoint="http://localhost:4318/v1/traces", service_name="bookalope-client",
+                 batch_size=256, timeout=5.0):
         """
-        return self.__created
+        Initialize this exporter.
+
+        :param str endpoint: The URL of the collector's OTLP/HTTP traces endpoint.
+        :param str service_name: The service name reported with every span.
+        :param int batch_size: The number of spans sent at once.
+        :param float timeout: The timeout in seconds of a single export request.
+        """
+        self.__endpoint = endpoint
+        self.__service_name = service_name
+        self.__batch_size = batch_size
+        self.__timeout = timeout
+        self.__session = requests.Session()
+        self.__batch = []
+        self.__lock = threading.Lock()
+        self.__dropped = 0
+
+    def _reinit_after_fork(self):
+        """
+        Reset the lock and connections that a newly forked child process inherited,
+        and drop the parent's pending spans, which the parent sends itself.
+        """
+        self.__lock = threading.Lock()
+        self.__session = requests.Session()
+        self.__batch = []
 
     @property
-    def books(self):
-        """Return a list of Book instances associated with this Bookshelf."""
-        return self.__books
+    def dropped(self):
+        """Return the number of spans that couldn't be delivered."""
+        return self.__dropped
+
+    def export(self, spans):
+        """Add the given spans to the current batch, and send it once it's full."""
+        with self.__lock:
+            self.__batch.extend(spans)
+            if len(self.__batch) < self.__batch_size:
+                return
+            batch, self.__batch = self.__batch, []
+        self.__send(batch)
+
+    def close(self):
+        """Send the remaining spans."""
+        with self.__lock:
+            batch, self.__batch = self.__batch, []
+        if batch:
+            self.__send(batch)
+        self.__session.close()
+
+    def __send(self, spans):
+        """Send the given spans to the collector."""
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": self.__attributes({"service.name": self.__service_name})},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [{
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        "parentSpanId": span.parent_id or "",
+                        "name": span.name,
+                        "kind": 1,
+                        "startTimeUnixNano": str(span.start),
+                        "endTimeUnixNano": str(span.end),
+                        "attributes": self.__attributes(span.attributes),
+                        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                        } for span in spans],
+                    }],
+                }],
+            }
+        try:
+            response = self.__session.post(self.__endpoint, json=payload, timeout=self.__timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            with self.__lock:
+                self.__dropped += len(spans)
+
+    @staticmethod
+    def __attributes(attributes):
+        """Return the given attributes as a list of OTLP key/value pairs."""
+        pairs = []
+        for key, value in attributes.items():
+            if isinstance(value, bool):
+                value = {"boolValue": value}
+            elif isinstance(value, int):
+                value = {"intValue": str(value)}
+            elif isinstance(value, float):
+                value = {"doubleValue": value}
+            else:
+                value = {"stringValue": str(value)}
+            pairs.append({"key": key, "value": value})
+        return pairs
+
+
+def _to_srgb(image, icc_profile):
+    """
+    Convert an RGB, RGBA or CMYK image from its embedded ICC profile to sRGB.
 
-    def add_book(self, book):
+    :returns: The converted image, or None if the profile couldn't be applied.
+    """
+    if not _IMAGE_CMS:
+        return None
+    try:
+        profile = PIL.ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+        srgb = PIL.ImageCms.createProfile("sRGB")
+        mode = "RGBA" if image.mode == "RGBA" else "RGB"
+        return PIL.ImageCms.profileToProfile(image, profile, srgb, outputMode=mode)
+    except (OSError, ValueError, PIL.ImageCms.PyCMSError):
+        return None
+
+
+def _optimize_image(image, image_filename, max_dimension, format_, quality):
+    """
+    Downscale, recompress and strip the metadata of an image. This function runs
+    in a worker process of the ImageOptimizer.
+
+    :param image: A file name, or a bytes-like object with the image.
+    :param str image_filename: The file name of the image.
+    :returns tuple: A (file name, bytes, original size) tuple; the original image
+                    is returned if it couldn't be made smaller.
+    """
+    if isinstance(image, str):
+        with open(image, "rb") as file_:
+            image = file_.read()
+    try:
+        with PIL.Image.open(io.BytesIO(image)) as original:
+            # Apply the EXIF orientation because the metadata is dropped.
+            optimized = PIL.ImageOps.exif_transpose(original)
+            optimized.thumbnail((max_dimension, max_dimension))
+            # Convert the colors of e.g. print-oriented CMYK covers with their ICC
+            # profile; if that's not possible then keep the profile instead.
+            icc_profile = original.info.get("icc_profile")
+            if icc_profile and optimized.mode in ("RGB", "RGBA", "CMYK"):
+                converted = _to_srgb(optimized, icc_profile)
+                if converted is not None:
+                    optimized, icc_profile = converted, None
+            if optimized.mode == "CMYK" and icc_profile:
+                if format_ != "JPEG":
+                    return image_filename, image, len(image)
+            elif optimized.mode not in ("RGB", "L"):
+                if "A" in optimized.getbands() or "transparency" in optimized.info:
+                    rgba = optimized.convert("RGBA")
+                    optimized = PIL.Image.new("RGB", rgba.size, "white")
+                    optimized.paste(rgba, mask=rgba.getchannel("A"))
+                else:
+                    optimized = optimized.convert("RGB")
+            buffer = io.BytesIO()
+            options = {"icc_profile": icc_profile} if icc_profile else {}
+            optimized.save(buffer, format=format_, quality=quality, optimize=True, **options)
+    except (OSError, ValueError, PIL.Image.DecompressionBombError):
+        return image_filename, image, len(image)
+    if buffer.tell() >= len(image):
+        return image_filename, image, len(image)
+    ext = ".webp" if format_ == "WEBP" else ".jpg"
+    return os.path.splitext(image_filename)[0] + ext, buffer.getvalue(), len(image)
+
+
+class ImageOptimizer(object):
+    """
+    An ImageOptimizer shrinks cover and other images before they are uploaded:
+    it downscales images to a maximum dimension, recompresses them as JPEG or
+    WebP with a given quality, and strips their metadata. The CPU heavy work
+    runs in a process pool so that it doesn't block the client's I/O threads.
+    Requires Pillow.
+    """
+
+    def __init__(self, max_dimension=2400, format_="JPEG", quality=85, max_workers=None):
         """
-        Add the given Book instance to this Bookshelf.
+        Initialize this ImageOptimizer instance. The process pool is started
+        when the first image is optimized.
+
+        :param int max_dimension: The maximum width and height of an image.
+        :param str format_: The target image format, either 'JPEG' or 'WEBP'.
+        :param int quality: The target quality between 1 and 100.
+        :param int max_workers: The number of worker processes; defaults to the
+                                number of CPUs.
+        :raises: BookalopeError if Pillow is not installed; ValueError if the
+                 format is not supported.
+        """
+        if PIL is None:
+            raise BookalopeError("Image optimization requires Pillow, please install it")
+        if format_ not in ("JPEG", "WEBP"):
+            raise ValueError("Unsupported image format: " + format_)
+        self.__max_dimension = max_dimension
+        self.__format = format_
+        self.__quality = quality
+        self.__max_workers = max_workers
+        self.__executor = None
+        self.__lock = threading.Lock()
+        self.__images = 0
+        self.__bytes_in = 0
+        self.__bytes_out = 0
+
+    def _reinit_after_fork(self):
+        """
+        Reset the lock and the process pool that a newly forked child process
+        inherited; a new pool is started when the next image is optimized.
+        """
+        self.__lock = threading.Lock()
+        self.__executor = None
 
-        :param book: The Book that's being added to this Bookshelf.
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps({
+                "images": self.__images,
+                "bytes_in": self.__bytes_in,
+                "bytes_out": self.__bytes_out,
+                }))
+        return repr_s
+
+    def close(self):
+        """Shut down the process pool."""
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def optimize(self, image, image_filename):
         """
-        return book.move_to_bookshelf(self)
+        Optimize the given image in the process pool. Images that Pillow can't
+        read, or that don't get smaller, are returned unchanged.
 
-    def remove_book(self, book):
+        :param image: A file name, or a bytes-like object with the image.
+        :param str image_filename: The file name of the image.
+        :returns tuple: The (file name, bytes) of the optimized image; the file
+                        name extension changes with the image format.
         """
-        Remove the given Book instance from this Bookshelf.
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.__max_workers)
+            executor = self.__executor
+        future = executor.submit(_optimize_image, image, image_filename,
+                                 self.__max_dimension, self.__format, self.__quality)
+        image_filename, image_bytes, size = _wait(future)
+        with self.__lock:
+            self.__images += 1
+            self.__bytes_in += size
+            self.__bytes_out += len(image_bytes)
+        return image_filename, image_bytes
 
-        :param book: The Book that's being added to this Bookshelf.
+    @property
+    def images(self):
+        """Return the number of images that were processed."""
+        return self.__images
+
+    @property
+    def bytes_in(self):
+        """Return the total size of all images before optimization."""
+        return self.__bytes_in
+
+    @property
+    def bytes_out(self):
+        """Return the total size of all images after optimization."""
+        return self.__bytes_out
+
+    @property
+    def bytes_saved(self):
+        """Return the total number of bytes saved by optimization."""
+        return self.__bytes_in - self.__bytes_out
+
+
+class ConversionStats(object):
+    """
+    A small SQLite store of observed durations of document analyses and
+    conversions, together with the document size and the conversion's format
+    and style. From these samples it estimates how long an analysis or a
+    conversion is going to take, which the StatusMonitor uses to schedule the
+    first poll near the predicted completion instead of polling early.
+    """
+
+    def __init__(self, path=":memory:", window=50, min_samples=3):
         """
-        return book.remove_from_bookshelf()
+        Open or create the stats store.
 
+        :param str path: The file name of the SQLite database; defaults to an
+                         in-memory database.
+        :param int window: The number of most recent samples used for estimates.
+        :param int min_samples: The number of samples required for an estimate.
+        """
+        self.__window = window
+        self.__min_samples = min_samples
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        with self.__db:
+            self.__db.executescript("""
+                CREATE TABLE IF NOT EXISTS samples (
+                    kind TEXT NOT NULL,
+                    format TEXT,
+                    style TEXT,
+                    size INTEGER,
+                    duration REAL NOT NULL,
+                    recorded REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS samples_kind ON samples (kind, format, style, recorded);
+                """)
+
+    def _reinit_after_fork(self):
+        """Reset the lock that a newly forked child process inherited."""
+        self.__lock = threading.Lock()
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self.__lock:
+            self.__db.close()
+
+    def record(self, kind, duration, size=None, format_=None, style=None):
+        """
+        Record an observed duration.
 
-class Book(object):
+        :param str kind: Either 'analysis' or 'conversion'.
+        :param float duration: The observed duration in seconds.
+        :param int size: The optional size of the document in bytes.
+        :param str format_: The conversion format, or None for an analysis.
+        :param str style: The short name of the conversion style, or None.
+        """
+        with self.__lock, self.__db:
+            self.__db.execute(
+                "INSERT INTO samples (kind, format, style, size, duration, recorded) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, format_, style, size, duration, time.time()))
+
+    def estimate(self, kind, size=None, format_=None, style=None):
+        """
+        Estimate the duration of an analysis or conversion from the most recent
+        matching samples. Samples with the same format and style are preferred,
+        then samples with the same format, then all samples of the kind. If the
+        samples and the given size allow it, the estimate follows a least-squares
+        line over the document size; otherwise it's the median duration.
+
+        :param str kind: Either 'analysis' or 'conversion'.
+        :param int size: The optional size of the document in bytes.
+        :param str format_: The conversion format, or None for an analysis.
+        :param str style: The short name of the conversion style, or None.
+        :returns float: The estimated duration in seconds, or None.
+        """
+        queries = [
+            ("kind = ? AND format IS ? AND style IS ?", (kind, format_, style)),
+            ("kind = ? AND format IS ?", (kind, format_)),
+            ("kind = ?", (kind,)),
+            ]
+        for where, params in queries:
+            with self.__lock:
+                rows = self.__db.execute(
+                    "SELECT size, duration FROM samples WHERE " + where + " ORDER BY recorded DESC LIMIT ?",
+                    params + (self.__window,)).fetchall()
+            if len(rows) >= self.__min_samples:
+                return self.__fit(rows, size)
+        return None
+
+    def __fit(self, rows, size):
+        """Estimate a duration for the given size from (size, duration) samples."""
+        durations = sorted(duration for _, duration in rows)
+        median = durations[len(durations) // 2]
+        sized = [(x, y) for x, y in rows if x is not None]
+        if size is None or len(sized) < self.__min_samples:
+            return median
+        mean_x = sum(x for x, _ in sized) / len(sized)
+        mean_y = sum(y for _, y in sized) / len(sized)
+        var_x = sum((x - mean_x) ** 2 for x, _ in sized)
+        if not var_x:
+            return median
+        slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in sized) / var_x)
+        return max(0.0, mean_y + slope * (size - mean_x))
+
+
+class ArtifactCache(object):
     """
-    The Book class describes a single book as used by Bookalope. A Book may be
-    associated with a Bookshelf, it has only one name, and a list of conversions:
-    the Bookflows. Note that title, author, and other information is stored as
-    part of the Bookflow, not the Book itself.
+    A thread-safe, in-memory cache for downloaded bookflow artifacts, i.e.
+    converted documents and images. The cache is bounded by the total number
+    of bytes it holds, and evicts the least recently used artifacts first.
+    Bookflows invalidate their cached artifacts when they change.
     """
 
-    def __init__(self, bookalope, id_or_packed=None, name=None, bookshelf=None):
+    def __init__(self, max_bytes=256 * 1024 * 1024):
         """
-        Create or initialize a new Book instance. The new Book instance is created
-        on the Bookalope server and this instance is initialized with the new
-        data. Note that the default book name is set to '<none>', and an empty
-        bookflow will be created for this book as well.
+        Initialize this empty ArtifactCache instance.
 
-        :param bookalope: A Bookalope instance.
-        :param bookshelf: An optional Bookshelf instance.
-        :param str id_or_packed: None to create a new Book instance; a valid
-                                 Bookalope token string with a book id; or a
-                                 dictionary containing packed book information.
-        :param str name: An optional name for this Book.
+        :param int max_bytes: The maximum number of bytes held by the cache.
         """
-        assert isinstance(bookalope, BookalopeClient)
-        self.__bookalope = bookalope
-        if id_or_packed is None:
-            params = {
-                "name": name or "<none>",
-                }
-            if bookshelf:
-                params["bookshelf_id"] = bookshelf.id
-            url = "/api/books"
-            book = self.__bookalope.http_post(url, params)["book"]
-        elif isinstance(id_or_packed, str):
-            if not _is_token(id_or_packed):
-                raise TokenError(id_or_packed)
-            url = "/api/books/" + id_or_packed
-            book = self.__bookalope.http_get(url)["book"]
-            if bookshelf and book.bookshelf and bookshelf.id != book.bookshelf.id:
-                raise BookflowError("Bookshelf and Book's bookshelf are not the same")
-        elif isinstance(id_or_packed, dict):
-            book = id_or_packed
-            if bookshelf and book.bookshelf and bookshelf.id != book.bookshelf.id:
-                raise BookflowError("Bookshelf and Book's bookshelf are not the same")
-        else:
-            raise TypeError()
-        self.__id = book["id"]
-        self.__url = "/api/books/{}".format(self.__id)
-        self.__name = book["name"]
-        self.__created = datetime.datetime.strptime(book["created"], "%Y-%m-%dT%H:%M:%S")
-        if bookshelf:
-            self.__bookshelf = bookshelf
-        elif book.bookshelf:
-            self.__bookshelf = Bookshelf(self.__bookalope, book.bookshelf.id)
-        else:
-            self.__bookshelf = None
-        bookflows = book["bookflows"]
-        self.__bookflows = [Bookflow(self.__bookalope, self, _) for _ in bookflows]
+        self.__max_bytes = max_bytes
+        self.__size = 0
+        self.__artifacts = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+
+    def _reinit_after_fork(self):
+        """Reset the lock that a newly forked child process inherited."""
+        self.__lock = threading.Lock()
 
     def __repr__(self):
         """Return a printable representation of this instance."""
@@ -724,209 +4576,343 @@ class Book(object):
             self.__class__.__module__,
             self.__class__.__name__,
             hex(id(self)),
-            json.dumps(self.pack()))
+            json.dumps({
+                "size": self.__size,
+                "max_bytes": self.__max_bytes,
+                "hits": self.__hits,
+                "misses": self.__misses,
+                }))
         return repr_s
 
-    def update(self):
-        """
-        Queries the Bookalope server for this Book's server-side data, and updates
-        this instance with that data. Note that this creates a new list with new
-        Bookflow instances, that may compete with references to older Bookflow
-        instances, as well as a new (optional) Bookshelf instance.
-        """
-        book = self.__bookalope.http_get(self.url)["book"]
-        self.__name = book["name"]
-        if book.bookshelf:
-            self.__bookshelf = Bookshelf(self.__bookalope, book.bookshelf.id)
-        else:
-            self.__bookshelf = None
-        bookflows = book["bookflows"]
-        self.__bookflows = [Bookflow(self.__bookalope, self, _) for _ in bookflows]
+    def __len__(self):
+        """Return the number of cached artifacts."""
+        return len(self.__artifacts)
 
-    def save(self):
-        """
-        Post this Book's instance data to the Bookalope server, i.e. stores the
-        name of this book.
+    def get(self, key):
         """
-        params = {
-            "name": self.__name,
-            "bookshelf_id": self.__bookshelf.id if self.__bookshelf else None,
-            }
-        return self.__bookalope.http_post(self.url, params)
+        Return the cached artifact for the given key and mark it as most recently
+        used, or None if the artifact isn't cached.
 
-    def delete(self):
+        :param tuple key: A (bookflow id, kind, name) tuple.
+        :returns bytes: The artifact, or None.
         """
-        Delete this Book from the Bookalope server. Subsequent calls to save()
-        will fail on the server side.
+        with self.__lock:
+            artifact = self.__artifacts.get(key)
+            if artifact is None:
+                self.__misses += 1
+                return None
+            self.__artifacts.move_to_end(key)
+            self.__hits += 1
+            return artifact
+
+    def put(self, key, artifact):
         """
-        return self.__bookalope.http_delete(self.url)
+        Add the given artifact to the cache, and evict least recently used
+        artifacts until the cache fits into its byte budget. Artifacts larger
+        than the budget are not cached.
 
-    def pack(self):
+        :param tuple key: A (bookflow id, kind, name) tuple.
+        :param bytes artifact: The artifact.
         """
-        Pack this instance data into a dictionary that can be encoded as a JSON
-        string and is compatible to the Bookalope Book data.
-
-        :returns dict: This Book's information as a Bookalope compatible
-                       dictionary.
+        if len(artifact) > self.__max_bytes:
+            return
+        with self.__lock:
+            old = self.__artifacts.pop(key, None)
+            if old is not None:
+                self.__size -= len(old)
+            self.__artifacts[key] = artifact
+            self.__size += len(artifact)
+            while self.__size > self.__max_bytes:
+                _, evicted = self.__artifacts.popitem(last=False)
+                self.__size -= len(evicted)
+
+    def invalidate(self, bookflow_id, key=None):
         """
-        packed = {
-            "id": self.__id,
-            "name": self.__name,
-            "created": self.__created.strftime("%Y-%m-%dT%H:%M:%S"),
-            "bookshelf": {
-                "id": self.__bookshelf.id,
-                "name": self.__bookshelf.name,
-                "description": self.__bookshelf.description,
-                "created": self.__bookshelf.created,
-                } if self.__bookshelf else None,
-            "bookflows": [_.pack() for _ in self.__bookflows],
-            }
-        return packed
+        Remove all cached artifacts of the given bookflow, or only the one with
+        the given key.
+
+        :param str bookflow_id: The id of the bookflow.
+        :param tuple key: An optional (bookflow id, kind, name) tuple.
+        """
+        with self.__lock:
+            keys = [key] if key else [_ for _ in self.__artifacts if _[0] == bookflow_id]
+            for key_ in keys:
+                artifact = self.__artifacts.pop(key_, None)
+                if artifact is not None:
+                    self.__size -= len(artifact)
+
+    def clear(self):
+        """Remove all cached artifacts, and reset the hit and miss counters."""
+        with self.__lock:
+            self.__artifacts.clear()
+            self.__size = 0
+            self.__hits = 0
+            self.__misses = 0
 
     @property
-    def id(self):
-        """Return the Bookalope token id for this Book instance."""
-        return self.__id
+    def size(self):
+        """Return the total number of bytes of all cached artifacts."""
+        return self.__size
 
     @property
-    def url(self):
-        """Return the API endpoint URL for this Book instance."""
-        return self.__url
+    def max_bytes(self):
+        """Return the maximum number of bytes that this cache holds."""
+        return self.__max_bytes
 
     @property
-    def name(self):
-        """Return the name of this Book instance."""
-        return self.__name
+    def hits(self):
+        """Return the number of cache lookups that found an artifact."""
+        return self.__hits
 
-    @name.setter
-    def name(self, name):
+    @property
+    def misses(self):
+        """Return the number of cache lookups that found no artifact."""
+        return self.__misses
+
+
+# All live warm-start caches, which are saved when the interpreter exits.
+_WARM_START_CACHES = weakref.WeakSet()
+
+
+def _save_warm_start_caches():
+    """Save all live warm-start caches."""
+    for cache in list(_WARM_START_CACHES):
+        cache.save()
+
+
+atexit.register(_save_warm_start_caches)
+
+
+class WarmStartCache(object):
+    """
+    A WarmStartCache keeps the server's catalog responses (formats, styles per
+    format, and the user profile) and the validated language names in a small
+    JSON file, so that a new process, e.g. a CLI invocation or a cron script,
+    starts working right away instead of querying the server first. Entries are
+    keyed by server host, API version and auth token, and expire after a given
+    time. Several processes can share the cache file.
+    """
+
+    # The version of the cache file format; files of other versions are ignored.
+    _FORMAT = 1
+
+    def __init__(self, path=None, ttl=86400.0):
         """
-        Change the name of this Book instance locally. Use save() to store the
-        change to the Bookalope server.
+        Initialize this cache and load the cache file, if there is one.
 
-        :param str name: The new book name.
+        :param str path: The name of the cache file; defaults to 'warm-start.json'
+                         in the user's cache directory.
+        :param float ttl: The number of seconds after which an entry expires.
         """
-        self.__name = name
+        if path is None:
+            cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+            path = os.path.join(cache_home, "bookalope", "warm-start.json")
+        self.__path = path
+        self.__ttl = ttl
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__entries, languages = self.__load()
+        self.__removed = set()
+        self.__dirty = False
+        _LANGUAGES.update(languages)
+        self.__languages = len(_LANGUAGES)
+        _WARM_START_CACHES.add(self)
+
+    def _reinit_after_fork(self):
+        """Reset the lock that a newly forked child process inherited."""
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps({
+                "path": self.__path,
+                "entries": len(self.__entries),
+                "hits": self.__hits,
+                "misses": self.__misses,
+                }))
+        return repr_s
+
+    def __len__(self):
+        """Return the number of entries in this cache."""
+        return len(self.__entries)
 
     @property
-    def created(self):
-        """
-        Return a Python datetime instance that represents the date when this
-        Book instance was created.
+    def path(self):
+        """Return the name of the cache file."""
+        return self.__path
+
+    def get(self, bookalope, url, params=None):
         """
-        return self.__created
+        Return the cached response of the given catalog request, or None if there
+        is no fresh response in the cache.
 
-    @property
-    def bookshelf(self):
+        :param bookalope: A Bookalope instance.
+        :param str url: The URL string of the service endpoint.
+        :param dict params: The optional query parameters of the request.
         """
-        Return the Bookshelf instance that this Book is associated with.
+        key = self.__key(bookalope, url, params)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry["stored"] + self.__ttl < time.time():
+                self.__misses += 1
+                return None
+            self.__hits += 1
+            return entry["value"]
+
+    def put(self, bookalope, url, value, params=None):
         """
-        return self.__bookshelf
+        Store the response of the given catalog request, and write the cache file.
 
-    def move_to_bookshelf(self, bookshelf):
+        :param bookalope: A Bookalope instance.
+        :param str url: The URL string of the service endpoint.
+        :param value: The decoded JSON response.
+        :param dict params: The optional query parameters of the request.
         """
-        Move this Book onto the specified Bookshelf. If the Book is already associated
-        with a Bookshelf then it moves to the new one.
+        key = self.__key(bookalope, url, params)
+        with self.__lock:
+            self.__entries[key] = {"stored": time.time(), "value": value}
+            self.__removed.discard(key)
+            self.__dirty = True
+        self.save()
+
+    def invalidate(self, bookalope, url, params=None):
+        """
+        Remove the cached response of the given catalog request, e.g. after the
+        data changed on the server, and write the cache file.
 
-        :param bookshelf: A Bookshelf instance to which this Book is being added.
+        :param bookalope: A Bookalope instance.
+        :param str url: The URL string of the service endpoint.
+        :param dict params: The optional query parameters of the request.
         """
-        assert isinstance(bookshelf, Bookshelf)
-        params = {
-            "bookshelf_id": bookshelf.id,
-            }
-        self.__bookalope.http_post(self.__url, params)
+        key = self.__key(bookalope, url, params)
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__removed.add(key)
+            self.__dirty = True
+        self.save()
+
+    def close(self):
+        """Write the cache file; the cache is no longer saved when the interpreter exits."""
+        _WARM_START_CACHES.discard(self)
+        self.save()
+
+    def clear(self):
+        """Remove all entries from this cache and from the cache file."""
+        with self.__lock:
+            self.__entries = {}
+            self.__removed = set()
+            self.__dirty = False
+            if os.path.exists(self.__path):
+                os.remove(self.__path)
 
-    def remove_from_bookshelf(self):
+    def save(self):
         """
-        Remove this Book from its Bookshelf.
+        Write this cache to the cache file, merged with the entries that other
+        processes wrote in the meantime; expired entries are dropped. The file is
+        replaced atomically, and errors are ignored because the cache is only an
+        optimization.
         """
-        params = {
-            "bookshelf_id": None,
-            }
-        self.__bookalope.http_post(self.__url, params)
-
-    @property
-    def bookflows(self):
-        """Return a list of Bookflow instances associated with this Book."""
-        return self.__bookflows
-
-    def create_bookflow(self, name=None, title=None):
+        with self.__lock:
+            if not self.__dirty and len(_LANGUAGES) == self.__languages:
+                return
+            entries, languages = self.__load()
+            for key, entry in self.__entries.items():
+                if key not in entries or entries[key]["stored"] <= entry["stored"]:
+                    entries[key] = entry
+            for key in self.__removed:
+                entries.pop(key, None)
+            expired = time.time() - self.__ttl
+            self.__entries = {key: entry for key, entry in entries.items() if entry["stored"] >= expired}
+            languages.update(_LANGUAGES)
+            data = {
+                "format": self._FORMAT,
+                "babel": babel.__version__,
+                "entries": self.__entries,
+                "languages": languages,
+                }
+            partial = "{}.{}.part".format(self.__path, os.getpid())
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.__path)), exist_ok=True)
+                with open(partial, "w", encoding="utf-8") as file_:
+                    json.dump(data, file_)
+                os.replace(partial, self.__path)
+                self.__removed = set()
+                self.__dirty = False
+                self.__languages = len(_LANGUAGES)
+            except OSError:
+                if os.path.exists(partial):
+                    os.remove(partial)
+
+    def __load(self):
         """
-        Create a new Bookflow on the Bokalope server and return an initialized
-        Bookflow instance.
-
-        :param str name: An optional name for this Book.
-        :param str title: An optional title for this Book.
+        Read the cache file, and return its entries and its languages; or empty
+        dictionaries if there is no valid cache file.
         """
-        bookflow = Bookflow(self.__bookalope, self, name=name, title=title)
-        self.__bookflows += [bookflow]
-        return bookflow
+        try:
+            with open(self.__path, encoding="utf-8") as file_:
+                data = json.load(file_)
+        except (OSError, ValueError):
+            return {}, {}
+        if not isinstance(data, dict) or data.get("format") != self._FORMAT:
+            return {}, {}
+        languages = data.get("languages", {}) if data.get("babel") == babel.__version__ else {}
+        return data.get("entries", {}), languages
+
+    @staticmethod
+    def __key(bookalope, url, params):
+        """
+        Return the cache key of a catalog request: the server host, the API version,
+        a digest of the auth token, and the URL with its sorted query parameters.
+        """
+        token = hashlib.sha256((bookalope.token or "").encode()).hexdigest()[:16]
+        query = "&".join("{}={}".format(k, v) for k, v in sorted((params or {}).items()))
+        return " ".join((bookalope.host, _API_VERSION, token, url + ("?" + query if query else "")))
 
 
-class Bookflow(object):
+class StatusMonitor(object):
     """
-    The Bookflow class describes a Bookalope conversion flow--the 'bookflow'. A
-    bookflow also contains the book's title, author, and other related information.
-    All document uploads, image handling, and conversion is handled by this
-    class.
+    The StatusMonitor multiplexes the polling of many in-flight bookflows and
+    conversions onto a single scheduler thread. Every watched (bookflow, format)
+    pair is polled with its own backoff, all polls are scheduled from a single
+    timer wheel, and the total number of polls is limited by a global budget of
+    polls per second. Watchers are notified through futures and callbacks.
     """
 
-    def __init__(self, bookalope, book, id_or_packed=None, name=None, title=None):
+    def __init__(self, bookalope, polls_per_second=10, initial_interval=2.0,
+                 max_interval=60.0, backoff=1.5, max_errors=5, max_workers=8):
         """
-        Create or initialize a new Bookflow instance. The new bookflow is created
-        on the Bookalope server side, and this Bookflow instance is then initialized
-        from the new bookflow data. If a valid bookflow id is given, the new
-        Bookflow instance is initialized from that existing bookflow.
-
-        Note: initialization does not update the bookflow's metadata; instead
-              call update() manually. This is to prevent too many server requests.
-
-        :param bookalope: A Bookalope instance.
-        :param book: A Book instance for which this bookflow is created.
-        :param str id_or_packed: None to create a new Bookflow instance; a valid
-                                 Bookalope token string with a bookflow id; or
-                                 a dictionary containing packed bookflow information.
-        :raises: BookflowError if the Bookflow's book and the specified book are different.
+        Initialize this StatusMonitor instance. The scheduler thread is started
+        when the first watch is added.
+
+        :param bookalope: A Bookalope instance that's used to poll the server.
+        :param float polls_per_second: The global budget of polls per second.
+        :param float initial_interval: The first poll interval in seconds.
+        :param float max_interval: The maximum poll interval in seconds.
+        :param float backoff: The factor by which the poll interval of a watch
+                              grows whenever a poll observed no change.
+        :param int max_errors: The number of consecutive failed polls after which
+                               a watch fails.
+        :param int max_workers: The number of threads that execute polls.
         """
         assert isinstance(bookalope, BookalopeClient)
         self.__bookalope = bookalope
-        if id_or_packed is None:
-            params = {
-                "name": name or "Bookflow",
-                "title": title or "<no-title>",
-                }
-            url = "/api/books/{}/bookflows".format(book.id)
-            bookflow = self.__bookalope.http_post(url, params)["bookflow"]
-        elif isinstance(id_or_packed, str):
-            if not _is_token(id_or_packed):
-                raise TokenError(id_or_packed)
-            url = "/api/bookflows/{}".format(id_or_packed)
-            bookflow = self.__bookalope.http_get(url)["bookflow"]
-            if bookflow.book.id != book.id:
-                raise BookflowError("Book and Bookflow's book are not the same")
-        elif isinstance(id_or_packed, dict):
-            bookflow = id_or_packed
-        else:
-            raise TypeError()
-        # BUGBUG: I can pass a Bookflow from a different Book here.
-        self.__id = bookflow["id"]
-        self.__name = bookflow["name"]
-        self.__step = bookflow["step"]
-        self.__credit = None
-        if bookflow["credit"]:
-            self.__credit = bookflow["credit"]["type"]
-            # TODO: Does a client want to know formats here as well?
-        self.__book = book
-        self.__url = "/api/bookflows/{}".format(self.__id)
-        # Metadata that can be modified.
-        # TODO: Consider update() here to pull in server data.
-        self.__title = None
-        self.__author = None
-        self.__copyright = None
-        self.__isbn = None
-        self.__language = None
-        self.__pubdate = None
-        self.__publisher = None
+        self.__initial_interval = initial_interval
+        self.__max_interval = max_interval
+        self.__backoff = backoff
+        self.__max_errors = max_errors
+        self.__max_workers = max_workers
+        self.__budget = _RateLimiter(polls_per_second)
+        self.__wheel = _TimerWheel()
+        self.__watches = {}
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__executor = None
+        self.__closed = False
 
     def __repr__(self):
         """Return a printable representation of this instance."""
@@ -934,341 +4920,1337 @@ class Bookflow(object):
             self.__class__.__module__,
             self.__class__.__name__,
             hex(id(self)),
-            json.dumps(self.pack()))
+            json.dumps({
+                "watches": len(self),
+                }))
         return repr_s
 
-    def update(self):
+    def __len__(self):
+        """Return the number of currently watched (bookflow, format) pairs."""
+        with self.__lock:
+            return len(self.__watches)
+
+    def watch(self, bookflow, format_=None, callback=None):
         """
-        Queries the Bookalope server for this Bookflow's server-side data, and
-        updates this instance with that data.
+        Start watching the given bookflow. If no format is given then the step of
+        the bookflow is watched until it leaves 'processing'; otherwise the status
+        of the conversion into the given format is watched until it leaves
+        'processing'. Watching the same pair more than once does not add polls.
+        If the client has ConversionStats then the first poll of a Bookflow is
+        scheduled near the estimated completion time.
+
+        :param bookflow: A Bookflow instance, or a bookflow id string.
+        :param str format_: An optional conversion format, see `Bookflow.convert`.
+        :param callback: An optional callable that's called with the arguments
+                         (bookflow, format_, status) whenever the observed step
+                         or status changes.
+        :returns: A concurrent.futures.Future that resolves to the final step or
+                  conversion status.
+        :raises: TokenError if the given bookflow id is invalid; BookalopeError
+                 if the monitor was closed.
         """
-        bookflow = self.__bookalope.http_get(self.url)["bookflow"]
-        self.__name = bookflow["name"]
-        self.__step = bookflow["step"]
-        self.__credit = None
-        if bookflow["credit"]:
-            self.__credit = bookflow["credit"]["type"]
-            # TODO: Does a client want to know formats here as well?
-        self.__title = bookflow["title"]
-        self.__author = bookflow["author"]
-        self.__copyright = bookflow["copyright"]
-        self.__isbn = bookflow["isbn"]
-        self.__language = bookflow["language"]
-        self.__pubdate = bookflow["pubdate"]
-        self.__publisher = bookflow["publisher"]
+        if isinstance(bookflow, str):
+            if not _is_token(bookflow):
+                raise TokenError(bookflow)
+            bookflow_id = bookflow
+        else:
+            bookflow_id = bookflow.id
+        future = concurrent.futures.Future()
+        key = (bookflow_id, format_)
+        with self.__lock:
+            if self.__closed:
+                raise BookalopeError("Status monitor was closed")
+            watch = self.__watches.get(key)
+            if watch is None:
+                watch = _Watch(bookflow, format_, self.__initial_interval)
+                self.__watches[key] = watch
+                # Poll first shortly before the estimated completion, if there is an
+                # estimate. Polling a little early lets the observed durations, and
+                # with them the estimates, shrink if the server got faster.
+                eta = bookflow.eta(format_) if isinstance(bookflow, Bookflow) else None
+                self.__wheel.schedule(0.9 * eta if eta else 0, key)
+            watch.futures.append(future)
+            if callback is not None:
+                watch.callbacks.append(callback)
+            self.__start()
+        return future
+
+    def unwatch(self, bookflow, format_=None):
+        """
+        Stop watching the given bookflow and cancel all of its pending futures.
 
-    def save(self):
-        """Post this Bookflow's instance data to the Bookalope server."""
-        params = {
-            "name": self.__name,
-            }
-        params.update({k: v for k, v in self.metadata().items() if v is not None})
-        return self.__bookalope.http_post(self.url, params)
+        :param bookflow: A Bookflow instance, or a bookflow id string.
+        :param str format_: An optional conversion format.
+        """
+        bookflow_id = bookflow if isinstance(bookflow, str) else bookflow.id
+        with self.__lock:
+            watch = self.__watches.pop((bookflow_id, format_), None)
+        if watch is not None:
+            for future in watch.futures:
+                future.cancel()
+
+    def detach(self, bookflow, format_, future, callback=None):
+        """
+        Remove a single watcher, i.e. the future and callback returned by and passed
+        to watch(), and cancel its future. The other watchers of the bookflow are
+        not affected, and the bookflow is polled until it has no watchers left.
+
+        :param bookflow: A Bookflow instance, or a bookflow id string.
+        :param str format_: An optional conversion format.
+        :param future: The future that watch() returned.
+        :param callback: The callback that was passed to watch(), if any.
+        """
+        bookflow_id = bookflow if isinstance(bookflow, str) else bookflow.id
+        key = (bookflow_id, format_)
+        with self.__lock:
+            watch = self.__watches.get(key)
+            if watch is not None:
+                if future in watch.futures:
+                    watch.futures.remove(future)
+                if callback is not None and callback in watch.callbacks:
+                    watch.callbacks.remove(callback)
+                if not watch.futures:
+                    del self.__watches[key]
+        future.cancel()
+
+    def close(self):
+        """
+        Stop the scheduler thread, and cancel the futures of all current watches.
+        """
+        with self.__lock:
+            self.__closed = True
+            watches = list(self.__watches.values())
+            self.__watches.clear()
+            thread, self.__thread = self.__thread, None
+            executor, self.__executor = self.__executor, None
+        for watch in watches:
+            for future in watch.futures:
+                future.cancel()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def __start(self):
+        """Start the scheduler thread unless it's running already. Requires the lock."""
+        if self.__thread is None:
+            self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.__max_workers)
+            self.__thread = threading.Thread(target=self.__run, name="bookalope-status-monitor", daemon=True)
+            self.__thread.start()
+
+    def __run(self):
+        """The scheduler loop that turns the timer wheel and dispatches due polls."""
+        tick = self.__wheel.tick
+        next_tick = time.monotonic() + tick
+        while True:
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_tick += tick
+            with self.__lock:
+                if self.__closed:
+                    return
+                if not self.__watches:
+                    # Idle: stop ticking; the next watch() starts a new thread.
+                    self.__thread = None
+                    self.__wheel = _TimerWheel()
+                    executor, self.__executor = self.__executor, None
+                    break
+                due = self.__wheel.advance()
+                for key in due:
+                    watch = self.__watches.get(key)
+                    if watch is None:
+                        continue
+                    wait = self.__budget.try_acquire()
+                    if wait:
+                        # Over budget: try again once the next token is available.
+                        self.__wheel.schedule(wait, key)
+                        continue
+                    self.__executor.submit(self.__poll, key, watch)
+        executor.shutdown(wait=False)
+
+    def __poll(self, key, watch):
+        """Poll the server for the current step or status of the given watch."""
+        # Background polls are shared by all waiters, so they are not traced;
+        # the waiters' spans cover them. They are batch traffic.
+        token = _SPAN.set(False)
+        priority_token = _PRIORITY.set("batch")
+        try:
+            status = watch.poll(self.__bookalope)
+        except Exception as exc:  # pylint: disable=broad-except
+            watch.errors += 1
+            if watch.errors >= self.__max_errors:
+                self.__finish(key, watch, exception=exc)
+            else:
+                self.__reschedule(key, watch, changed=False)
+            return
+        finally:
+            _PRIORITY.reset(priority_token)
+            _SPAN.reset(token)
+        watch.errors = 0
+        changed = status != watch.status
+        watch.status = status
+        if changed:
+            for callback in list(watch.callbacks):
+                try:
+                    callback(watch.bookflow, watch.format, status)
+                except Exception:  # pylint: disable=broad-except
+                    pass
+        if status == "processing":
+            self.__reschedule(key, watch, changed)
+        else:
+            self.__finish(key, watch, result=status)
 
-    def delete(self):
+    def __reschedule(self, key, watch, changed):
+        """Schedule the next poll of the given watch, backing off if nothing changed."""
+        if changed:
+            watch.interval = self.__initial_interval
+        else:
+            watch.interval = min(self.__max_interval, watch.interval * self.__backoff)
+        with self.__lock:
+            if self.__watches.get(key) is watch:
+                self.__wheel.schedule(watch.interval, key)
+
+    def __finish(self, key, watch, result=None, exception=None):
+        """Remove the given watch and resolve all of its futures."""
+        with self.__lock:
+            if self.__watches.get(key) is watch:
+                del self.__watches[key]
+            futures = list(watch.futures)
+        for future in futures:
+            # A future may be cancelled concurrently, e.g. by detach().
+            if future.done():
+                continue
+            try:
+                if exception is not None:
+                    future.set_exception(exception)
+                else:
+                    future.set_result(result)
+            except concurrent.futures.InvalidStateError:
+                pass
+
+
+class _Watch(object):
+    """
+    The state of a single (bookflow, format) pair that's watched by the
+    StatusMonitor.
+    """
+
+    def __init__(self, bookflow, format_, interval):
         """
-        Delete this Bookflow from the Bookalope server. Subsequent calls to save()
-        will fail on the server side.
+        Initialize this watch.
+
+        :param bookflow: A Bookflow instance, or a bookflow id string.
+        :param str format_: The conversion format, or None to watch the step.
+        :param float interval: The initial poll interval in seconds.
         """
-        if self.processing:
-            raise BookflowError("Unable to delete a processing bookflow")
-        # TODO: Remove this Bookflow from the Book's list.
-        return self.__bookalope.http_delete(self.url)
+        self.bookflow = bookflow
+        self.format = format_
+        self.interval = interval
+        self.status = None
+        self.errors = 0
+        self.futures = []
+        self.callbacks = []
+
+    def poll(self, bookalope):
+        """
+        Query the Bookalope server for the current step or conversion status of
+        this watch. If the watched bookflow is a Bookflow instance then it is
+        updated as well.
 
-    def pack(self):
+        :param bookalope: A Bookalope instance.
+        :returns str: The current step or conversion status.
         """
-        Pack this instance data into a dictionary that can be encoded as a JSON
-        string and is compatible to the Bookalope Book data.
+        if isinstance(self.bookflow, Bookflow):
+            if self.format is None:
+                self.bookflow.update()
+                return self.bookflow.step
+            return self.bookflow.convert_status(self.format)
+        url = "/api/bookflows/{}".format(self.bookflow)
+        if self.format is None:
+            return bookalope.http_get(url)["bookflow"]["step"]
+        return bookalope.http_get(url + "/download/" + self.format + "/status")["status"]
 
-        :returns dict: This Bookflow's information as a Bookalope compatible
-                       dictionary.
+
+class _BrokerConnection(socketserver.StreamRequestHandler):
+    """A subscriber's connection to a StatusBroker, which exchanges JSON lines."""
+
+    def setup(self):
+        """Prepare the connection."""
+        super().setup()
+        self.lock = threading.Lock()
+
+    def handle(self):
+        """Serve the subscriber's requests until it disconnects."""
+        self.server.broker._serve(self)  # pylint: disable=protected-access
+
+    def send(self, message):
+        """Send the given message to the subscriber; a broken connection is ignored."""
+        data = (json.dumps(message) + "\n").encode()
+        with self.lock:
+            try:
+                self.wfile.write(data)
+            except OSError:
+                pass
+
+
+class _BrokerUnixServer(socketserver.ThreadingUnixStreamServer):
+    """The StatusBroker's server for a Unix socket."""
+
+    daemon_threads = True
+
+
+class _BrokerTCPServer(socketserver.ThreadingTCPServer):
+    """The StatusBroker's server for a TCP socket, which can rebind right after a restart."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _ChannelSubscription(object):
+    """The subscription of a StatusBroker's Redis channel, see StatusBroker.watch()."""
+
+    def __init__(self, send):
         """
-        packed = {
-            "book": self.__book.id,
-            "id": self.__id,
-            "name": self.__name,
-            "step": self.__step,
-            "credit": self.__credit,
-            }
-        return packed
+        Initialize this subscription.
 
-    def metadata(self):
-        """Pack the bookflow metadata into a dictionary and return that dictionary."""
-        metadata = {
-            "title": self.__title,
-            "author": self.__author,
-            "copyright": self.__copyright,
-            "isbn": self.__isbn,
-            "language": self.__language,
-            "pubdate": self.__pubdate,
-            "publisher": self.__publisher,
-            }
-        return metadata
+        :param send: A callable that publishes a message to the channel.
+        """
+        self.send = send
 
-    @property
-    def id(self):
-        """Return the Bookalope token id for this Bookflow instance."""
-        return self.__id
 
-    @property
-    def url(self):
-        """Return the API endpoint URL for this Bookflow instance."""
-        return self.__url
+class StatusBroker(object):
+    """
+    A StatusBroker does the status polling for any number of processes: it
+    accepts subscriber connections on a local Unix socket or a TCP address,
+    watches the bookflows and conversions they ask for with its client's
+    StatusMonitor (which deduplicates and backs off the polls), and publishes
+    every change of a step or conversion status to the subscribers of that
+    bookflow, and optionally to a Redis-compatible channel. The polling load
+    thus stays the same no matter how many processes wait for a bookflow.
+
+    Subscribers send JSON lines {"op": "watch" or "unwatch", "bookflow": id,
+    "format": format or null}, and receive JSON lines {"bookflow": id, "format":
+    format or null, "status": step or status, "final": bool, "error": message or
+    null}; see StatusSubscriber. If the broker has a secret then a subscriber's
+    first line must be {"op": "hello", "secret": secret}.
+
+    Consumers of the Redis channel can't send requests, so the broker's process
+    asks for their bookflows with watch() and unwatch() instead.
+
+    Subscribers can watch any bookflow with the broker's token, so a TCP socket
+    must not face untrusted networks; use a secret if it isn't bound to localhost.
+    """
 
-    @property
-    def name(self):
-        """Return the name of this Bookflow instance."""
-        return self.__name
+    def __init__(self, bookalope, address, redis=None, channel="bookalope:status", secret=None):
+        """
+        Initialize this broker and bind its socket; call start() or serve_forever()
+        to accept subscribers.
+
+        :param bookalope: A Bookalope instance whose StatusMonitor polls the server.
+        :param address: The file name of a Unix socket, a port number of a TCP
+                        socket on 127.0.0.1, or a (host, port) tuple of a TCP socket
+                        for subscribers on other hosts.
+        :param redis: An optional Redis client, or any object with a publish(channel,
+                      message) method, to which all messages are published as well.
+        :param str channel: The channel name for the Redis messages.
+        :param str secret: An optional shared secret that subscribers must present.
+        """
+        assert isinstance(bookalope, BookalopeClient)
+        self.__bookalope = bookalope
+        self.__redis = redis
+        self.__channel = channel
+        self.__subscriptions = {}
+        self.__last = {}
+        self.__futures = {}
+        self.__connections = set()
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__published = 0
+        self.__redis_errors = 0
+        self.__callback = self.__changed
+        self.__channel_subscription = _ChannelSubscription(self.__publish_redis)
+        self.__secret = secret
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self.__server = _BrokerUnixServer(address, _BrokerConnection)
+        else:
+            if isinstance(address, int):
+                address = ("127.0.0.1", address)
+            self.__server = _BrokerTCPServer(address, _BrokerConnection)
+        self.__server.broker = self
 
-    @name.setter
-    def name(self, name):
-        """Set the name for this bookflow instance."""
-        self.__name = name
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps(dict(self.stats, address=self.address)))
+        return repr_s
 
     @property
-    def step(self):
+    def stats(self):
         """
-        Return the current conversion step this Bookflow instance is currently in.
-        The step changes as the bookflow itself progresses by calling methods on
-        it, but it can not be modified.
+        Return a dictionary with the numbers of watched (bookflow, format) pairs,
+        of connected subscribers, of published messages, and of messages that
+        couldn't be published to Redis.
         """
-        return self.__step
+        with self.__lock:
+            return {
+                "subscriptions": len(self.__subscriptions),
+                "subscribers": len(self.__connections),
+                "published": self.__published,
+                "redis_errors": self.__redis_errors,
+                }
 
     @property
-    def credit(self):
+    def address(self):
+        """Return the address that this broker listens on, e.g. with the actual port."""
+        return self.__server.server_address
+
+    def start(self):
         """
-        Return the credit type associated with this Bookflow, either None, 'basic',
-        or 'pro'.
+        Accept subscribers in a background thread.
+
+        :returns: This StatusBroker instance.
         """
-        return self.__credit
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__server.serve_forever, name="bookalope-status-broker",
+                                             daemon=True)
+            self.__thread.start()
+        return self
 
-    @property
-    def book(self):
-        """Return the Book instance associated with this bookflow."""
-        return self.__book
+    def serve_forever(self):
+        """Accept subscribers until close() is called from another thread."""
+        self.__server.serve_forever()
 
-    @property
-    def title(self):
-        """Return the title of this bookflow's book."""
-        return self.__title
+    def close(self):
+        """
+        Stop accepting subscribers, close the socket and all subscriber connections,
+        and stop all watches.
+        """
+        if self.__thread is not None:
+            self.__server.shutdown()
+            self.__thread.join()
+            self.__thread = None
+        self.__server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        with self.__lock:
+            futures, self.__futures = self.__futures, {}
+            self.__subscriptions.clear()
+            self.__last.clear()
+            connections, self.__connections = self.__connections, set()
+        for connection in connections:
+            try:
+                connection.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for (bookflow_id, format_), future in futures.items():
+            self.__bookalope.status_monitor.detach(bookflow_id, format_, future, self.__callback)
+
+    def watch(self, bookflow, format_=None):
+        """
+        Watch the given bookflow for the consumers of the Redis channel, as if a
+        subscriber had asked for it; its changes are published to the channel. If
+        the bookflow is watched already then its last status is published again.
 
-    @title.setter
-    def title(self, title):
-        """Set the title for this bookflow's book."""
-        self.__title = title
+        :param bookflow: A Bookflow instance, or a bookflow id string.
+        :param str format_: An optional conversion format, see `Bookflow.convert`.
+        :raises: TokenError if the given bookflow id is invalid.
+        """
+        bookflow_id = bookflow if isinstance(bookflow, str) else bookflow.id
+        if not _is_token(bookflow_id):
+            raise TokenError(bookflow_id)
+        self.__subscribe(self.__channel_subscription, (bookflow_id, format_))
 
-    @property
-    def author(self):
-        """Get the author's name for this bookflow's book."""
-        return self.__author
+    def unwatch(self, bookflow, format_=None):
+        """
+        Stop watching the given bookflow for the consumers of the Redis channel;
+        the broker keeps watching it while subscribers are waiting for it.
 
-    @author.setter
-    def author(self, author):
-        """Set the author's name for this bookflow's book."""
-        self.__author = author
+        :param bookflow: A Bookflow instance, or a bookflow id string.
+        :param str format_: An optional conversion format.
+        """
+        bookflow_id = bookflow if isinstance(bookflow, str) else bookflow.id
+        self.__unsubscribe(self.__channel_subscription, (bookflow_id, format_))
 
-    @property
-    def copyright(self):
-        """Get the copyright string for this bookflow's book."""
-        return self.__copyright
+    def _serve(self, connection):
+        """Handle the requests of the given subscriber connection until it's closed."""
+        with self.__lock:
+            self.__connections.add(connection)
+        try:
+            if self.__secret is not None and not self.__authenticate(connection):
+                connection.send({"error": "Authentication failed"})
+                return
+            for line in connection.rfile:
+                try:
+                    message = json.loads(line)
+                    op, key = message["op"], (message["bookflow"], message.get("format"))
+                except (ValueError, KeyError, TypeError):
+                    connection.send({"error": "Invalid message"})
+                    continue
+                if op == "watch":
+                    self.__subscribe(connection, key)
+                elif op == "unwatch":
+                    self.__unsubscribe(connection, key)
+                else:
+                    connection.send({"error": "Unknown op: {}".format(op)})
+        except OSError:
+            pass
+        finally:
+            with self.__lock:
+                self.__connections.discard(connection)
+                keys = [key for key, connections in self.__subscriptions.items() if connection in connections]
+            for key in keys:
+                self.__unsubscribe(connection, key)
+
+    def __authenticate(self, connection):
+        """Return True if the connection's first line presents the broker's secret."""
+        try:
+            message = json.loads(connection.rfile.readline())
+            secret = message["secret"] if message["op"] == "hello" else None
+        except (ValueError, KeyError, TypeError):
+            return False
+        return isinstance(secret, str) and hmac.compare_digest(secret.encode(), self.__secret.encode())
+
+    def __subscribe(self, connection, key):
+        """Subscribe the connection to the given key, and start watching it if needed."""
+        with self.__lock:
+            connections = self.__subscriptions.get(key)
+            new = connections is None
+            if new:
+                connections = self.__subscriptions[key] = set()
+            connections.add(connection)
+            last = self.__last.get(key)
+        if last is not None:
+            connection.send(last)
+        if not new:
+            return
+        bookflow_id, format_ = key
+        try:
+            future = self.__bookalope.status_monitor.watch(bookflow_id, format_, callback=self.__callback)
+        except BookalopeError as exc:
+            self.__done(key, None, exc)
+            return
+        with self.__lock:
+            self.__futures[key] = future
+        future.add_done_callback(lambda _: self.__done(key, _))
+
+    def __unsubscribe(self, connection, key):
+        """Unsubscribe the connection from the given key, and stop watching it if unused."""
+        with self.__lock:
+            connections = self.__subscriptions.get(key)
+            if connections is None:
+                return
+            connections.discard(connection)
+            if connections:
+                return
+            del self.__subscriptions[key]
+            self.__last.pop(key, None)
+            future = self.__futures.pop(key, None)
+        # Detach only the broker's own watcher: in-process watchers of the same
+        # bookflow must not be cancelled by a remote subscriber.
+        if future is not None:
+            self.__bookalope.status_monitor.detach(key[0], key[1], future, self.__callback)
+
+    def __changed(self, bookflow_id, format_, status):
+        """Publish a changed step or conversion status; called by the StatusMonitor."""
+        self.__publish((bookflow_id, format_), {
+            "bookflow": bookflow_id,
+            "format": format_,
+            "status": status,
+            "final": False,
+            "error": None,
+            })
+
+    def __done(self, key, future, exception=None):
+        """Publish the final step or conversion status of a finished watch."""
+        status = None
+        if future is not None:
+            with self.__lock:
+                # A watch that was dropped, e.g. unsubscribed, has no one to notify;
+                # it must not finish a newer watch of the same key either.
+                if self.__futures.get(key) is not future:
+                    return
+                del self.__futures[key]
+            if future.cancelled():
+                exception = BookalopeError("Watch was cancelled")
+            elif future.exception() is not None:
+                exception = future.exception()
+            else:
+                status = future.result()
+        self.__publish(key, {
+            "bookflow": key[0],
+            "format": key[1],
+            "status": status,
+            "final": True,
+            "error": str(exception) if exception is not None else None,
+            }, final=True)
+
+    def __publish(self, key, message, final=False):
+        """Send the message to the key's subscribers and to the Redis channel."""
+        with self.__lock:
+            connections = list(self.__subscriptions.get(key, ()))
+            if final:
+                self.__subscriptions.pop(key, None)
+                self.__last.pop(key, None)
+            else:
+                self.__last[key] = message
+            self.__published += 1
+        for connection in connections:
+            if connection is not self.__channel_subscription:
+                connection.send(message)
+        self.__publish_redis(message)
+
+    def __publish_redis(self, message):
+        """Publish the message to the Redis channel, if any; failures are counted."""
+        if self.__redis is None:
+            return
+        try:
+            self.__redis.publish(self.__channel, json.dumps(message))
+        except Exception:  # pylint: disable=broad-except
+            with self.__lock:
+                self.__redis_errors += 1
 
-    @copyright.setter
-    def copyright(self, copyright_):
-        """Set the copyright string for this bookflow's book."""
-        self.__copyright = copyright_
 
-    @property
-    def isbn(self):
-        """Get the ISBN number string for this bookflow's book."""
-        return self.__isbn
+class StatusSubscriber(object):
+    """
+    A StatusSubscriber waits for bookflows and conversions through a StatusBroker
+    instead of polling the server itself. Its interface follows StatusMonitor.
+    """
 
-    @isbn.setter
-    def isbn(self, isbn):
-        """Set the copyright string for this bookflow's book."""
-        # TODO: Check if ISBN is valid ( http://bit.ly/1lV1PgI )
-        self.__isbn = isbn
+    def __init__(self, address, timeout=10.0, secret=None):
+        """
+        Connect to a StatusBroker.
 
-    @property
-    def language(self):
-        """Get the Babel Locale instance representing the book's language."""
-        return self.__language
+        :param address: The file name of the broker's Unix socket, or the port
+                        number (on 127.0.0.1) or (host, port) tuple of its TCP socket.
+        :param float timeout: The timeout in seconds for connecting.
+        :param str secret: The broker's shared secret, if it has one.
+        """
+        if isinstance(address, str):
+            self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.__socket.settimeout(timeout)
+            self.__socket.connect(address)
+        else:
+            if isinstance(address, int):
+                address = ("127.0.0.1", address)
+            self.__socket = socket.create_connection(address, timeout)
+        self.__socket.settimeout(None)
+        if secret is not None:
+            self.__send({"op": "hello", "secret": secret})
+        self.__watches = {}
+        self.__lock = threading.Lock()
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__run, name="bookalope-status-subscriber", daemon=True)
+        self.__thread.start()
 
-    @language.setter
-    def language(self, language):
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps({
+                "watches": len(self),
+                }))
+        return repr_s
+
+    def __len__(self):
+        """Return the number of currently watched (bookflow, format) pairs."""
+        with self.__lock:
+            return len(self.__watches)
+
+    def watch(self, bookflow, format_=None, callback=None):
         """
-        Given a standard language/culture name string, set this bookflow's book
-        language using a Babel Locale instance.
+        Ask the broker to watch the given bookflow, see StatusMonitor.watch().
+
+        :param bookflow: A Bookflow instance, or a bookflow id string.
+        :param str format_: An optional conversion format, see `Bookflow.convert`.
+        :param callback: An optional callable that's called with the arguments
+                         (bookflow id, format_, status) whenever the step or
+                         status changes.
+        :returns: A concurrent.futures.Future that resolves to the final step or
+                  conversion status.
+        :raises: TokenError if the given bookflow id is invalid; BookalopeError
+                 if the subscriber was closed.
+        """
+        bookflow_id = bookflow if isinstance(bookflow, str) else bookflow.id
+        if not _is_token(bookflow_id):
+            raise TokenError(bookflow_id)
+        future = concurrent.futures.Future()
+        key = (bookflow_id, format_)
+        with self.__lock:
+            if self.__closed:
+                raise BookalopeError("Status subscriber was closed")
+            watch = self.__watches.get(key)
+            new = watch is None
+            if new:
+                watch = self.__watches[key] = ([], [])
+            watch[0].append(future)
+            if callback is not None:
+                watch[1].append(callback)
+        if new:
+            self.__send({"op": "watch", "bookflow": bookflow_id, "format": format_})
+        return future
+
+    def unwatch(self, bookflow, format_=None):
+        """
+        Stop watching the given bookflow and cancel all of its pending futures.
 
-        :param str language: A standard language/culture name, e.g. en_US that
-                             specifies the book's language.
-        :raises: ValueError, babel.core.UnknownLocaleError if the language string
-                 is invalid.
+        :param bookflow: A Bookflow instance, or a bookflow id string.
+        :param str format_: An optional conversion format.
         """
+        bookflow_id = bookflow if isinstance(bookflow, str) else bookflow.id
+        with self.__lock:
+            watch = self.__watches.pop((bookflow_id, format_), None)
+        if watch is not None:
+            self.__send({"op": "unwatch", "bookflow": bookflow_id, "format": format_})
+            for future in watch[0]:
+                future.cancel()
+
+    def close(self):
+        """Close the connection to the broker, and cancel all pending futures."""
+        with self.__lock:
+            self.__closed = True
         try:
-            _ = babel.core.Locale.parse(language)
-            locale = babel.core.parse_locale(language)
-        except (ValueError, babel.core.UnknownLocaleError):
-            _ = babel.core.Locale.parse(language, sep="-")
-            locale = babel.core.parse_locale(language, sep="-")
-        self.__language = babel.core.get_locale_identifier(locale)
+            self.__socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.__socket.close()
+        self.__thread.join()
+
+    def __send(self, message):
+        """Send a request to the broker."""
+        self.__socket.sendall((json.dumps(message) + "\n").encode())
+
+    def __run(self):
+        """Receive the broker's messages, and notify the watchers."""
+        try:
+            with self.__socket.makefile("rb") as file_:
+                for line in file_:
+                    message = json.loads(line)
+                    if "bookflow" not in message:
+                        continue
+                    key = (message["bookflow"], message["format"])
+                    with self.__lock:
+                        watch = self.__watches.pop(key, None) if message["final"] else self.__watches.get(key)
+                    if watch is None:
+                        continue
+                    if not message["final"]:
+                        for callback in list(watch[1]):
+                            try:
+                                callback(key[0], key[1], message["status"])
+                            except Exception:  # pylint: disable=broad-except
+                                pass
+                        continue
+                    for future in watch[0]:
+                        if future.cancelled():
+                            continue
+                        if message["error"] is not None:
+                            future.set_exception(BookalopeError(message["error"]))
+                        else:
+                            future.set_result(message["status"])
+        except (OSError, ValueError):
+            pass
+        with self.__lock:
+            self.__closed = True
+            watches = list(self.__watches.values())
+            self.__watches.clear()
+        for futures, _ in watches:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(BookalopeError("Connection to the status broker was lost"))
+
+
+class _MirrorWriter(object):
+    """
+    Collects the SQL statements of a Mirror sync, and executes them in batches,
+    each in a short transaction under the mirror's lock. Use as a context manager
+    that writes the last batch on exit, also if the sync failed, so that all rows
+    fetched so far are kept.
+    """
 
-    @property
-    def pubdate(self):
-        """Get the publication date string of this bookflow's book."""
-        return self.__pubdate
+    def __init__(self, db, lock, batch_size):
+        """
+        Initialize this writer.
 
-    @pubdate.setter
-    def pubdate(self, pubdate):
-        """Set the publication date string of this bookflow's book."""
-        # TODO: Use datetime/date instance instead of string?
-        self.__pubdate = pubdate
+        :param db: The mirror's SQLite connection.
+        :param lock: The mirror's lock.
+        :param int batch_size: The number of statements per transaction.
+        """
+        self.__db = db
+        self.__lock = lock
+        self.__batch_size = batch_size
+        self.__pending = []
 
-    @property
-    def publisher(self):
-        """Get this bookflow's book's publisher string."""
-        return self.__publisher
+    def __enter__(self):
+        return self
 
-    @publisher.setter
-    def publisher(self, publisher):
-        """Set this bookflow's book's publisher string."""
-        self.__publisher = publisher
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
 
-    @property
-    def processing(self):
-        """Return True if the bookflow is currently being processed; False otherwise."""
-        return self.step == "processing"
+    def execute(self, sql, params):
+        """Add a statement to the current batch, and write the batch once it's full."""
+        self.__pending.append((sql, params))
+        if len(self.__pending) >= self.__batch_size:
+            self.flush()
 
-    def set_credit(self, credit):
-        """
-        Add the specified credit type to this Bookflow.
+    def flush(self):
+        """Write the current batch in a single transaction."""
+        pending, self.__pending = self.__pending, []
+        if pending:
+            with self.__lock, self.__db:
+                for sql, params in pending:
+                    self.__db.execute(sql, params)
 
-        :param str credit: The credit type, either 'basic' or 'pro'.
-        """
-        if credit not in ("basic", "pro"):
-            raise BookflowError("Invalid credit type")
-        params = {
-            "type": credit,
-            }
-        self.__bookalope.http_post(self.url + "/credit", params)
-        self.__credit = credit
 
-    def get_cover_image(self):
-        """Download the cover image as a byte array from the Bookalope server."""
-        return self.get_image("cover-image")
+class Mirror(object):
+    """
+    A Mirror keeps a local SQLite copy of the user's books, bookshelves and the
+    bookflow metadata (title, author, isbn, step, credit), so that questions like
+    "which bookflows are stuck processing" or "which book has this ISBN" can be
+    answered from indexed tables instead of walking the server. Use sync() to
+    refresh the mirror incrementally.
+    """
 
-    def get_image(self, name):
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bookshelves (
+            id TEXT PRIMARY KEY,
+            name TEXT,
+            description TEXT,
+            created TEXT,
+            synced REAL
+        );
+        CREATE TABLE IF NOT EXISTS books (
+            id TEXT PRIMARY KEY,
+            name TEXT,
+            created TEXT,
+            bookshelf_id TEXT,
+            synced REAL
+        );
+        CREATE TABLE IF NOT EXISTS bookflows (
+            id TEXT PRIMARY KEY,
+            book_id TEXT NOT NULL,
+            name TEXT,
+            step TEXT,
+            credit TEXT,
+            title TEXT,
+            author TEXT,
+            isbn TEXT,
+            metadata_step TEXT,
+            metadata_synced REAL,
+            synced REAL
+        );
+        CREATE INDEX IF NOT EXISTS books_bookshelf_id ON books (bookshelf_id);
+        CREATE INDEX IF NOT EXISTS books_name ON books (name);
+        CREATE INDEX IF NOT EXISTS bookflows_book_id ON bookflows (book_id);
+        CREATE INDEX IF NOT EXISTS bookflows_step ON bookflows (step);
+        CREATE INDEX IF NOT EXISTS bookflows_isbn ON bookflows (isbn);
+        CREATE INDEX IF NOT EXISTS bookflows_title ON bookflows (title);
+        CREATE INDEX IF NOT EXISTS bookflows_author ON bookflows (author);
         """
-        Download an image with the name 'name' as a byte array from the
-        Bookalope server.
 
-        :param str name: The name of the image.
-        :returns bytes: An array of bytes of the image.
+    # The number of rows that sync() writes in a single transaction.
+    _BATCH_SIZE = 500
+
+    def __init__(self, bookalope, path=":memory:", max_age=86400.0, max_workers=8):
         """
-        params = {
-            "name": name,
-            }
-        # TODO: Handle file name and mime type correctly (part of the response).
-        return self.__bookalope.http_get(self.url + "/files/image", params)
+        Open or create the local mirror database.
+
+        :param bookalope: A Bookalope instance that's used to query the server.
+        :param str path: The file name of the SQLite database; defaults to an
+                         in-memory database.
+        :param float max_age: The number of seconds after which the metadata of
+                              an otherwise unchanged bookflow is fetched again.
+        :param int max_workers: The number of concurrent bookflow metadata requests.
+        """
+        assert isinstance(bookalope, BookalopeClient)
+        self.__bookalope = bookalope
+        self.__max_age = max_age
+        self.__max_workers = max_workers
+        self.__lock = threading.RLock()
+        self.__sync_lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.row_factory = sqlite3.Row
+        with self.__db:
+            self.__db.executescript(self._SCHEMA)
 
-    def set_cover_image(self, image_filename, image_bytes):
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps({
+                "books": self.query("SELECT COUNT(*) AS n FROM books")[0]["n"],
+                "bookflows": self.query("SELECT COUNT(*) AS n FROM bookflows")[0]["n"],
+                }))
+        return repr_s
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self.__lock:
+            self.__db.close()
+
+    def sync(self, full=False):
         """
-        Upload the cover image for this bookflow.
+        Refresh the mirror from the Bookalope server. Books and bookshelves are
+        streamed from their listings, and entries that no longer exist on the
+        server are removed. The metadata of a bookflow is fetched only if the
+        bookflow is new, if its step changed since the last fetch, if its
+        metadata is older than `max_age`, or if `full` is True. Unless the caller
+        chose a priority, the requests of a sync are batch traffic.
+
+        The mirror stays readable during a sync: the server is queried without
+        holding the mirror's lock, and the results are written in batches of
+        short transactions. If a sync fails then the batches written so far are
+        kept, and entries are removed only after complete listings.
+
+        :param bool full: True to fetch the metadata of all bookflows.
+        :returns dict: The number of synced bookshelves, books and bookflows, and
+                       the number of bookflows whose metadata was fetched.
+        """
+        now = time.time()
+        stats = {"bookshelves": 0, "books": 0, "bookflows": 0, "metadata": 0}
+        with _default_priority("batch"), self.__sync_lock:
+            with _MirrorWriter(self.__db, self.__lock, self._BATCH_SIZE) as writer:
+                for bookshelf in self.__bookalope.http_get_items("/api/bookshelves", "bookshelves"):
+                    writer.execute(
+                        "INSERT OR REPLACE INTO bookshelves (id, name, description, created, synced) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (bookshelf["id"], bookshelf["name"], bookshelf["description"], bookshelf["created"], now))
+                    stats["bookshelves"] += 1
+                for book in self.__bookalope.http_get_items("/api/books", "books"):
+                    bookshelf_id = book["bookshelf"]["id"] if book["bookshelf"] else None
+                    writer.execute(
+                        "INSERT OR REPLACE INTO books (id, name, created, bookshelf_id, synced) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (book["id"], book["name"], book["created"], bookshelf_id, now))
+                    stats["books"] += 1
+                    for bookflow in book["bookflows"]:
+                        credit = bookflow.get("credit")
+                        writer.execute(
+                            "INSERT INTO bookflows (id, book_id, name, step, credit, synced) "
+                            "VALUES (?, ?, ?, ?, ?, ?) "
+                            "ON CONFLICT (id) DO UPDATE SET book_id = excluded.book_id, "
+                            "name = excluded.name, step = excluded.step, "
+                            "credit = COALESCE(excluded.credit, credit), synced = excluded.synced",
+                            (bookflow["id"], book["id"], bookflow["name"], bookflow["step"],
+                             credit["type"] if credit else None, now))
+                        stats["bookflows"] += 1
+                for table in ("bookshelves", "books", "bookflows"):
+                    writer.execute("DELETE FROM {} WHERE synced < ?".format(table), (now,))
+            with self.__lock:
+                if full:
+                    rows = self.__db.execute("SELECT id FROM bookflows").fetchall()
+                else:
+                    rows = self.__db.execute(
+                        "SELECT id FROM bookflows WHERE metadata_synced IS NULL OR metadata_synced < ? "
+                        "OR metadata_step IS NOT step",
+                        (now - self.__max_age,)).fetchall()
+            stats["metadata"] = self.__sync_metadata([row["id"] for row in rows])
+        return stats
+
+    def __sync_metadata(self, bookflow_ids):
+        """Fetch the metadata for the given bookflows concurrently, and store it in batches."""
+        def _fetch(bookflow_id):
+            try:
+                return self.__bookalope.http_get("/api/bookflows/" + bookflow_id)["bookflow"]
+            except requests.HTTPError:
+                return None
+
+        count = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.__max_workers) as executor, \
+                _MirrorWriter(self.__db, self.__lock, self._BATCH_SIZE) as writer:
+            for bookflow in _imap(executor, _fetch, bookflow_ids, self.__max_workers * 4):
+                if bookflow is None:
+                    continue
+                credit = bookflow.get("credit")
+                writer.execute(
+                    "UPDATE bookflows SET name = ?, step = ?, credit = ?, title = ?, author = ?, "
+                    "isbn = ?, metadata_step = ?, metadata_synced = ? WHERE id = ?",
+                    (bookflow["name"], bookflow["step"], credit["type"] if credit else None,
+                     bookflow["title"], bookflow["author"], bookflow["isbn"], bookflow["step"],
+                     time.time(), bookflow["id"]))
+                count += 1
+        return count
+
+    def invalidate(self, bookflow_ids):
+        """
+        Mark the mirrored metadata of the given bookflows as outdated, e.g. after
+        they were changed, so that the next sync() fetches it again.
 
-        :param str image_filename: The file name of the cover image.
-        :param bytes image_bytes: A byte array containing the image.
+        :param bookflow_ids: An iterable of bookflow id strings.
         """
-        return self.add_image("cover-image", image_filename, image_bytes)
+        with self.__lock, self.__db:
+            self.__db.executemany("UPDATE bookflows SET metadata_synced = NULL WHERE id = ?",
+                                  [(_,) for _ in bookflow_ids])
 
-    def add_image(self, name, image_filename, image_bytes):
+    def query(self, sql, params=()):
         """
-        Upload an image for this bookflow using the given name.
+        Run an arbitrary SQL query against the mirror's tables 'bookshelves',
+        'books' and 'bookflows'.
 
-        :param str name: A name for the image, e.g. 'cover'.
-        :param str image_filename: The file name of the cover image.
-        :param bytes image_bytes: A byte array containing the image.
+        :param str sql: The SQL statement.
+        :param params: The parameters of the SQL statement.
+        :returns list: A list of dictionaries, one for each result row.
         """
-        if self.step != "convert":
-            raise BookflowError("Can't add image, bookflow must be in 'convert' step")
-        params = {
-            "name": name,
-            "filename": image_filename,
-            "file": base64.b64encode(image_bytes).decode(),
-        }
-        return self.__bookalope.http_post(self.url + "/files/image", params)
+        with self.__lock:
+            return [dict(row) for row in self.__db.execute(sql, params)]
 
-    def get_document(self):
+    def find_bookflows(self, **criteria):
         """
-        Download this bookflow's document. Returns a byte array of the document.
+        Find mirrored bookflows whose columns match all of the given criteria,
+        e.g. find_bookflows(step="processing") or find_bookflows(isbn="...").
+        Valid criteria are id, book_id, name, step, credit, title, author, isbn.
+
+        :returns list: A list of dictionaries, one for each matching bookflow.
+        :raises: ValueError for an unknown criterion.
         """
-        return self.__bookalope.http_get(self.url + "/files/document")
+        return self.__find("bookflows", ("id", "book_id", "name", "step", "credit", "title", "author", "isbn"), criteria)
 
-    def set_document(self, document_filename, document_bytes, document_type=None, skip_analysis=False):
+    def find_books(self, **criteria):
         """
-        Upload a document for this bookflow. This will start the style analysis,
-        and automatically extract the content and structure of the document using
-        Bookalope's default heuristics. Switches the bookflow's `step` property
-        to 'processing', and then to 'convert' once the document analysis has
-        finished and the document can be converted.
+        Find mirrored books whose columns match all of the given criteria, e.g.
+        find_books(bookshelf_id="..."). Valid criteria are id, name, bookshelf_id,
+        and isbn which matches any of the book's bookflows.
 
-        :param str document_filename: The file name of the document.
-        :param bytes document_bytes: A byte array containing the document.
-        :param str document_type: The optional document type, one of "doc", "epub" or "gutenberg".
-        :param boolean skip_analysis: Whether to skip the semantic structure analysis of the document.
+        :returns list: A list of dictionaries, one for each matching book.
+        :raises: ValueError for an unknown criterion.
         """
-        if self.step != "files":
-            raise BookflowError("Unable to set document because one is already set")
-        # TODO: Check that bytes are not of an unsupported format.
-        params = {
-            "filename": document_filename,
-            "file": base64.b64encode(document_bytes).decode(),
-            "skip_analysis": skip_analysis,
-            }
-        if document_type and document_type in ("doc", "epub", "gutenberg",):
-            params["filetype"] = document_type
-        self.__bookalope.http_post(self.url + "/files/document", params)
-        self.__step = "processing"  # Server does the same.
+        isbn = criteria.pop("isbn", None)
+        if isbn is None:
+            return self.__find("books", ("id", "name", "bookshelf_id"), criteria)
+        return self.__find("books", ("id", "name", "bookshelf_id"), criteria,
+                           "id IN (SELECT book_id FROM bookflows WHERE isbn = ?)", (isbn,))
+
+    def __find(self, table, columns, criteria, extra=None, extra_params=()):
+        """Select the rows of a table whose columns equal the given criteria."""
+        clauses = []
+        params = []
+        for column, value in criteria.items():
+            if column not in columns:
+                raise ValueError("Unknown criterion: " + column)
+            if value is None:
+                clauses.append(column + " IS NULL")
+            else:
+                clauses.append(column + " = ?")
+                params.append(value)
+        if extra:
+            clauses.append(extra)
+            params.extend(extra_params)
+        sql = "SELECT * FROM " + table
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return self.query(sql, params)
+
+
+# The bookflow metadata that can be synced from a feed.
+_METADATA_FIELDS = ("title", "author", "copyright", "isbn", "language", "pubdate", "publisher")
+
+# The ONIX for Books elements used by iter_onix_metadata(), both reference and
+# short tag names, mapped to the reference names.
+_ONIX_TAGS = {
+    "Product": "Product", "product": "Product",
+    "ProductIdentifier": "ProductIdentifier", "productidentifier": "ProductIdentifier",
+    "ProductIDType": "ProductIDType", "b221": "ProductIDType",
+    "IDValue": "IDValue", "b244": "IDValue",
+    "TitleDetail": "TitleDetail", "titledetail": "TitleDetail",
+    "Title": "Title", "title": "Title",
+    "TitleType": "TitleType", "b202": "TitleType",
+    "TitleElement": "TitleElement", "titleelement": "TitleElement",
+    "TitleElementLevel": "TitleElementLevel", "x409": "TitleElementLevel",
+    "TitleText": "TitleText", "b203": "TitleText",
+    "TitlePrefix": "TitlePrefix", "b030": "TitlePrefix",
+    "TitleWithoutPrefix": "TitleWithoutPrefix", "b031": "TitleWithoutPrefix",
+    "DistinctiveTitle": "DistinctiveTitle", "b028": "DistinctiveTitle",
+    "Collection": "Collection", "collection": "Collection",
+    "Series": "Series", "series": "Series",
+    "RelatedMaterial": "RelatedMaterial", "relatedmaterial": "RelatedMaterial",
+    "RelatedProduct": "RelatedProduct", "relatedproduct": "RelatedProduct",
+    "Contributor": "Contributor", "contributor": "Contributor",
+    "ContributorRole": "ContributorRole", "b035": "ContributorRole",
+    "PersonName": "PersonName", "b036": "PersonName",
+    "CorporateName": "PersonName", "b047": "PersonName",
+    "PublisherName": "PublisherName", "b081": "PublisherName",
+    "PublicationDate": "PublicationDate", "b003": "PublicationDate",
+    "PublishingDate": "PublishingDate", "publishingdate": "PublishingDate",
+    "PublishingDateRole": "PublishingDateRole", "x448": "PublishingDateRole",
+    "Date": "Date", "b306": "Date",
+    "Language": "Language", "language": "Language",
+    "LanguageRole": "LanguageRole", "b253": "LanguageRole",
+    "LanguageCode": "LanguageCode", "b252": "LanguageCode",
+    "CopyrightYear": "CopyrightYear", "b087": "CopyrightYear",
+}
+
+
+def _onix_children(elem):
+    """Return a dictionary of the reference names and texts of an element's children."""
+    return {_ONIX_TAGS.get(child.tag.rpartition("}")[2]): (child.text or "").strip() for child in elem}
+
+
+# Composites that describe a series or another product rather than the product itself.
+_ONIX_SKIPPED = {"Collection", "Series", "RelatedMaterial", "RelatedProduct"}
+
+
+def _onix_iter(elem):
+    """Yield the descendants of an element, except those of other products or series."""
+    for child in elem:
+        if _ONIX_TAGS.get(child.tag.rpartition("}")[2]) in _ONIX_SKIPPED:
+            continue
+        yield child
+        yield from _onix_iter(child)
+
+
+def _onix_title(elem):
+    """
+    Return the product title of an ONIX 3.0 TitleDetail or ONIX 2.1 Title element,
+    preferring the product-level TitleElement of a TitleDetail.
+    """
+    elements = [_ for _ in elem if _ONIX_TAGS.get(_.tag.rpartition("}")[2]) == "TitleElement"]
+    if elements:
+        levels = [_onix_children(_).get("TitleElementLevel") for _ in elements]
+        elem = elements[levels.index("01")] if "01" in levels else elements[0]
+    children = _onix_children(elem)
+    if children.get("TitleText"):
+        return children["TitleText"]
+    return " ".join(filter(None, (children.get("TitlePrefix"), children.get("TitleWithoutPrefix"))))
+
+
+def _onix_product(product):
+    """Return the metadata record of the given ONIX Product element."""
+    record = {}
+    authors = []
+    distinctive_title = None
+    for elem in _onix_iter(product):
+        tag = _ONIX_TAGS.get(elem.tag.rpartition("}")[2])
+        if tag == "ProductIdentifier":
+            children = _onix_children(elem)
+            if children.get("ProductIDType") in ("02", "03", "15") and "isbn" not in record:
+                try:
+                    record["isbn"] = _normalize_isbn(children.get("IDValue", ""))
+                except ValueError:  # A GTIN-13 that's not an ISBN.
+                    pass
+        elif tag in ("TitleDetail", "Title") and "title" not in record:
+            # Only the distinctive title (type 01) is the book's title.
+            if _onix_children(elem).get("TitleType") == "01":
+                record["title"] = _onix_title(elem)
+        elif tag == "DistinctiveTitle" and distinctive_title is None:
+            distinctive_title = (elem.text or "").strip()
+        elif tag == "Contributor":
+            children = _onix_children(elem)
+            if children.get("ContributorRole") == "A01" and children.get("PersonName"):
+                authors.append(children["PersonName"])
+        elif tag == "PublisherName" and "publisher" not in record:
+            record["publisher"] = (elem.text or "").strip()
+        elif tag == "PublicationDate":
+            record["pubdate"] = (elem.text or "").strip()[:8]
+        elif tag == "PublishingDate":
+            children = _onix_children(elem)
+            if children.get("PublishingDateRole") == "01" and children.get("Date"):
+                record["pubdate"] = children["Date"][:8]
+        elif tag == "Language":
+            children = _onix_children(elem)
+            if children.get("LanguageRole") == "01" and children.get("LanguageCode"):
+                code = children["LanguageCode"].lower()
+                record["language"] = babel.core.get_global("language_aliases").get(code, code)
+        elif tag == "CopyrightYear" and "copyright" not in record:
+            record["copyright"] = "\u00a9 " + (elem.text or "").strip()
+    if not record.get("title") and distinctive_title:
+        record["title"] = distinctive_title
+    if authors:
+        record["author"] = ", ".join(authors)
+    return {k: v for k, v in record.items() if v}
+
+
+def iter_onix_metadata(source):
+    """
+    Parse an ONIX for Books 2.1 or 3.0 feed incrementally and yield a metadata
+    record for every product: a dictionary with the keys isbn, title, author,
+    copyright, publisher, pubdate and language, as far as the product provides
+    them. Reference and short tag names are both understood. Every product is
+    discarded once it's been parsed, so that feeds of any size are read in
+    constant memory.
+
+    :param source: A file name, or a binary file object.
+    :returns: A generator of metadata dictionaries.
+    """
+    root = None
+    for event, elem in xml.etree.ElementTree.iterparse(source, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event == "end" and _ONIX_TAGS.get(elem.tag.rpartition("}")[2]) == "Product":
+            record = _onix_product(elem)
+            root.clear()
+            if record:
+                yield record
+
+
+def iter_csv_metadata(source, **fmtparams):
+    """
+    Read a CSV file with a header row incrementally and yield a metadata record
+    for every row. Columns are matched case-insensitively to the metadata fields
+    title, author, copyright, isbn, language, pubdate and publisher, and to the
+    bookflow id in a column named id or bookflow_id; other columns and empty
+    cells are ignored.
+
+    :param source: A file name, or a text file object.
+    :param fmtparams: Formatting parameters passed on to csv.DictReader.
+    :returns: A generator of metadata dictionaries.
+    """
+    with contextlib.ExitStack() as stack:
+        if isinstance(source, str):
+            source = stack.enter_context(open(source, newline="", encoding="utf-8-sig"))
+        for row in csv.DictReader(source, **fmtparams):
+            record = {}
+            for column, value in row.items():
+                if column is None or not value or not value.strip():
+                    continue
+                key = column.strip().lower().replace(" ", "_")
+                key = "id" if key in ("bookflow_id", "bookflow") else key
+                if key == "id" or key in _METADATA_FIELDS:
+                    record[key] = value.strip()
+            yield record
+
+
+class MetadataSync(object):
+    """
+    A MetadataSync applies book metadata from a feed, e.g. iter_onix_metadata()
+    or iter_csv_metadata(), to the matching bookflows in a single pass. Records
+    are matched to bookflows by bookflow id or by ISBN, validated before any
+    request is sent, and compared to the bookflow's current metadata on the
+    server; only bookflows whose metadata changed are saved. Records are
+    processed concurrently while the feed is still being read.
+    """
 
-    def convert(self, format_, style=None):
+    def __init__(self, bookalope, mirror=None, max_workers=8):
         """
-        Initiate the conversion of a bookflow's document. If no plan was associated
-        with the bookflow then a *test version* of the document is produced. A
-        'test' version shuffles the letters of random words, thus making the
-        document rather useless for anything but testing purposes.
+        Initialize this metadata sync.
 
-        :param str format_: A valid format string, one of 'epub', 'epub3', 'mobi',
-                           'pdf', 'icml', 'docx', 'docbook', 'htmlbook'.
-        :param style: A Style instance describing the styling for the converted
-                      document.
+        :param bookalope: A Bookalope instance.
+        :param mirror: An optional Mirror instance that's used to find bookflows by
+                       ISBN; defaults to an in-memory mirror. The mirror is synced
+                       once when the first record needs an ISBN lookup.
+        :param int max_workers: The number of concurrent records.
         """
-        if self.step != "convert":
-            raise BookflowError("Can't convert document, bookflow must be in 'convert' step")
-        styling = style.short_name if style else "default"
-        params = {
-            "format": format_,
-            "styling": styling,
-            }
-        self.__bookalope.http_post(self.url + "/convert", params)
+        assert isinstance(bookalope, BookalopeClient)
+        self.__bookalope = bookalope
+        self.__mirror = mirror
+        self.__max_workers = max_workers
+        self.__isbns = None
+        self.__lock = threading.Lock()
 
-    def convert_status(self, format_):
+    def __repr__(self):
+        """Return a printable representation of this instance."""
+        repr_s = "<{}.{} object at {}> JSON: {}".format(
+            self.__class__.__module__,
+            self.__class__.__name__,
+            hex(id(self)),
+            json.dumps({
+                "isbns": len(self.__isbns) if self.__isbns is not None else None,
+                }))
+        return repr_s
+
+    def sync(self, records, dry_run=False):
         """
-        Check the status of the bookflow's file conversion for the specified format and style.
+        Apply the given metadata records to their bookflows. A record is a
+        dictionary with an id or isbn key to find its bookflow, and any of the
+        keys title, author, copyright, isbn, language, pubdate and publisher. A
+        record that has both id and isbn is matched by id and updates the ISBN.
+        Unless the caller chose a priority, the requests are batch traffic.
+
+        :param records: An iterable of metadata dictionaries.
+        :param bool dry_run: True to only compare the records to the server's
+                             metadata without saving any changes.
+        :returns list: A list of BulkResult instances, one for each record in order,
+                       whose result is the dictionary of changed metadata (empty
+                       if nothing changed). The error is a ValueError for invalid
+                       records, and a BookalopeError if no single bookflow matches.
+        """
+        with self.__lock:
+            self.__isbns = None
+        with _default_priority("batch"), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+            results = list(_imap(executor, functools.partial(self.__apply, dry_run=dry_run),
+                                 records, 4 * self.__max_workers))
+        if self.__mirror is not None and not dry_run:
+            self.__mirror.invalidate(self.__bookflow_id(_.item) for _ in results if _.ok and _.result)
+        return results
+
+    def __apply(self, record, dry_run):
+        """Validate and apply a single record, and return its BulkResult."""
+        try:
+            metadata = self.__validate(record)
+            bookflow_id = self.__bookflow_id(record)
+            url = "/api/bookflows/" + bookflow_id
+            current = self.__bookalope.http_get(url)["bookflow"]
+            changes = {k: v for k, v in metadata.items() if not self.__equal(k, current.get(k), v)}
+            if changes and not dry_run:
+                self.__bookalope.http_post(url, changes)
+            return BulkResult(record, changes, None)
+        except Exception as exc:  # pylint: disable=broad-except
+            return BulkResult(record, None, exc)
+
+    @staticmethod
+    def __validate(record):
+        """
+        Return the metadata of the given record with the language and pubdate
+        normalized to what the server expects.
 
-        :param str format_: Same as `convert` method.
-        :param style: Same as `convert` method.
-        :return: A string that is either 'processing', 'available' (conversion finished), 'failed',
-                 or 'none' (no conversion initiated yet).
+        :raises: ValueError if the record is invalid.
         """
-        conversion = self.__bookalope.http_get(self.url + "/download/" + format_ + "/status")
-        return conversion["status"]
+        if not record.get("id") and not record.get("isbn"):
+            raise ValueError("Record has neither bookflow id nor ISBN")
+        if record.get("id") and not _is_token(record["id"]):
+            raise ValueError("Invalid bookflow id: {}".format(record["id"]))
+        metadata = {k: record[k] for k in _METADATA_FIELDS if record.get(k)}
+        if "isbn" in metadata:
+            _normalize_isbn(metadata["isbn"])
+        if "language" in metadata:
+            try:
+                metadata["language"] = _parse_language(metadata["language"])
+            except babel.core.UnknownLocaleError as exc:
+                raise ValueError("Invalid language: {}".format(metadata["language"])) from exc
+        if "pubdate" in metadata:
+            metadata["pubdate"] = _parse_pubdate(metadata["pubdate"])
+        return metadata
 
-    def convert_download(self, format_):
+    @staticmethod
+    def __equal(field, current, value):
+        """Return True if a record's field value equals the server's value."""
+        if current == value:
+            return True
+        if field == "isbn" and current:
+            try:
+                return _normalize_isbn(current) == _normalize_isbn(value)
+            except ValueError:
+                return False
+        return False
+
+    def __bookflow_id(self, record):
         """
-        Once `convert_status` method returns 'available', the converted file can be downloaded
-        and is returned by this method.
+        Return the id of the bookflow that the given record applies to.
 
-        :param str format_: Same as `convert` method.
-        :return: A bytes object containing the converted document, or None if converted document
-                 was not available (any status but 'available').
-        :raises: A HTTPException (Bad Request) if the conversion was not in 'available' status.
+        :raises: BookalopeError if no single bookflow has the record's ISBN.
         """
-        return self.__bookalope.http_get(self.url + "/download/" + format_)
+        if record.get("id"):
+            return record["id"]
+        with self.__lock:
+            if self.__isbns is None:
+                if self.__mirror is None:
+                    self.__mirror = Mirror(self.__bookalope, max_workers=self.__max_workers)
+                self.__mirror.sync()
+                self.__isbns = collections.defaultdict(list)
+                for row in self.__mirror.query("SELECT id, isbn FROM bookflows WHERE isbn IS NOT NULL"):
+                    try:
+                        self.__isbns[_normalize_isbn(row["isbn"])].append(row["id"])
+                    except ValueError:
+                        pass
+        bookflow_ids = self.__isbns.get(_normalize_isbn(record["isbn"]), [])
+        if len(bookflow_ids) != 1:
+            raise BookalopeError("{} bookflows with ISBN {}".format(len(bookflow_ids) or "No", record["isbn"]))
+        return bookflow_ids[0]
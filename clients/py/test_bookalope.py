@@ -0,0 +1,673 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests for the Bookalope module. Helpers are tested directly, and the client
+is tested against a local stand-in for the Bookalope server.
+"""
+
+import base64
+import concurrent.futures
+import gzip
+import hashlib
+import http.server
+import io
+import json
+import os
+import re
+import threading
+import time
+
+import pytest
+import requests
+
+import bookalope
+
+
+# A valid, made-up Bookalope token.
+TOKEN = "0123456789abcdef0123456789abcdef"
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handle a request to the stand-in server: record it, and reply with whatever
+    the test's handler returns, a (status, body, headers) tuple where the body is
+    bytes or JSON data.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Don't log requests."""
+
+    def __handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path, self.headers, body))
+        status, data, headers = self.server.handler(self)
+        headers = dict(headers or {})
+        if data is not None and not isinstance(data, bytes):
+            data = json.dumps(data).encode()
+            headers.setdefault("Content-Type", "application/json")
+        data = data or b""
+        headers.setdefault("Content-Type", "application/octet-stream")
+        self.send_response(status)
+        self.send_header("X-Bookalope-Api-Version", bookalope._API_VERSION)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_DELETE = __handle
+
+
+@pytest.fixture
+def stand_in():
+    """Run a stand-in Bookalope server; a test sets its handler and reads its requests."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.handler = lambda request: (404, {"status": "error"}, None)
+    server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _client(stand_in, **kwargs):
+    """Return a client that talks to the given stand-in server."""
+    return bookalope.BookalopeClient(token=TOKEN, host=stand_in.url, **kwargs)
+
+
+def _bytewise(document):
+    """Return the UTF-8 encoded document as a list of single-byte chunks."""
+    data = document.encode()
+    return [data[i:i + 1] for i in range(len(data))]
+
+
+@pytest.mark.parametrize("array", [
+    [1500.0, 1e5, -2, 0, 3.25e-7, 12E+3],
+    [{"id": "a", "size": 1500.0}, {"id": "ü", "size": -1e5}],
+    ["a,b", [1, [2.5]], True, False, None],
+    [],
+    ])
+def test_iter_json_array_bytewise(array):
+    """Numbers, strings and nested values that are split at every byte are decoded intact."""
+    document = json.dumps({"before": 1.5, "items": array, "after": [2e3]})
+    assert list(bookalope._iter_json_array(_bytewise(document), "items")) == array
+
+
+def test_iter_json_array_chunked_number():
+    """A number split after its '.' or exponent is not decoded early."""
+    chunks = [b'{"items": [1500.', b'0, 1e', b'5, 2', b'0]}']
+    assert list(bookalope._iter_json_array(chunks, "items")) == [1500.0, 1e5, 20]
+
+
+def test_iter_json_array_number_at_eof():
+    """A number at the end of the document is decoded at EOF."""
+    assert list(bookalope._iter_json_array([b'{"items": [1, 2', b"]}"], "items")) == [1, 2]
+    with pytest.raises(ValueError):
+        list(bookalope._iter_json_array(_bytewise('{"items": [12'), "items"))
+
+
+def test_iter_json_array_missing_key():
+    """A missing key raises KeyError."""
+    with pytest.raises(KeyError):
+        list(bookalope._iter_json_array(_bytewise('{"other": [1, 2]}'), "items"))
+
+
+def test_iter_onix_metadata_skips_collection_title():
+    """The product's own distinctive title is synced, not the series title before it."""
+    onix = b"""<ONIXMessage release="3.0"><Product>
+      <ProductIdentifier><ProductIDType>15</ProductIDType><IDValue>9780306406157</IDValue></ProductIdentifier>
+      <DescriptiveDetail>
+        <Collection><TitleDetail><TitleType>01</TitleType>
+          <TitleElement><TitleElementLevel>02</TitleElementLevel><TitleText>The Series</TitleText></TitleElement>
+        </TitleDetail></Collection>
+        <TitleDetail><TitleType>01</TitleType>
+          <TitleElement><TitleElementLevel>01</TitleElementLevel><TitleText>The Book</TitleText></TitleElement>
+        </TitleDetail>
+      </DescriptiveDetail>
+      <RelatedMaterial><RelatedProduct>
+        <ProductIdentifier><ProductIDType>15</ProductIDType><IDValue>9781234567897</IDValue></ProductIdentifier>
+      </RelatedProduct></RelatedMaterial>
+    </Product></ONIXMessage>"""
+    records = list(bookalope.iter_onix_metadata(io.BytesIO(onix)))
+    assert records == [{"isbn": "9780306406157", "title": "The Book"}]
+
+
+def test_iter_onix_metadata_21_series():
+    """An ONIX 2.1 Series title is skipped in favor of the product's Title."""
+    onix = b"""<ONIXmessage><product>
+      <series><title><b202>01</b202><b203>The Series</b203></title></series>
+      <title><b202>01</b202><b203>The Book</b203></title>
+    </product></ONIXmessage>"""
+    assert list(bookalope.iter_onix_metadata(io.BytesIO(onix))) == [{"title": "The Book"}]
+
+
+# A request body that's large enough to be compressed, and compresses well.
+_LARGE_PARAMS = {"file": "A" * 100000}
+
+
+def test_compression_falls_back_on_415(stand_in):
+    """A 415 for a compressed body is retried once without compression."""
+    stand_in.handler = lambda request: (
+        (415, {"status": "error"}, None) if request.headers.get("Content-Encoding") else (201, {"ok": 1}, None))
+    client = _client(stand_in, compression="gzip")
+    assert client.http_post("/api/test", _LARGE_PARAMS) == {"ok": 1}
+    assert [_[2].get("Content-Encoding") for _ in stand_in.requests] == ["gzip", None]
+    assert client.compression_stats["rejected"] == 1
+    assert not client.compression_stats["enabled"]
+
+
+def test_compression_falls_back_on_400_naming_encoding(stand_in):
+    """A 400 whose body names the Content-Encoding is retried without compression."""
+    stand_in.handler = lambda request: (
+        (400, b"Unsupported Content-Encoding", None) if request.headers.get("Content-Encoding")
+        else (201, None, None))
+    client = _client(stand_in, compression="gzip")
+    assert client.http_post("/api/test", _LARGE_PARAMS) is None
+    assert len(stand_in.requests) == 2
+
+
+def test_compression_keeps_validation_errors(stand_in):
+    """A 400 for invalid parameters fails without uploading the body a second time."""
+    stand_in.handler = lambda request: (400, {"status": "error", "message": "Invalid title"}, None)
+    client = _client(stand_in, compression="gzip")
+    with pytest.raises(requests.HTTPError):
+        client.http_post("/api/test", _LARGE_PARAMS)
+    assert len(stand_in.requests) == 1
+    assert json.loads(stand_in.requests[0][3]) == _LARGE_PARAMS
+    assert client.compression_stats["enabled"]
+
+
+# The id of the bookflow that the stand-in server knows.
+BOOKFLOW_ID = "fedcba9876543210fedcba9876543210"
+
+
+def _bookflow(step):
+    """Return the packed data of the stand-in's bookflow in the given step."""
+    return {
+        "id": BOOKFLOW_ID, "name": "Bookflow", "step": step, "credit": None, "book": None,
+        "title": None, "author": None, "copyright": None, "isbn": None, "language": None,
+        "pubdate": None, "publisher": None,
+        }
+
+
+def _processing_forever(request):
+    """Answer all status polls with 'processing'."""
+    if request.path.endswith("/status"):
+        return 200, {"status": "processing"}, None
+    return 200, {"bookflow": _bookflow("processing")}, None
+
+
+@pytest.mark.parametrize("wait", ["timeout", "deadline"])
+def test_wait_detaches_on_timeout(stand_in, wait):
+    """A wait that times out stops the status monitor's polls for it."""
+    stand_in.handler = _processing_forever
+    client = _client(stand_in)
+    bookflow = bookalope.Bookflow(client, None, _bookflow("processing"))
+    if wait == "timeout":
+        with pytest.raises(concurrent.futures.TimeoutError):
+            bookflow.wait_for_conversion("epub", timeout=0.3)
+    else:
+        with pytest.raises(bookalope.DeadlineExceeded), bookalope.deadline(0.3):
+            bookflow.wait_for_analysis()
+    assert len(client.status_monitor) == 0
+
+
+def _monitor_threads():
+    """Return the number of running status monitor scheduler threads."""
+    return sum(1 for _ in threading.enumerate() if _.name == "bookalope-status-monitor")
+
+
+def test_status_monitor_dedups_and_stops_when_idle(stand_in):
+    """Watchers of one bookflow share polls, and the scheduler stops once they're done."""
+    steps = iter(["processing", "processing"])
+    stand_in.handler = lambda request: (200, {"bookflow": _bookflow(next(steps, "convert"))}, None)
+    client = _client(stand_in)
+    monitor = bookalope.StatusMonitor(client, initial_interval=0.1)
+    futures = [monitor.watch(BOOKFLOW_ID) for _ in range(5)]
+    assert [_.result(5) for _ in futures] == ["convert"] * 5
+    assert len(stand_in.requests) == 3
+    deadline = time.monotonic() + 2
+    while _monitor_threads() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert _monitor_threads() == 0
+    assert monitor.watch(BOOKFLOW_ID).result(5) == "convert"
+    monitor.close()
+
+
+def test_status_monitor_detach_keeps_other_watchers(stand_in):
+    """Detaching one watcher cancels only its future."""
+    stand_in.handler = _processing_forever
+    monitor = bookalope.StatusMonitor(_client(stand_in), initial_interval=0.1)
+    detached, kept = monitor.watch(BOOKFLOW_ID), monitor.watch(BOOKFLOW_ID)
+    monitor.detach(BOOKFLOW_ID, None, detached)
+    assert detached.cancelled() and not kept.done()
+    assert len(monitor) == 1
+    monitor.detach(BOOKFLOW_ID, None, kept)
+    assert len(monitor) == 0
+    monitor.close()
+
+
+def _get_item(client, item):
+    """Fetch an item from the stand-in server in a ProcessRunner worker."""
+    return client.http_get("/api/items/{}".format(item))["item"]
+
+
+def test_process_runner_shares_rate_limit(stand_in):
+    """Worker processes share a single rate limit."""
+    stand_in.handler = lambda request: (200, {"item": request.path.rpartition("/")[2]}, None)
+    started = time.monotonic()
+    with bookalope.ProcessRunner(TOKEN, processes=4, rate_limit=10, host=stand_in.url, start_method="fork") as runner:
+        results = list(runner.map(_get_item, range(20)))
+    assert [_.result for _ in results] == [str(_) for _ in range(20)]
+    # A burst of 10 requests, and then 10 more at 10 per second.
+    assert time.monotonic() - started >= 0.8
+    assert len(stand_in.requests) == 20
+
+
+@pytest.mark.skipif(not hasattr(bookalope.os, "fork"), reason="requires fork()")
+def test_fork_resets_inherited_locks(stand_in):
+    """A child forked while the parent's locks are held can still send requests."""
+    stand_in.handler = lambda request: (200, {"item": "ok"}, None)
+    client = _client(stand_in, rate_limit=10, max_inflight_bytes=1024 * 1024, compression="gzip")
+    client.http_get("/api/items/warmup")
+    held = [
+        client._BookalopeClient__rate_limiter._RateLimiter__lock,
+        client._BookalopeClient__byte_budget._ByteBudget__condition,
+        client._BookalopeClient__compression_lock,
+        ]
+    for lock in held:
+        lock.acquire()
+    try:
+        pid = os.fork()
+        if pid == 0:
+            ok = False
+            try:
+                with bookalope.deadline(5):
+                    ok = _get_item(client, "child") == "ok"
+            finally:
+                os._exit(0 if ok else 1)
+        # A deadlocked child is killed rather than hanging the test.
+        for _ in range(100):
+            reaped, status = os.waitpid(pid, os.WNOHANG)
+            if reaped:
+                break
+            time.sleep(0.1)
+        else:
+            os.kill(pid, 9)
+            _, status = os.waitpid(pid, 0)
+    finally:
+        for lock in held:
+            lock.release()
+    assert os.waitstatus_to_exitcode(status) == 0
+
+
+class _Redis(object):
+    """A Redis stand-in that records published messages, or fails to publish."""
+
+    def __init__(self, fail=False):
+        self.messages = []
+        self.fail = fail
+
+    def publish(self, channel, message):
+        if self.fail:
+            raise ConnectionError("Redis is down")
+        self.messages.append((channel, json.loads(message)))
+
+
+def _analysis(polls):
+    """Return a handler whose bookflow is processing for the given number of polls."""
+    steps = iter(["processing"] * polls)
+    return lambda request: (200, {"bookflow": _bookflow(next(steps, "convert"))}, None)
+
+
+def _broker(stand_in, **kwargs):
+    """Return a started broker on a local TCP port whose client polls quickly."""
+    client = _client(stand_in)
+    client._BookalopeClient__status_monitor = bookalope.StatusMonitor(client, initial_interval=0.1)
+    return client, bookalope.StatusBroker(client, 0, **kwargs).start()
+
+
+def test_broker_watch_for_redis_consumers(stand_in):
+    """A watch of the broker's process publishes the changes to Redis."""
+    stand_in.handler = _analysis(1)
+    redis = _Redis()
+    _, broker = _broker(stand_in, redis=redis)
+    broker.watch(BOOKFLOW_ID)
+    deadline = time.monotonic() + 5
+    while not any(_[1]["final"] for _ in redis.messages) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    broker.close()
+    assert [(_[1]["status"], _[1]["final"]) for _ in redis.messages] == [
+        ("processing", False), ("convert", False), ("convert", True)]
+    assert {_[0] for _ in redis.messages} == {"bookalope:status"}
+
+
+def test_broker_counts_redis_errors(stand_in):
+    """Failures to publish to Redis are counted."""
+    stand_in.handler = _analysis(0)
+    _, broker = _broker(stand_in, redis=_Redis(fail=True))
+    subscriber = bookalope.StatusSubscriber(broker.address)
+    assert subscriber.watch(BOOKFLOW_ID).result(5) == "convert"
+    subscriber.close()
+    broker.close()
+    assert broker.stats["redis_errors"] == 2
+
+
+def test_broker_requires_secret(stand_in):
+    """Subscribers without the broker's secret are refused."""
+    stand_in.handler = _analysis(0)
+    _, broker = _broker(stand_in, secret="s3cret")
+    subscriber = bookalope.StatusSubscriber(broker.address[1], secret="s3cret")
+    assert subscriber.watch(BOOKFLOW_ID).result(5) == "convert"
+    subscriber.close()
+    for secret in ("wrong", None):
+        subscriber = bookalope.StatusSubscriber(broker.address, secret=secret)
+        with pytest.raises(bookalope.BookalopeError):
+            subscriber.watch(BOOKFLOW_ID).result(5)
+        subscriber.close()
+    broker.close()
+
+
+def test_broker_subscriber_leaves_local_watchers(stand_in):
+    """A disconnecting subscriber doesn't cancel a local wait for the same bookflow."""
+    stand_in.handler = _analysis(5)
+    client, broker = _broker(stand_in)
+    local = client.status_monitor.watch(BOOKFLOW_ID)
+    subscriber = bookalope.StatusSubscriber(broker.address)
+    subscriber.watch(BOOKFLOW_ID)
+    time.sleep(0.2)
+    subscriber.close()
+    assert local.result(5) == "convert"
+    broker.close()
+
+
+def test_concurrent_conversions_keep_start_times(stand_in):
+    """Conversions started concurrently on one bookflow all get an ETA."""
+    stand_in.handler = lambda request: (201, {"status": "processing"}, None)
+    formats = ["format{}".format(_) for _ in range(16)]
+    stats = bookalope.ConversionStats(min_samples=1)
+    for format_ in formats:
+        stats.record("conversion", 10.0, format_=format_, style="default")
+    bookflow = bookalope.Bookflow(_client(stand_in, conversion_stats=stats), None, _bookflow("convert"))
+    barrier = threading.Barrier(len(formats))
+
+    def _convert(format_):
+        barrier.wait()
+        bookflow.convert(format_)
+
+    threads = [threading.Thread(target=_convert, args=(_,)) for _ in formats]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(bookflow.eta(_) is not None for _ in formats)
+
+
+# The attachment that the stand-in serves for downloads.
+_ATTACHMENT = bytes(range(256)) * 400
+
+
+def _attachment(ranges=True, digest=False, fail=0):
+    """
+    Return a handler that serves the attachment, honoring Range requests if
+    ranges is True, with a SHA-256 digest if digest is True, and dropping the
+    connection without an answer for the first `fail` requests.
+    """
+    failures = iter(range(fail))
+
+    def _handler(request):
+        if next(failures, None) is not None:
+            raise ConnectionAbortedError("Dropped")
+        headers = {"Content-Disposition": "attachment; filename=book.epub"}
+        if digest:
+            sha256 = base64.b64encode(hashlib.sha256(_ATTACHMENT).digest()).decode()
+            headers["Repr-Digest"] = "sha-256=:{}:".format(sha256)
+        match = re.match(r"bytes=(\d+)-", request.headers.get("Range") or "")
+        if ranges and match:
+            start = int(match.group(1))
+            if start >= len(_ATTACHMENT):
+                headers["Content-Range"] = "bytes */{}".format(len(_ATTACHMENT))
+                return 416, None, headers
+            headers["Content-Range"] = "bytes {}-{}/{}".format(start, len(_ATTACHMENT) - 1, len(_ATTACHMENT))
+            return 206, _ATTACHMENT[start:], headers
+        return 200, _ATTACHMENT, headers
+
+    return _handler
+
+
+def _download(stand_in, tmp_path, partial=None):
+    """Download the attachment, optionally over a partial file of an earlier call."""
+    filename = str(tmp_path / "book.epub")
+    if partial is not None:
+        with open(filename + ".part", "wb") as file_:
+            file_.write(partial)
+    size, _ = _client(stand_in).http_download("/api/bookflows/{}/download/epub".format(BOOKFLOW_ID), filename)
+    with open(filename, "rb") as file_:
+        assert file_.read() == _ATTACHMENT
+    assert size == len(_ATTACHMENT)
+    assert not os.path.exists(filename + ".part")
+    return [_[2].get("Range") for _ in stand_in.requests]
+
+
+def test_download_resumes_partial_file(stand_in, tmp_path):
+    """A partial file of an earlier, interrupted call is resumed with a Range request."""
+    stand_in.handler = _attachment()
+    assert _download(stand_in, tmp_path, _ATTACHMENT[:1000]) == ["bytes=1000-"]
+
+
+def test_download_restarts_if_range_ignored(stand_in, tmp_path):
+    """A server that ignores the Range request sends the whole file, which replaces the partial file."""
+    stand_in.handler = _attachment(ranges=False)
+    assert _download(stand_in, tmp_path, b"X" * 1000) == ["bytes=1000-"]
+
+
+def test_download_discards_stale_partial_file(stand_in, tmp_path):
+    """A resumed file that fails the digest check is downloaded again from scratch."""
+    stand_in.handler = _attachment(digest=True)
+    assert _download(stand_in, tmp_path, b"X" * 1000) == ["bytes=1000-", None]
+
+
+def test_download_keeps_partial_file_on_connection_error(stand_in, tmp_path):
+    """A connection error before any response keeps the partial file for the retry."""
+    stand_in.handler = _attachment(fail=1)
+    assert _download(stand_in, tmp_path, _ATTACHMENT[:1000]) == ["bytes=1000-", "bytes=1000-"]
+
+
+def test_download_complete_partial_file(stand_in, tmp_path):
+    """A partial file that's already complete is checked and kept."""
+    stand_in.handler = _attachment()
+    assert _download(stand_in, tmp_path, _ATTACHMENT) == ["bytes={}-".format(len(_ATTACHMENT))]
+
+
+def test_download_overlong_partial_file(stand_in, tmp_path):
+    """A partial file that's longer than the attachment is downloaded again from scratch."""
+    stand_in.handler = _attachment()
+    assert _download(stand_in, tmp_path, _ATTACHMENT + b"X") == ["bytes={}-".format(len(_ATTACHMENT) + 1), None]
+
+
+_BOOKSHELF = {"id": "shelf", "name": "Shelf", "description": "", "created": "2024-01-01"}
+_BOOK = {"id": "book", "name": "Book", "created": "2024-01-01", "bookshelf": {"id": "shelf"},
+         "bookflows": [{"id": BOOKFLOW_ID, "name": "Bookflow", "step": "convert", "credit": None}]}
+
+
+def _mirror_handler(bookshelves=(_BOOKSHELF,), books_status=200, metadata_released=None):
+    """Return a handler for the listings of a mirror sync and for the bookflow metadata."""
+    def _handler(request):
+        if request.path.startswith("/api/bookshelves"):
+            return 200, {"bookshelves": list(bookshelves)}, None
+        if request.path.startswith("/api/books"):
+            return books_status, {"books": [_BOOK]}, None
+        if metadata_released is not None:
+            metadata_released.wait(10)
+        return 200, {"bookflow": dict(_BOOK["bookflows"][0], title="Title", author="Author", isbn=None)}, None
+
+    return _handler
+
+
+def test_mirror_readable_during_sync(stand_in):
+    """The mirror answers queries while a sync waits for the server."""
+    released = threading.Event()
+    stand_in.handler = _mirror_handler(metadata_released=released)
+    mirror = bookalope.Mirror(_client(stand_in))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(mirror.sync)
+        for _ in range(100):
+            if mirror.find_books():
+                break
+            time.sleep(0.05)
+        books = mirror.find_books()
+        syncing = not future.done()
+        released.set()
+        assert future.result(10) == {"bookshelves": 1, "books": 1, "bookflows": 1, "metadata": 1}
+    assert syncing and [book["id"] for book in books] == ["book"]
+    assert mirror.find_bookflows(title="Title")
+
+
+def test_mirror_keeps_progress_of_failed_sync(stand_in):
+    """A failed listing keeps the rows written so far, and removes nothing."""
+    stand_in.handler = _mirror_handler()
+    mirror = bookalope.Mirror(_client(stand_in))
+    mirror.sync()
+    stand_in.handler = _mirror_handler(bookshelves=[dict(_BOOKSHELF, id="other")], books_status=500)
+    with pytest.raises(requests.HTTPError):
+        mirror.sync()
+    assert sorted(row["id"] for row in mirror.query("SELECT id FROM bookshelves")) == ["other", "shelf"]
+    assert [book["id"] for book in mirror.find_books()] == ["book"]
+
+
+def test_client_pool_creates_no_status_monitors():
+    """Balancing and closing a pool doesn't create a status monitor for every client."""
+    pool = bookalope.ClientPool([TOKEN, "f" * 32])
+    assert pool.least_loaded() is pool.clients[0]
+    pool.close()
+    assert not any(client.has_status_monitor for client in pool.clients)
+
+
+def test_priority_gate_reserves_interactive_slots(stand_in):
+    """Batch requests leave the reserved connections to interactive requests."""
+    released = threading.Event()
+
+    def _handler(request):
+        if request.path.startswith("/api/slow"):
+            released.wait(10)
+        return 200, {"status": "ok"}, None
+
+    stand_in.handler = _handler
+    client = _client(stand_in, max_connections=4, interactive_share=0.25)
+
+    def _slow(index):
+        with bookalope.priority("batch"):
+            return client.http_get("/api/slow/{}".format(index))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
+        futures = [executor.submit(_slow, _) for _ in range(6)]
+        for _ in range(100):
+            if len(stand_in.requests) >= 3:
+                break
+            time.sleep(0.05)
+        started = time.monotonic()
+        assert client.http_get("/api/profile") == {"status": "ok"}
+        assert time.monotonic() - started < 5
+        slow = sum(1 for _ in stand_in.requests if _[1].startswith("/api/slow"))
+        released.set()
+        assert [_.result(10) for _ in futures] == [{"status": "ok"}] * 6
+    assert slow == 3
+
+
+def test_priority_gate_holds_batch_for_waiting_interactive():
+    """A waiting interactive request gets the next free slot before any batch request."""
+    gate = bookalope._PriorityGate(2, 1)
+    assert gate.acquire("batch") and gate.acquire("interactive")
+    assert not gate.acquire("batch", blocking=False)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        waiting = executor.submit(gate.acquire, "interactive")
+        time.sleep(0.1)
+        gate.release("interactive")
+        assert waiting.result(5)
+    assert gate.used == {"interactive": 1, "batch": 1}
+    with bookalope.deadline(0.1), pytest.raises(bookalope.DeadlineExceeded):
+        gate.acquire("batch")
+
+
+def test_request_deadline(stand_in):
+    """A request that outlasts the current deadline fails with DeadlineExceeded."""
+    def _handler(request):
+        time.sleep(2)
+        return 200, {"status": "ok"}, None
+
+    stand_in.handler = _handler
+    client = _client(stand_in)
+    started = time.monotonic()
+    with bookalope.deadline(0.3), pytest.raises(bookalope.DeadlineExceeded):
+        client.http_get("/api/profile")
+    assert time.monotonic() - started < 1.5
+
+
+def test_bulk_retries_too_many_requests(stand_in):
+    """Bulk operations retry requests that were rejected with 429 after the Retry-After delay."""
+    rejected = set()
+
+    def _handler(request):
+        with stand_in.lock:
+            if request.path not in rejected:
+                rejected.add(request.path)
+                return 429, {"status": "error"}, {"Retry-After": "0.1"}
+        return 200, {"status": "ok"}, None
+
+    stand_in.handler = _handler
+    ids = ["{:032x}".format(_) for _ in range(3)]
+    results = _client(stand_in).bulk_set_credit(ids, "pro")
+    assert [_.item for _ in results] == ids and all(_.ok for _ in results)
+    assert len(stand_in.requests) == 6
+    results = _client(stand_in).bulk_set_credit(["f" * 32], "pro", retries=0)
+    assert results[0].error.response.status_code == 429
+
+
+def test_single_flight_coalesces_identical_gets(stand_in):
+    """Concurrent identical GET requests share one request to the server."""
+    released = threading.Event()
+
+    def _handler(request):
+        released.wait(10)
+        return 200, {"status": "ok"}, None
+
+    stand_in.handler = _handler
+    client = _client(stand_in)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(client.http_get, "/api/profile")
+        for _ in range(100):
+            if stand_in.requests:
+                break
+            time.sleep(0.05)
+        second = executor.submit(client.http_get, "/api/profile")
+        time.sleep(0.1)
+        released.set()
+        assert first.result(10) == second.result(10) == {"status": "ok"}
+    assert len(stand_in.requests) == 1
+
+
+def test_artifact_cache_evicts_and_invalidates():
+    """The cache evicts the least recently used artifacts first, and invalidates by bookflow."""
+    cache = bookalope.ArtifactCache(max_bytes=10)
+    cache.put(("a", "convert", "epub"), b"1234")
+    cache.put(("b", "convert", "epub"), b"1234")
+    assert cache.get(("a", "convert", "epub")) == b"1234"
+    cache.put(("c", "convert", "epub"), b"1234")
+    assert cache.get(("b", "convert", "epub")) is None
+    assert cache.size == 8
+    cache.put(("a", "cover", "image"), b"12")
+    cache.put(("d", "convert", "epub"), b"12345678901")
+    assert len(cache) == 3
+    cache.invalidate("a")
+    assert len(cache) == 1 and cache.size == 4
+    assert cache.get(("c", "convert", "epub")) == b"1234"
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Memory benchmark for the Bookalope object model. Builds a large number of Book
+instances (each with a single Bookflow) from packed book data just like
+BookalopeClient.get_books() does, and reports the memory used per object
+compared to the size of the underlying JSON. No server requests are made.
+"""
+
+import sys
+import json
+import argparse
+import tracemalloc
+import uuid
+
+import bookalope
+
+def main():
+    """
+    The main and only function. Generates packed book data, measures the memory
+    allocated by the Book and Bookflow instances built from it, and prints the
+    result.
+    """
+
+    # Handle the command line arguments.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", dest="books", type=int, default=100000, help="The number of books.")
+    args = parser.parse_args()
+
+    # Generate the packed book data as the server would return it.
+    packed_books = [
+        {
+            "id": uuid.uuid4().hex,
+            "name": f"Book {i}",
+            "created": "2020-03-15T10:16:23",
+            "bookshelf": None,
+            "bookflows": [
+                {
+                    "id": uuid.uuid4().hex,
+                    "name": "Bookflow",
+                    "step": "convert",
+                },
+            ],
+        }
+        for i in range(args.books)
+    ]
+    json_size = len(json.dumps({"books": packed_books}))
+
+    # Build the Book instances and measure the memory they allocate.
+    b_client = bookalope.BookalopeClient()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    books = [bookalope.Book(b_client, packed) for packed in packed_books]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Report the results.
+    book, bookflow = books[0], books[0].bookflows[0]
+    total = after - before
+    print(f"Books:                   {len(books)}")
+    print(f"JSON listing:            {json_size} bytes, {json_size / len(books):.1f} bytes per book")
+    print(f"Allocated:               {total} bytes, {total / len(books):.1f} bytes per book (incl. bookflow)")
+    print(f"Book instance:           {sys.getsizeof(book)} bytes, has __dict__: {hasattr(book, '__dict__')}")
+    print(f"Bookflow instance:       {sys.getsizeof(bookflow)} bytes, has __dict__: {hasattr(bookflow, '__dict__')}")
+    return 0
+
+
+if __name__ == "__main__":
+    assert sys.version_info >= (3, 6)
+    sys.exit(main())
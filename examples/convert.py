@@ -10,7 +10,6 @@ documentation of the module.
 import os
 import sys
 import argparse
-import time
 import asyncio
 
 import bookalope
@@ -30,11 +29,23 @@ def main():
     parser.add_argument("--title", dest="title", default=None, help="The title of the book.")
     parser.add_argument("--author", dest="author", default=None, help="The book author's name.")
     parser.add_argument("--cover", dest="cover", default=None, help="Cover image file.")
+    parser.add_argument("--profile", dest="profile", default=None, metavar="DIR",
+                        help="Profile the run and write the report and flame graph stacks to DIR.")
     args = parser.parse_args()
 
-    # Create a new Bookalope client to communicate with the server.
+    # If requested, profile the run: the client records the time spent in each
+    # phase of the conversion, and the whole run is wrapped in cProfile and
+    # tracemalloc while the stacks of all threads are sampled.
+    profiler = None
+    if args.profile:
+        profiler = bookalope.Profiler(cprofile=True, trace_memory=True, sample_interval=0.01)
+        profiler.start()
+
+    # Create a new Bookalope client to communicate with the server. The warm-start
+    # cache keeps the server's formats and styles on disk, so that subsequent runs
+    # don't have to query them again.
     print("Creating Bookalope client...")
-    b_client = bookalope.BookalopeClient()
+    b_client = bookalope.BookalopeClient(profiler=profiler, warm_start_cache=bookalope.WarmStartCache())
     b_client.token = args.token
 
     # To convert a document, we create a new Book first with an empty Bookflow.
@@ -61,11 +72,10 @@ def main():
         _, fname = os.path.split(doc.name)
         bookflow.set_document(fname, doc.read())
 
-    # Wait for analysis of the uploaded document to finish.
+    # Wait for analysis of the uploaded document to finish. The client's status
+    # monitor polls the server with backoff, and updates the bookflow.
     print("Waiting for bookflow to finish analyzing...")
-    while bookflow.processing:
-        time.sleep(5)
-        bookflow.update()
+    bookflow.wait_for_analysis()
     if bookflow.step == "processing_failed":
         print("Failed to analyze document, exiting")
         return 1
@@ -86,47 +96,50 @@ def main():
         """Coroutine to convert the bookflow's file to the given format."""
         print(f"Converting and downloading {format_}...")
 
-        # Get the Style instance for the default styling, test version, and trigger conversion.
+        # Get the Style instance for the default styling, and trigger conversion.
         styles = b_client.get_styles(format_)
         default_style = next(_ for _ in styles if _.short_name == "default")
-        version = "test"
-        bookflow.convert(format_, default_style, version)
-
-        # Wait for the conversion to finish.
-        while True:
-            status = bookflow.convert_status(format_, default_style, version)
-            if status == "processing":
-                await asyncio.sleep(5)
-                continue
-            if status == "ok":
-                break
+        bookflow.convert(format_, default_style)
+
+        # Wait for the conversion to finish without blocking the event loop.
+        loop = asyncio.get_running_loop()
+        status = await loop.run_in_executor(None, bookflow.wait_for_conversion, format_)
+        if status != "available":
             print(f"Conversion of {format_} failed, skipping...")
             return 1
 
         # Save the converted document.
         fname = f"{bookflow.id}.{format_}"
         with open(fname, "wb") as f:
-            fbytes = bookflow.convert_download(format_, default_style, version)
+            fbytes = bookflow.convert_download(format_)
             f.write(fbytes)
         return 0
 
-    # Convert and download the document. For every format that we download we
-    # use the 'default' styling, and we download the 'test' version to avoid
-    # charges to our credit card.
-    loop = asyncio.new_event_loop()
-    future = asyncio.gather(*[_convert_and_save(format_) for format_ in formats], loop=loop)
-    results = loop.run_until_complete(future)
-    loop.close()
+    async def _convert_all():
+        """Coroutine to convert the bookflow's file to all formats concurrently."""
+        return await asyncio.gather(*[_convert_and_save(format_) for format_ in formats])
+
+    # Convert and download the document into all formats concurrently, using the
+    # 'default' styling for each. The client's status monitor polls all of the
+    # conversions together. Because the bookflow was credited above, these are
+    # full versions; without a plan the server produces 'test' versions instead.
+    asyncio.run(_convert_all())
 
     # Delete the book and all of its bookflows.
     print("Deleting book and all bookflows...")
     book.delete()
 
+    # Write the profile report, the cProfile data and the flame graph stacks.
+    if profiler:
+        profiler.stop()
+        profiler.write(args.profile)
+        print(f"Profile written to {args.profile}")
+
     # Done.
     print("Done.")
     return 0
 
 
 if __name__ == "__main__":
-    assert sys.version_info >= (3, 6)
+    assert sys.version_info >= (3, 7)
     sys.exit(main())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Example of how to apply book metadata from an ONIX feed or a CSV export to the
+matching bookflows using the Bookalope module. Records are matched by bookflow
+id or ISBN, and only bookflows whose metadata changed are saved.
+"""
+
+import sys
+import argparse
+
+import bookalope
+
+def main():
+    """
+    The main and only function. Creates a Bookalope client, streams the given
+    feed, and applies the metadata of every record to its bookflow.
+    """
+
+    # Handle the command line arguments.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("token", help="")
+    parser.add_argument("feed", help="An ONIX (.xml, .onix) or CSV (.csv) file.")
+    parser.add_argument("--format", dest="format", choices=["onix", "csv"], default=None,
+                        help="The format of the feed; derived from the file extension by default.")
+    parser.add_argument("--mirror", dest="mirror", default=None, metavar="FILE",
+                        help="A local mirror database used to find bookflows by ISBN.")
+    parser.add_argument("--workers", dest="workers", type=int, default=8, help="The number of concurrent records.")
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true", help="Report changes without saving them.")
+    args = parser.parse_args()
+
+    # Pick the incremental parser for the feed.
+    feed_format = args.format or ("csv" if args.feed.lower().endswith(".csv") else "onix")
+    if feed_format == "csv":
+        records = bookalope.iter_csv_metadata(args.feed)
+    else:
+        records = bookalope.iter_onix_metadata(args.feed)
+
+    # Create a client and sync the metadata, optionally using a persistent mirror
+    # so that ISBN lookups only fetch what changed since the last run.
+    b_client = bookalope.BookalopeClient(token=args.token, max_connections=args.workers)
+    mirror = bookalope.Mirror(b_client, args.mirror, max_workers=args.workers) if args.mirror else None
+    metadata_sync = bookalope.MetadataSync(b_client, mirror=mirror, max_workers=args.workers)
+    results = metadata_sync.sync(records, dry_run=args.dry_run)
+
+    # Report the errors and a summary.
+    for result in results:
+        if not result.ok:
+            key = result.item.get("id") or result.item.get("isbn")
+            print(f"{key}: {result.error}", file=sys.stderr)
+    changed = sum(1 for _ in results if _.ok and _.result)
+    unchanged = sum(1 for _ in results if _.ok and not _.result)
+    failed = sum(1 for _ in results if not _.ok)
+    action = "would change" if args.dry_run else "changed"
+    print(f"{len(results)} records: {changed} {action}, {unchanged} unchanged, {failed} failed")
+    if mirror is not None:
+        mirror.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    assert sys.version_info >= (3, 6)
+    sys.exit(main())
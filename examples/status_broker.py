@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Example of how to run a status broker with the Bookalope module. The broker polls
+the server for the bookflows and conversions that its subscribers wait for, and
+publishes their changes to all of them, so that many worker processes on several
+hosts don't poll the server for the same bookflows. Workers connect with:
+
+    subscriber = bookalope.StatusSubscriber("/tmp/bookalope-status.sock")
+    status = subscriber.watch(bookflow_id, "epub").result()
+"""
+
+import sys
+import argparse
+
+import bookalope
+
+def main():
+    """
+    The main and only function. Creates a Bookalope client and serves its status
+    monitor to subscribers until interrupted.
+    """
+
+    # Handle the command line arguments.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("token", help="")
+    parser.add_argument("--socket", dest="socket", default="/tmp/bookalope-status.sock",
+                        help="The Unix socket for subscribers on this host.")
+    parser.add_argument("--listen", dest="listen", default=None, metavar="HOST:PORT",
+                        help="Listen on a TCP address instead, for subscribers on other hosts.")
+    parser.add_argument("--secret", dest="secret", default=None,
+                        help="A shared secret that subscribers must present; use it for TCP addresses.")
+    parser.add_argument("--redis", dest="redis", default=None, metavar="URL",
+                        help="Also publish all status changes to this Redis server.")
+    args = parser.parse_args()
+
+    # The address that subscribers connect to.
+    if args.listen:
+        host, _, port = args.listen.rpartition(":")
+        address = (host, int(port))
+    else:
+        address = args.socket
+
+    # Optionally publish to Redis too, which requires the redis package.
+    redis = None
+    if args.redis:
+        import redis as redis_module  # pylint: disable=import-outside-toplevel
+        redis = redis_module.Redis.from_url(args.redis)
+
+    # Create a client whose status monitor does all polling, and serve it.
+    b_client = bookalope.BookalopeClient(token=args.token)
+    broker = bookalope.StatusBroker(b_client, address, redis=redis, secret=args.secret)
+    print(f"Serving status changes on {broker.address}, press Ctrl-C to stop...")
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    broker.close()
+    print("Done.")
+    return 0
+
+
+if __name__ == "__main__":
+    assert sys.version_info >= (3, 6)
+    sys.exit(main())